@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import multiprocessing
+import socket
+import time
+from urllib.parse import parse_qs, urlencode
+
+import uvicorn
+
+FILLER_PARAGRAPH = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor ' \
+                   '<a href="https://other-{n}.com/post">incididunt</a> ut labore et dolore magna aliqua.</p>\n'
+
+
+def get_donor_hosts(hosts_count: int) -> list[str]:
+    """loopback addresses, every one of them is a separate donor host (page_url_domain) for the link checker"""
+    return [f'127.0.0.{i}' for i in range(1, hosts_count + 1)]
+
+
+def get_page_url(host: str, port: int, page_num: int, **params) -> str:
+    """url of fake donor page, the page is described by params (see fake_donor_app)"""
+    return f'http://{host}:{port}/page/{page_num}?{urlencode(params)}'
+
+
+@functools.lru_cache(maxsize=256)
+def get_page_body(page_bytes: int, anchor_position: str, href_prefix: str, hrefs_count: int, anchor: str) -> bytes:
+    """synthetic html of about page_bytes, with <a href="href_prefix<n>">anchor</a> for n in 0 .. hrefs_count - 1
+    at anchor_position (start, middle, end), without them if anchor_position is none"""
+    paragraphs_count = max(page_bytes // len(FILLER_PARAGRAPH), 1)
+    paragraphs = [FILLER_PARAGRAPH.format(n=n) for n in range(paragraphs_count)]
+    if anchor_position != 'none':
+        index = {'start': 0, 'middle': paragraphs_count // 2, 'end': paragraphs_count}[anchor_position]
+        paragraphs.insert(index, ''.join(f'<p><a href="{href_prefix}{n}">{anchor}</a></p>\n'
+                                         for n in range(hrefs_count)))
+    return ('<!DOCTYPE html><html><head><title>fake donor</title></head><body>\n'
+            + ''.join(paragraphs) + '</body></html>\n').encode('utf-8')
+
+
+async def send_response(send, status: int, body: bytes = b'', headers: list[tuple[bytes, bytes]] | None = None):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/html; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode())] + (headers or [])})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def fake_donor_app(scope, receive, send):
+    """asgi app of fake donor pages, stateless: every page is described by the query of its url
+
+    latency_ms - response delay, redirects - 301 chain length before the page,
+    status - response code of the page (403, 503 ...), timeout_s - delay before 504 (longer than checker timeout),
+    bytes, anchor_position, href_prefix, hrefs, anchor - page content (see get_page_body)"""
+    if scope['type'] != 'http':
+        return
+    params = {key: values[0] for key, values in parse_qs(scope['query_string'].decode()).items()}
+    await asyncio.sleep(int(params.get('latency_ms', 0)) / 1000)
+
+    if float(params.get('timeout_s', 0)):
+        await asyncio.sleep(float(params['timeout_s']))
+        return await send_response(send, 504)
+
+    redirects = int(params.get('redirects', 0))
+    if redirects:
+        location = f"{scope['path']}?{urlencode({**params, 'redirects': redirects - 1})}"
+        return await send_response(send, 301, headers=[(b'location', location.encode())])
+
+    status = int(params.get('status', 200))
+    if status != 200:
+        return await send_response(send, status, b'<html><body>no</body></html>', headers=[(b'retry-after', b'1')])
+
+    body = get_page_body(int(params.get('bytes', 32 * 1024)), params.get('anchor_position', 'end'),
+                         params.get('href_prefix', ''), int(params.get('hrefs', 1)), params.get('anchor', ''))
+    await send_response(send, 200, body)
+
+
+def serve_fake_donor(hosts: list[str], port: int):
+    """serve fake_donor_app on port of every one of hosts, in the calling process until it is terminated"""
+    sockets = []
+    for host in hosts:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sockets.append(sock)
+    config = uvicorn.Config(fake_donor_app, lifespan='off', log_level='warning', access_log=False,
+                            backlog=4096, timeout_keep_alive=30)
+    asyncio.run(uvicorn.Server(config).serve(sockets=sockets))
+
+
+def get_free_port(host='127.0.0.1') -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class FakeDonorServer:
+    """fake donor server in a separate process (so its cpu is not counted to the link checker),
+    listening on the same port of every one of hosts"""
+
+    def __init__(self, hosts: list[str], port: int | None = None):
+        self.hosts = hosts
+        self.port = port or get_free_port()
+        self.process: multiprocessing.Process | None = None
+
+    def __repr__(self):
+        return f"<FakeDonorServer> (hosts: {len(self.hosts)}, port: {self.port})"
+
+    def __enter__(self):
+        self.process = multiprocessing.get_context('spawn').Process(
+            target=serve_fake_donor, args=(self.hosts, self.port), daemon=True)
+        self.process.start()
+        self.wait_started()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join(timeout=5)
+
+    def wait_started(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection((self.hosts[-1], self.port), timeout=1).close()
+                return
+            except OSError:
+                if time.monotonic() >= deadline or not self.process.is_alive():
+                    raise RuntimeError(f'{self} is not started')
+                time.sleep(0.05)
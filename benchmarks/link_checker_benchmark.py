@@ -0,0 +1,220 @@
+"""
+throughput benchmark of LinkChecker.check_links against local fake donor server (see fake_donor.py)
+
+python -m benchmarks.link_checker_benchmark --links 5000 --hosts 50 --page-bytes 65536 --latency-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+from collections import OrderedDict
+
+import httpx
+import psutil
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, sessionmaker
+
+from benchmarks.fake_donor import FakeDonorServer, get_donor_hosts, get_page_url
+from core.config import settings
+from database import Base
+from database.models import init_models
+from database.models.link import LinkModel
+from database.models.link_url_domain import LinkUrlDomainModel
+from database.models.page_url_domain import PageUrlDomainModel
+from services.link_checker.client_pool import client_registry
+from services.link_checker.link_checker import LinkChecker, get_link_chunks
+from services.link_checker.page_parser import shutdown_parse_executor
+from services.link_checker.proxy_manager import ProxyManager
+from services.link_checker.rate_limiter import HostRateLimiter
+
+LINK_URL_DOMAIN_NAME = 'acceptor.com'
+ANCHOR = 'fake acceptor'
+
+
+class BenchmarkLinkChecker(LinkChecker):
+    """LinkChecker measuring duration of every page check (fetch and parse, without waiting for its turn),
+    playwright rechecks (of 403, 503 and pages without the link) are skipped unless with_playwright"""
+
+    def __init__(self, *args, with_playwright=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.with_playwright = with_playwright
+        self.link_latencies: list[float] = []
+
+    async def get_page_link_check_sers(self, client, links, **kwargs):
+        started_at = time.monotonic()
+        link_check_sers = await super().get_page_link_check_sers(client, links, **kwargs)
+        self.link_latencies.extend([time.monotonic() - started_at] * len(links))
+        return link_check_sers
+
+    async def check_links_with_playwright(self):
+        if self.with_playwright:
+            await super().check_links_with_playwright()
+
+
+def get_page_params(rnd: random.Random, args: argparse.Namespace, timeout_s: float) -> dict:
+    """query params of fake donor page of one of kinds: redirected, forbidden, throttled, timed out,
+    without the link or ordinary one, by their shares in args"""
+    params = {'bytes': args.page_bytes, 'anchor_position': args.anchor_position,
+              'latency_ms': rnd.randint(0, 2 * args.latency_ms)}
+    kind = rnd.random()
+    for share, kind_params in (
+            (args.redirect_share, {'redirects': args.redirects}),
+            (args.forbidden_share, {'status': 403}),
+            (args.throttled_share, {'status': 503}),
+            (args.timeout_share, {'timeout_s': timeout_s + 1}),
+            (args.missing_share, {'anchor_position': 'none'}),
+    ):
+        if kind < share:
+            return {**params, **kind_params}
+        kind -= share
+    return params
+
+
+def create_links(session: Session, args: argparse.Namespace, port: int, timeout_s: float) -> int:
+    """links placed on fake donor pages, args.links_per_page links per page, returns count of links"""
+    rnd = random.Random(args.seed)
+    hosts = get_donor_hosts(args.hosts)
+    pudomain_ids = {}
+    for host in hosts:
+        pudomain = PageUrlDomainModel(name=host)
+        session.add(pudomain)
+        session.flush()
+        pudomain_ids[host] = pudomain.id
+    ludomain = LinkUrlDomainModel(name=LINK_URL_DOMAIN_NAME)
+    session.add(ludomain)
+    session.flush()
+
+    links = []
+    for page_num in range(args.links // args.links_per_page):
+        host = hosts[page_num % len(hosts)]
+        page_params = get_page_params(rnd, args, timeout_s)
+        href_prefix = f'https://{LINK_URL_DOMAIN_NAME}/landing-{page_num}-'
+        page_url = get_page_url(host, port, page_num, href_prefix=href_prefix, hrefs=args.links_per_page,
+                                anchor=ANCHOR, **page_params)
+        for link_num in range(args.links_per_page):
+            links.append({'page_url': page_url, 'anchor': ANCHOR, 'link_url': f'{href_prefix}{link_num}',
+                          'page_url_domain_id': pudomain_ids[host], 'link_url_domain_id': ludomain.id})
+    session.execute(sa.insert(LinkModel.__table__), links)
+    session.commit()
+    return len(links)
+
+
+def get_cpu_seconds(process: psutil.Process, exclude_pids: set[int]) -> float:
+    """cpu time of process and its children (parse pool), but not of exclude_pids ones (fake donor server)"""
+    processes = [process] + [child for child in process.children(recursive=True) if child.pid not in exclude_pids]
+    cpu_seconds = 0.0
+    for p in processes:
+        try:
+            cpu_times = p.cpu_times()
+        except psutil.NoSuchProcess:
+            continue
+        cpu_seconds += cpu_times.user + cpu_times.system
+    return cpu_seconds
+
+
+async def check_links(session: Session, args: argparse.Namespace, timeout_s: float) -> BenchmarkLinkChecker:
+    links = list(itertools.chain.from_iterable(get_link_chunks(session)))
+    linkchecker = BenchmarkLinkChecker(
+        session,
+        concurrency=args.concurrency,
+        concurrency_per_host=args.concurrency_per_host,
+        rate_limiter=HostRateLimiter(rate=args.host_rate),
+        # without proxies timed out pages are not rechecked with them
+        proxy_manager=ProxyManager(OrderedDict()),
+        with_playwright=args.with_playwright,
+    )
+    try:
+        await linkchecker.check_links(links, timeout=httpx.Timeout(timeout_s, pool=None))
+    finally:
+        await client_registry.aclose()
+    return linkchecker
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    """create args.links links on fake donor pages in an empty db, check them once, returns measurements"""
+    init_models()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = args.database_url or f'sqlite:///{os.path.join(tmp_dir, "link_checker_benchmark.db")}'
+        connect_args = {'check_same_thread': False} if database_url.startswith('sqlite') else {}
+        engine = sa.create_engine(database_url, connect_args=connect_args)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        try:
+            if session.query(LinkModel.id).first() is not None:
+                raise RuntimeError(f'{database_url} already has links, benchmark needs an empty db')
+            timeout_s = args.timeout_s
+            with FakeDonorServer(get_donor_hosts(args.hosts)) as server:
+                links_count = create_links(session, args, server.port, timeout_s)
+                process = psutil.Process()
+                cpu_seconds_before = get_cpu_seconds(process, {server.process.pid})
+                started_at = time.monotonic()
+                linkchecker = asyncio.run(check_links(session, args, timeout_s))
+                duration = time.monotonic() - started_at
+                cpu_seconds = get_cpu_seconds(process, {server.process.pid}) - cpu_seconds_before
+            status_counts = dict(session.query(LinkModel.link_check_last_status, sa.func.count(LinkModel.id))
+                                 .group_by(LinkModel.link_check_last_status).all())
+        finally:
+            session.close()
+            shutdown_parse_executor()
+            engine.dispose()
+
+    latencies = sorted(linkchecker.link_latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'links': links_count,
+        'duration_s': duration,
+        'links_per_s': links_count / duration,
+        'latency_p50_ms': percentiles[49] * 1000,
+        'latency_p99_ms': percentiles[98] * 1000,
+        'cpu_s': cpu_seconds,
+        'cpu_percent': cpu_seconds / duration * 100,
+        # ru_maxrss is in kilobytes on linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'statuses': status_counts,
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='LinkChecker.check_links throughput against local fake donors')
+    parser.add_argument('--links', type=int, default=2000)
+    parser.add_argument('--links-per-page', type=int, default=1)
+    parser.add_argument('--hosts', type=int, default=50, help='donor hosts, 127.0.0.1 .. 127.0.0.<hosts>')
+    parser.add_argument('--page-bytes', type=int, default=32 * 1024)
+    parser.add_argument('--anchor-position', choices=('start', 'middle', 'end'), default='end')
+    parser.add_argument('--latency-ms', type=int, default=20, help='mean response latency, uniform 0 .. 2x')
+    parser.add_argument('--redirects', type=int, default=2, help='301 chain length of redirected pages')
+    parser.add_argument('--redirect-share', type=float, default=0.05)
+    parser.add_argument('--forbidden-share', type=float, default=0.02, help='403 pages')
+    parser.add_argument('--throttled-share', type=float, default=0.0, help='503 pages with Retry-After: 1')
+    parser.add_argument('--timeout-share', type=float, default=0.0, help='pages not answered in --timeout-s')
+    parser.add_argument('--missing-share', type=float, default=0.02, help='pages without the link')
+    parser.add_argument('--timeout-s', type=float, default=5.0)
+    parser.add_argument('--concurrency', type=int, default=settings.LINK_CHECKER_CONCURRENCY)
+    parser.add_argument('--concurrency-per-host', type=int, default=settings.LINK_CHECKER_CONCURRENCY_PER_HOST)
+    parser.add_argument('--host-rate', type=float, default=settings.LINK_CHECKER_HOST_RATE)
+    parser.add_argument('--with-playwright', action='store_true', help='recheck 403, 503 and missing with playwright')
+    parser.add_argument('--database-url', help='empty db to create links in, temporary sqlite file by default')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    results = run_benchmark(args)
+    print(f'links:       {results["links"]}')
+    print(f'duration:    {results["duration_s"]:.2f} s')
+    print(f'throughput:  {results["links_per_s"]:.1f} links/s')
+    print(f'latency p50: {results["latency_p50_ms"]:.1f} ms')
+    print(f'latency p99: {results["latency_p99_ms"]:.1f} ms')
+    print(f'cpu:         {results["cpu_s"]:.2f} s ({results["cpu_percent"]:.0f}%)')
+    print(f'max rss:     {results["max_rss_mb"]:.1f} MB')
+    print(f'statuses:    {results["statuses"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,37 @@
+import logging
 import os
 
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_ready
 
 from core.config import settings
+from core.metrics import mark_metrics_process_dead, start_metrics_server
+
+logger = logging.getLogger(name='celery_app')
 
 celery_app = Celery(__name__, broker=settings.CELERY_BROKER_URL, backend=settings.CELERY_RESULT_BACKEND)
 celery_app.conf.beat_schedule = settings.CELERY_BEAT_SCHEDULE
 celery_app.conf.timezone = settings.CELERY_TIMEZONE
+celery_app.conf.task_default_queue = settings.CELERY_TASK_DEFAULT_QUEUE
+celery_app.conf.task_routes = settings.CELERY_TASK_ROUTES
+
+
+@worker_ready.connect
+def start_worker_metrics_server(**kwargs):
+    """serve prometheus metrics of worker on CELERY_WORKER_METRICS_PORT,
+    metrics of its pool processes are there only with PROMETHEUS_MULTIPROC_DIR.
+    the port is not bound if it is taken (by another worker on the same host), the worker runs without it"""
+    if settings.CELERY_WORKER_METRICS_PORT:
+        try:
+            start_metrics_server(settings.CELERY_WORKER_METRICS_PORT)
+        except OSError as e:
+            logger.error(f'start_worker_metrics_server: port {settings.CELERY_WORKER_METRICS_PORT} is not bound, '
+                         f'{e.__class__.__name__} {e}')
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_metrics_dead(pid=None, **kwargs):
+    mark_metrics_process_dead(pid)
 
 
 def import_celery_tasks_from_services():
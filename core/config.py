@@ -70,14 +70,36 @@ class Settings(BaseSettings):
     CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
     CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
     CELERY_TIMEZONE = os.getenv('CELERY_TIMEZONE', 'Europe/Moscow')
+    # link checks go to their own queues, every queue is consumed by its own workers (supervisord.conf),
+    # so single link checks from the ui don't wait behind bulk runs, the rest goes to the default queue
+    CELERY_TASK_DEFAULT_QUEUE = 'celery'
+    CELERY_QUEUE_INTERACTIVE = 'interactive'
+    CELERY_QUEUE_UPLOADS = 'uploads'
+    CELERY_QUEUE_NIGHTLY = 'nightly'
+    CELERY_QUEUE_PLAYWRIGHT = 'playwright'
+    CELERY_TASK_ROUTES = {
+        'check_link_by_id': {'queue': CELERY_QUEUE_INTERACTIVE},
+        'check_links_from_list': {'queue': CELERY_QUEUE_UPLOADS},
+        'create_links_from_uploaded_file_archive': {'queue': CELERY_QUEUE_UPLOADS},
+        'check_links_all': {'queue': CELERY_QUEUE_NIGHTLY},
+        'check_links_per_year': {'queue': CELERY_QUEUE_NIGHTLY},
+        'check_every_day': {'queue': CELERY_QUEUE_NIGHTLY},
+        'check_every_day_id_range': {'queue': CELERY_QUEUE_NIGHTLY},
+        'check_links_done': {'queue': CELERY_QUEUE_NIGHTLY},
+        'dispatch_due_links': {'queue': CELERY_QUEUE_NIGHTLY},
+        'check_monthly': {'queue': CELERY_QUEUE_PLAYWRIGHT},
+        'check_links_from_list_playwright': {'queue': CELERY_QUEUE_PLAYWRIGHT},
+    }
+    # http port of prometheus metrics of celery worker (0 - not served), every worker on a host needs its own one.
+    # workers sharing PROMETHEUS_MULTIPROC_DIR with the api (supervisord.conf) are served by its /metrics instead
+    CELERY_WORKER_METRICS_PORT = int(os.getenv('CELERY_WORKER_METRICS_PORT', 0))
+    # dir shared by processes (gunicorn workers, celery worker processes) to collect their prometheus metrics,
+    # without it every process serves only its own metrics
+    PROMETHEUS_MULTIPROC_DIR: str | None = os.getenv('PROMETHEUS_MULTIPROC_DIR')
     CELERY_BEAT_SCHEDULE = {
-        'check_every_day': {
-            'task': 'check_every_day',
-            'schedule': crontab(hour=1, minute=0, day_of_week='1,2,3,4,5,6,0'),
-        },
-        'check_monthly': {
-            'task': 'check_monthly',
-            'schedule': crontab(hour=5, minute=0, day_of_month='1'),
+        'dispatch_due_links': {
+            'task': 'dispatch_due_links',
+            'schedule': crontab(minute='*/10'),
         },
         'prepare_and_send_linkers_report_daily_messages': {
             'task': 'prepare_and_send_linkers_report_daily_messages',
@@ -115,8 +137,81 @@ class Settings(BaseSettings):
     )
 
     LINK_CHECKER_CHUNK_SIZE = 100
+    # links of one check_every_day subtask (id range), checked by LINK_CHECKER_CHUNK_SIZE chunks
+    LINK_CHECKER_TASK_CHUNK_SIZE = 2000
+    # names of celery tasks sent by check_links_done, when all subtasks of check_every_day
+    # or of one dispatch_due_links run are done
+    CHECK_LINKS_DONE_TASKS: list[str] = []
+    # max links checked at once per LinkChecker, and max of them going to the same donor host
+    LINK_CHECKER_CONCURRENCY = 20
+    LINK_CHECKER_CONCURRENCY_PER_HOST = 2
+    # requests per second to one donor host (page_url_domain), halved on 429/503 down to LINK_CHECKER_HOST_RATE_MIN
+    LINK_CHECKER_HOST_RATE = 5
+    LINK_CHECKER_HOST_RATE_MIN = 0.2
+    # seconds donor host is not requested after 429/503 without Retry-After, doubled on every next one,
+    # page is requested again up to LINK_CHECKER_THROTTLED_RETRIES times if the wait is not over LINK_CHECKER_HOST_BACKOFF_MAX
+    LINK_CHECKER_HOST_BACKOFF = 2
+    LINK_CHECKER_HOST_BACKOFF_MAX = 60
+    LINK_CHECKER_THROTTLED_RETRIES = 2
+    # timed out pages are requested through LINK_CHECKER_PROXY_RACE_SIZE best proxies at once, the first answer is taken
+    LINK_CHECKER_PROXY_RACE_SIZE = 3
+    # weight of the last request in proxy success rate and latency moving averages
+    LINK_CHECKER_PROXY_EWMA_ALPHA = 0.3
+    # proxy failed LINK_CHECKER_PROXY_DEAD_FAILURES times in a row is skipped for LINK_CHECKER_PROXY_COOLDOWN seconds
+    LINK_CHECKER_PROXY_DEAD_FAILURES = 3
+    LINK_CHECKER_PROXY_COOLDOWN = 300
+    # redis of in-flight registry shared by workers (local per process registry if it is not a redis url)
+    LINK_CHECKER_INFLIGHT_REDIS_URL: str | None = os.getenv('LINK_CHECKER_INFLIGHT_REDIS_URL', os.getenv('CELERY_BROKER_URL'))
+    # seconds link being checked is not checked by other tasks (in case its check never ends, it expires),
+    # links checked within LINK_CHECKER_RESULT_TTL seconds are not checked again by bulk checks
+    LINK_CHECKER_INFLIGHT_TTL = 30 * 60
+    LINK_CHECKER_RESULT_TTL = 10 * 60
+    # seconds check_link_by_id of the link already in flight is put off for, to check it after that check is done
+    LINK_CHECKER_INFLIGHT_RECHECK_COUNTDOWN = 10
+    # seconds idle keep-alive connections of worker's httpx clients are kept open
+    LINK_CHECKER_KEEPALIVE_EXPIRY = 30
+    # max bytes of page body read by httpx, the rest is dropped
+    LINK_CHECKER_MAX_PAGE_BYTES = 10 * 1024 * 1024
+    # how page html is parsed: 'scanner' - one pass LinkScanner, 'soup' - full BeautifulSoup tree
+    LINK_CHECKER_PAGE_PARSER = 'scanner'
+    # processes of worker's page parsing billiard pool (0 - parse right in the event loop), started with the first big page,
+    # pages smaller than LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES are parsed in the loop anyway
+    LINK_CHECKER_PARSE_PROCESSES = 2
+    LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES = 64 * 1024
+    # seconds page is awaited from parsing pool, its process could die while parsing it
+    LINK_CHECKER_PARSE_TIMEOUT = 60
+    # green httpx linkcheck is carried forward (check_mode 'cache') if its page is not changed since the last check:
+    # response is 304 to If-None-Match / If-Modified-Since, or page content has the same hash
+    LINK_CHECKER_CONDITIONAL_RECHECKS = True
     PLAYWRIGHT_LINK_CHUNK_SIZE = 5
+    # browser context of worker's playwright browser is recycled after this pages count or RAM memory % used
+    PLAYWRIGHT_CONTEXT_MAX_PAGES = 20
+    PLAYWRIGHT_MAX_RAM_PERCENT = 80
+    # how playwright waits for page to be rendered after load:
+    # 'anchor' - until <a> with link_url href appears (polling every PLAYWRIGHT_WAIT_POLLING ms),
+    # 'networkidle' - until page network is idle,
+    # but not longer than PLAYWRIGHT_WAIT_TIMEOUT ms
+    PLAYWRIGHT_WAIT_MODE = 'anchor'
+    PLAYWRIGHT_WAIT_POLLING = 100
+    PLAYWRIGHT_WAIT_TIMEOUT = 15000
     OLD_LINKCHECKS_DAYS = 30
+    # links are rechecked every LINK_SCHEDULER_INTERVAL_MIN_HOURS (just flipped status)
+    # .. LINK_SCHEDULER_INTERVAL_MAX_HOURS (stable green, old, cheap, on a stable donor)
+    LINK_SCHEDULER_INTERVAL_MIN_HOURS = 1
+    LINK_SCHEDULER_INTERVAL_MAX_HOURS = 24 * 7
+    # .. LINK_SCHEDULER_PLAYWRIGHT_INTERVAL_MAX_HOURS for green links of the last check with playwright (the costliest)
+    LINK_SCHEDULER_PLAYWRIGHT_INTERVAL_MAX_HOURS = 24 * 30
+    # weight of the last check in moving average of link status flips
+    LINK_SCHEDULER_FLIP_RATE_ALPHA = 0.3
+    # risk of not green links, 0.4 keeps them about daily
+    LINK_SCHEDULER_NOT_GREEN_RISK = 0.4
+    # links younger than LINK_SCHEDULER_NEW_LINK_DAYS are riskier the younger they are
+    LINK_SCHEDULER_NEW_LINK_DAYS = 30
+    # link of LINK_SCHEDULER_PRICE_SCALE price gets half of the price risk boost
+    LINK_SCHEDULER_PRICE_SCALE = 100
+    # max links sent to check by one dispatch_due_links, dispatched links are not due again for lease hours
+    LINK_SCHEDULER_DISPATCH_MAX_LINKS = 20000
+    LINK_SCHEDULER_DISPATCH_LEASE_HOURS = 6
 
     BUSINESS_DAYS_TO_ADD_SHORT = 3
     BUSINESS_DAYS_TO_ADD_LONG = 5
@@ -124,6 +219,11 @@ class Settings(BaseSettings):
     CONTENT_AUTHOR_MONTH_WORDS_QTY_PLAN = 30000
 
     SSL_EXPIRATION_DAYS = 30
+    # max hosts probed for ssl certificate at once
+    SSL_CHECKER_CONCURRENCY = 20
+    # days ssl expiration date of page_url_domain is taken from cache instead of probing,
+    # certificates expiring within SSL_EXPIRATION_DAYS are probed every time
+    SSL_CACHE_TTL_DAYS = 7
 
     NOTIFICATIONS_HOURS_CONTENT_AUTHORS_TODO = [7, 11, 15, 19]
     NOTIFICATIONS_HOURS_CONTENT_AUTHORS_INEDIT = [7, 9, 11, 13, 15, 17, 19, 21]
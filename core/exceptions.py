@@ -119,6 +119,13 @@ class CheckWithPlaywrightException(Exception):
         self.response_code = response_code
 
 
+class PageThrottledException(Exception):
+    def __init__(self, message, response_code, retry_delay):
+        super().__init__(message)
+        self.response_code = response_code
+        self.retry_delay = retry_delay
+
+
 class AcceptorNotFoundException(Exception):
     def __init__(self, message, response_code):
         super().__init__(message)
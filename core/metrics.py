@@ -0,0 +1,74 @@
+import os
+import time
+from contextlib import contextmanager
+
+from core.config import settings
+
+# prometheus_client picks multiprocess mode by PROMETHEUS_MULTIPROC_DIR when it is imported, the dir must exist
+if settings.PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server
+)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# stages of one page (or one host for ssl_probe): connect, tls_handshake, ttfb, body_download, parse, match, ssl_probe
+LINK_CHECKER_STAGE_SECONDS = Histogram(
+    'link_checker_stage_seconds', 'seconds of link check stages of one page', ['stage'], buckets=STAGE_BUCKETS)
+# stages of one chunk of links: domain_resolution, fetch, db_write, ssl_probe
+LINK_CHECKER_CHUNK_STAGE_SECONDS = Histogram(
+    'link_checker_chunk_stage_seconds', 'seconds of link check stages of one chunk of links', ['stage'],
+    buckets=STAGE_BUCKETS)
+LINK_CHECKER_LINKCHECKS = Counter(
+    'link_checker_linkchecks', 'linkchecks created by link checker', ['status', 'check_mode'])
+
+
+@contextmanager
+def observe_seconds(histogram: Histogram, stage: str):
+    """observe seconds of the block in histogram for stage, also when it raises"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(stage).observe(time.perf_counter() - started_at)
+
+
+def count_linkchecks(linkchecks):
+    """count linkchecks (serializers or rows with status and check_mode) by status and check_mode"""
+    for linkcheck in linkchecks:
+        LINK_CHECKER_LINKCHECKS.labels(linkcheck.status, linkcheck.check_mode or 'httpx').inc()
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """registry of metrics of this process,
+    or of all processes writing to PROMETHEUS_MULTIPROC_DIR (gunicorn workers, celery worker processes)"""
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def get_metrics_latest() -> bytes:
+    """get_metrics_registry in prometheus text format"""
+    return generate_latest(get_metrics_registry())
+
+
+def start_metrics_server(port: int):
+    """serve get_metrics_registry on http port in a thread of this process"""
+    start_http_server(port, registry=get_metrics_registry())
+
+
+def mark_metrics_process_dead(pid: int):
+    """drop live metrics (gauges) of finished process pid, its counters and histograms are kept"""
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
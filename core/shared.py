@@ -7,6 +7,7 @@ import sqlalchemy as sa
 from sqlalchemy.orm import Session, Query
 from sqlalchemy.sql import and_
 
+from core.config import settings
 from core.enums import OrderEnum
 from core.exceptions import UnauthorizedException
 from database import Base
@@ -40,6 +41,27 @@ def chunks_generator(lst, chunk_size):
         yield lst[i:i + chunk_size]
 
 
+def keyset_chunks_generator(query: Query, key: sa.Column, chunk_size):
+    """Yield chunk_sized chunks of query rows ordered by unique key column,
+    every chunk is selected by its own query after the key of the previous chunk (keyset pagination),
+    so rows are never loaded all at once"""
+    last_key = None
+    while True:
+        chunk_query = query if last_key is None else query.filter(key > last_key)
+        chunk = chunk_query.order_by(key).limit(chunk_size).all()
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_key = getattr(chunk[-1], key.key)
+
+
+def keyset_ranges_generator(query: Query, key: sa.Column, chunk_size):
+    """Yield (first key, last key) of every chunk of keyset_chunks_generator, only keys are selected"""
+    for chunk in keyset_chunks_generator(query.with_entities(key), key, chunk_size):
+        yield getattr(chunk[0], key.key), getattr(chunk[-1], key.key)
+
+
 def normalize(string: str) -> str:
     """
     re.sub for:
@@ -165,15 +187,40 @@ def paginate_query(Model: Base, query: Query, order_by: str, order: OrderEnum, p
     return query
 
 
-def update_links(session: Session, links: list[LinkModel], linkchecks: list[LinkCheckModel]):
-    for link in links:
-        link_check = next((lc for lc in linkchecks if lc.link_id == link.id), None)
-        link.link_check_last_id = link_check.id
-        link.link_check_last_status = link_check.status
-        link.link_check_last_result_message = link_check.result_message
-        link.link_check_last_check_mode = link_check.check_mode
-        link.link_check_last_created_at = link_check.created_at
-    session.commit()
+# columns of linkcheck denormalized to link.link_check_last_*
+LINK_CHECK_LAST_COLUMNS = ('id', 'status', 'result_message', 'check_mode', 'created_at')
+
+
+def update_links(session: Session, linkchecks: list[sa.engine.Row]):
+    """set link.link_check_last_* of links of linkchecks (rows of link_id and LINK_CHECK_LAST_COLUMNS)
+    with one UPDATE link ... FROM (VALUES ...), without commit
+
+    dialects without UPDATE ... FROM (VALUES) (sqlite) update with executemany UPDATE by link id"""
+    if not linkchecks:
+        return
+    link_table = LinkModel.__table__
+    if session.bind.dialect.name == 'postgresql':
+        link_check_last = sa.values(
+            sa.column('link_id', sa.Integer),
+            *[sa.column(name, LinkCheckModel.__table__.c[name].type) for name in LINK_CHECK_LAST_COLUMNS],
+            name='link_check_last'
+        ).data([(linkcheck.link_id, *[getattr(linkcheck, name) for name in LINK_CHECK_LAST_COLUMNS]) for linkcheck in linkchecks])
+        session.execute(
+            sa.update(link_table)
+            .where(link_table.c.id == link_check_last.c.link_id)
+            .values({f'link_check_last_{name}': link_check_last.c[name] for name in LINK_CHECK_LAST_COLUMNS})
+        )
+    else:
+        session.execute(
+            sa.update(link_table)
+            .where(link_table.c.id == sa.bindparam('b_link_id'))
+            .values({f'link_check_last_{name}': sa.bindparam(f'b_{name}') for name in LINK_CHECK_LAST_COLUMNS}),
+            [
+                {'b_link_id': linkcheck.link_id,
+                 **{f'b_{name}': getattr(linkcheck, name) for name in LINK_CHECK_LAST_COLUMNS}}
+                for linkcheck in linkchecks
+            ]
+        )
 
 
 def get_next_proxy(
@@ -239,12 +286,20 @@ def get_proxy_for_playwright(proxies_dict):
     return proxy
 
 
+def get_proxy_key(proxies_dict: dict | None) -> str | None:
+    # return 'http://10.0.2.3:3128' from proxies dict or None if no proxy
+    return proxies_dict.get('http://') if proxies_dict else None
+
+
 def get_visit_from(current_proxy: tuple | None = None) -> str | None:
     # return str from current_proxy tuple or None if current_proxy is None
     return current_proxy[0] if current_proxy is not None else None
 
 
 LIMITS_5 = httpx.Limits(max_connections=5)
+LIMITS_LINK_CHECKER = httpx.Limits(max_connections=settings.LINK_CHECKER_CONCURRENCY,
+                                   max_keepalive_connections=settings.LINK_CHECKER_CONCURRENCY,
+                                   keepalive_expiry=settings.LINK_CHECKER_KEEPALIVE_EXPIRY)
 TIMEOUT_2 = httpx.Timeout(connect=2, read=2, write=2, pool=None)
 TIMEOUT_5 = httpx.Timeout(connect=5, read=5, write=5, pool=None)
 TIMEOUT_30 = httpx.Timeout(connect=30, read=30, write=30, pool=None)
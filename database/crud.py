@@ -1,4 +1,4 @@
-from typing import Type
+from typing import Iterable, Type
 
 import fastapi as fa
 import sqlalchemy as sa
@@ -103,6 +103,22 @@ def create_many(db: Session, Model: Type[Base], serializers: list[BaseModel]) ->
     return obj_list
 
 
+def insert_many(db: Session, Model: Type[Base], serializers: list[BaseModel], *returning: sa.Column
+                ) -> list[sa.engine.Row]:
+    """insert rows of serializers with one INSERT ... RETURNING, without creating orm objects and without commit,
+    returns rows of returning columns of inserted rows
+
+    dialects without RETURNING (sqlite) insert row by row and select returning columns after"""
+    if not serializers:
+        return []
+    table = Model.__table__
+    values = [serializer.dict() for serializer in serializers]
+    if db.bind.dialect.full_returning:
+        return db.execute(table.insert().values(values).returning(*returning)).all()
+    ids = [db.execute(table.insert().values(value)).inserted_primary_key[0] for value in values]
+    return db.execute(sa.select(*returning).where(table.c.id.in_(ids)).order_by(table.c.id)).all()
+
+
 def get_or_create(db: Session, Model: Type[Base], serializer: BaseModel) -> Base:
     serializer_data = jsonable_encoder(serializer)
     model_obj = db.query(Model).filter_by(**serializer_data).first()
@@ -126,6 +142,26 @@ def get_or_create_by_name(session: Session, Model: Type[Base], name: str) -> (Ba
     return model_obj, created
 
 
+def get_or_create_many_by_name(session: Session, Model: Type[Base], names: Iterable[str]
+                               ) -> tuple[dict[str, Base], set[str]]:
+    """objects of Model for all names with one SELECT, missing ones are inserted with one executemany INSERT
+    (and selected after), without commit
+
+    returns (name: model_obj) and names of created ones"""
+    names = set(names)
+    if not names:
+        return {}, set()
+    model_objs = {}
+    for model_obj in session.query(Model).filter(Model.name.in_(names)).order_by(Model.id):
+        model_objs.setdefault(model_obj.name, model_obj)
+    created_names = names - model_objs.keys()
+    if created_names:
+        session.execute(Model.__table__.insert(), [{'name': name} for name in created_names])
+        for model_obj in session.query(Model).filter(Model.name.in_(created_names)).order_by(Model.id):
+            model_objs.setdefault(model_obj.name, model_obj)
+    return model_objs, created_names
+
+
 def update(db: Session, model_obj: Base, serializer: BaseModel | dict) -> Base:
     """bug of fastapi.encoders.jsonable_encoder with sqlalchemy.ext.hybrid.hybrid_property,
     that's why we should cut leading '_' in model_obj_data_field"""
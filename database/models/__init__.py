@@ -1,6 +1,7 @@
 # from sqlalchemy.orm import mapper
 
-from database.models import user, content_data_dashboard, link, link_check, message, link_url_domain, page_url_domain
+from database.models import user, content_data_dashboard, link, link_check, message, link_url_domain, page_url_domain, \
+    link_schedule
 
 
 def init_models():
@@ -9,6 +10,7 @@ def init_models():
     from database.models import tag
     from database.models import link
     from database.models import link_check
+    from database.models import link_schedule
     from database.models import link_url_domain
     from database.models import page_url_domain
     from database.models import message
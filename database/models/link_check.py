@@ -25,6 +25,12 @@ class LinkCheckModel(IdentifiedCreatedUpdated, Base):
     link_url_others_count = sa.Column(sa.Integer)
     status = sa.Column(sa.String(10), index=True)
     check_mode = sa.Column(sa.String(10), nullable=True, index=True)
+    # validators of the checked page, sent back on the next check as conditional request headers
+    response_etag = sa.Column(sa.String(255), nullable=True)
+    response_last_modified = sa.Column(sa.String(64), nullable=True)
+    content_hash = sa.Column(sa.String(40), nullable=True)
+    # hash of link_url, anchor and domain names the page was matched with, results are carried forward only to them
+    match_spec_hash = sa.Column(sa.String(40), nullable=True)
 
     link_id = sa.Column(sa.Integer, sa.ForeignKey('link.id'))
     link = relationship("LinkModel", cascade='all,delete', back_populates="link_checks",
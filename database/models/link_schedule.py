@@ -0,0 +1,17 @@
+import sqlalchemy as sa
+
+from database import IdentifiedCreatedUpdated, Base
+
+
+class LinkScheduleModel(IdentifiedCreatedUpdated, Base):
+    __tablename__ = 'link_schedule'
+
+    link_id = sa.Column(sa.Integer, sa.ForeignKey('link.id', ondelete='CASCADE'), nullable=False, unique=True)
+    next_check_at = sa.Column(sa.DateTime, nullable=False, index=True)
+    check_interval_hours = sa.Column(sa.Float, nullable=True)
+    # moving average of status flips per check, 0 - never flips, 1 - flips on every check
+    status_flip_rate = sa.Column(sa.Float, nullable=False, default=0, server_default='0')
+    last_status = sa.Column(sa.String(10), nullable=True)
+
+    def __repr__(self):
+        return f"<LinkScheduleModel> ({self.link_id=:}, {self.next_check_at=:}, {self.check_interval_hours=:})"
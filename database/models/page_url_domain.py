@@ -1,5 +1,3 @@
-from statistics import mean
-
 import sqlalchemy as sa
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
@@ -19,7 +17,14 @@ class PageUrlDomainModel(IdentifiedCreatedUpdated, Base):
     link_dr_last = sa.Column(sa.Numeric(precision=10, scale=2))
     link_created_at_last = sa.Column(sa.DateTime)
     link_price_avg = sa.Column(sa.Numeric(precision=10, scale=2))
+    # link_price_avg is link_price_sum / link_price_count,
+    # link aggregates are maintained by scripts/postgres/triggers_update_page_url_domain_link_aggregates.sql
+    link_price_sum = sa.Column(sa.Numeric(precision=14, scale=2), nullable=False, default=0, server_default='0')
+    link_price_count = sa.Column(sa.Integer, nullable=False, default=0, server_default='0')
     last_month_visits = sa.Column(sa.String(20))
+    # cache of ssl certificate probe of the domain
+    ssl_expiration_date = sa.Column(sa.DateTime)
+    ssl_checked_at = sa.Column(sa.DateTime)
 
     links = relationship("LinkModel", back_populates='page_url_domain')
     tags = relationship('TagModel', secondary='page_url_domain_tag')
@@ -36,24 +41,6 @@ class PageUrlDomainModel(IdentifiedCreatedUpdated, Base):
     def links_id(cls):
         return sa.select(LinkModel.id).filter(LinkModel.page_url_domain_id == cls.id)
 
-    def update_link_price_avg(self):
-        link_prices = []
-        for link in self.links:
-            if link.price is not None:
-                link_prices.append(link.price)
-        if link_prices:
-            link_price_avg = round(float(mean(link_prices)), 2)
-        else:
-            link_price_avg = 0
-        self.link_price_avg = link_price_avg
-
-    def update_pudomain_link_last(self, link_last: LinkModel) -> None:
-        self.link_created_at_last = link_last.created_at
-        if link_last.dr is not None:
-            self.link_dr_last = link_last.dr
-        if link_last.da is not None:
-            self.link_da_last = link_last.da
-
     @hybrid_property
     def tags_id(self):
         return [tag.id for tag in self.tags]
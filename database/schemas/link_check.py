@@ -23,6 +23,10 @@ class LinkCheckCreateSerializer(pd.BaseModel):
     redirect_url: str | None = None
     link_url_others_count: int | None = None
     check_mode: str | None = None
+    response_etag: str | None = None
+    response_last_modified: str | None = None
+    content_hash: str | None = None
+    match_spec_hash: str | None = None
 
 
 class LinkCheckReadSerializer(LinkCheckCreateSerializer):
@@ -7,6 +7,7 @@ from core.config import settings
 from core.dependencies import get_current_user_dependency
 from database import Base, engine
 from database.models import init_models
+from routers import metrics
 from routers.v1 import auth as v1_auth
 from routers.v1 import link_url_domains as v1_link_url_domains
 from routers.v1 import linkchecks as v1_linkchecks
@@ -96,5 +97,8 @@ v2_api_router.include_router(v2_auth_router)
 app.include_router(v1_api_router, prefix="/api/v1")
 app.include_router(v2_api_router, prefix="/api/v2")
 
+# public prometheus metrics
+app.include_router(metrics.router, prefix='/metrics', tags=['metrics'])
+
 if __name__ == "__main__":
     uvicorn.run('main:app', host=settings.SERVER_HOST, port=settings.SERVER_PORT, reload=True)
@@ -0,0 +1,12 @@
+import fastapi as fa
+from fastapi.responses import Response
+
+from core.metrics import CONTENT_TYPE_LATEST, get_metrics_latest
+
+router = fa.APIRouter()
+
+
+@router.get('', include_in_schema=False)
+def metrics_get():
+    """prometheus metrics of api, and of celery workers too if they share PROMETHEUS_MULTIPROC_DIR with it"""
+    return Response(get_metrics_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
@@ -8,7 +8,6 @@ from fastapi.responses import StreamingResponse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from core.config import settings
 from core.dependencies import (
     get_session_dependency,
     get_current_user_dependency,
@@ -31,7 +30,7 @@ from core.exceptions import UnauthorizedException
 from core.shared import (
     filter_query_by_period_params_link,
     filter_query_by_model_params_link,
-    paginate_query, chunks_generator
+    paginate_query
 )
 from database.crud import (get, create, update, remove, get_or_create_many)
 from database.models.link import LinkModel
@@ -53,7 +52,8 @@ from services.file_handler.file_handler import (
     create_links_from_uploaded_file_archive
 )
 from services.link_checker.link_checker import (
-    LinkChecker
+    check_links_in_chunks,
+    get_link_chunks
 )
 from services.link_checker.celery_tasks import (
     check_link_by_id,
@@ -394,11 +394,7 @@ async def links_create_my_from_file(
 
     if links:
         if sync_mode:
-            for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-                linkchecker = LinkChecker(db)
-                print(linkchecker)
-                await linkchecker.check_links(links=link_chunk)
-                print(f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}\n\n\n')
+            await check_links_in_chunks(db, get_link_chunks(db, LinkModel.id.in_([link.id for link in links])))
             return {'message': 'ok'}
         else:
             links_id_list = [str(link.id) for link in links]
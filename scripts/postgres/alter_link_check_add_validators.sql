@@ -0,0 +1,6 @@
+-- columns of LinkCheckModel used for conditional rechecks,
+-- tables are created by Base.metadata.create_all, so existing link_check table needs them added by hand
+ALTER TABLE link_check ADD COLUMN IF NOT EXISTS response_etag VARCHAR(255);
+ALTER TABLE link_check ADD COLUMN IF NOT EXISTS response_last_modified VARCHAR(64);
+ALTER TABLE link_check ADD COLUMN IF NOT EXISTS content_hash VARCHAR(40);
+ALTER TABLE link_check ADD COLUMN IF NOT EXISTS match_spec_hash VARCHAR(40);
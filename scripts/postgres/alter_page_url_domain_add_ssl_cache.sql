@@ -0,0 +1,4 @@
+-- columns of PageUrlDomainModel caching ssl certificate probes,
+-- tables are created by Base.metadata.create_all, so existing page_url_domain table needs them added by hand
+ALTER TABLE page_url_domain ADD COLUMN IF NOT EXISTS ssl_expiration_date TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE page_url_domain ADD COLUMN IF NOT EXISTS ssl_checked_at TIMESTAMP WITHOUT TIME ZONE;
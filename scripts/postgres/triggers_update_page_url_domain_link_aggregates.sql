@@ -0,0 +1,126 @@
+-- page_url_domain.link_price_avg, link_created_at_last, link_da_last, link_dr_last
+-- are maintained by triggers on link insert / update / delete:
+-- price average from running link_price_sum / link_price_count, link last from the latest created link
+
+ALTER TABLE page_url_domain ADD COLUMN IF NOT EXISTS link_price_sum NUMERIC(14, 2) NOT NULL DEFAULT 0;
+ALTER TABLE page_url_domain ADD COLUMN IF NOT EXISTS link_price_count INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS ix_link_page_url_domain_id_created_at ON link (page_url_domain_id, created_at);
+
+DROP FUNCTION IF EXISTS update_page_url_domain_link_aggregates CASCADE;
+CREATE FUNCTION update_page_url_domain_link_aggregates()
+RETURNS TRIGGER AS $$
+DECLARE
+    old_page_url_domain_id INTEGER;
+    old_price NUMERIC;
+    old_created_at TIMESTAMP;
+    new_page_url_domain_id INTEGER;
+    new_price NUMERIC;
+    new_created_at TIMESTAMP;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        old_page_url_domain_id = OLD.page_url_domain_id;
+        old_price = OLD.price;
+        old_created_at = OLD.created_at;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        new_page_url_domain_id = NEW.page_url_domain_id;
+        new_price = NEW.price;
+        new_created_at = NEW.created_at;
+    END IF;
+
+    -- take old link price off its page_url_domain and put new one on
+    IF old_page_url_domain_id IS NOT NULL AND old_price IS NOT NULL THEN
+        UPDATE page_url_domain
+        SET link_price_sum = link_price_sum - old_price,
+            link_price_count = link_price_count - 1
+        WHERE id = old_page_url_domain_id;
+    END IF;
+    IF new_page_url_domain_id IS NOT NULL AND new_price IS NOT NULL THEN
+        UPDATE page_url_domain
+        SET link_price_sum = link_price_sum + new_price,
+            link_price_count = link_price_count + 1
+        WHERE id = new_page_url_domain_id;
+    END IF;
+    UPDATE page_url_domain
+    SET link_price_avg = CASE WHEN link_price_count > 0 THEN ROUND(link_price_sum / link_price_count, 2) ELSE 0 END
+    WHERE id IN (old_page_url_domain_id, new_page_url_domain_id);
+
+    -- new link is the last one of its page_url_domain if it is created not earlier than the last one
+    IF new_page_url_domain_id IS NOT NULL THEN
+        UPDATE page_url_domain
+        SET link_created_at_last = NEW.created_at,
+            link_dr_last = COALESCE(NEW.dr, link_dr_last),
+            link_da_last = COALESCE(NEW.da, link_da_last)
+        WHERE id = new_page_url_domain_id
+          AND (link_created_at_last IS NULL OR link_created_at_last <= NEW.created_at);
+    END IF;
+    -- link is gone from its page_url_domain or moved earlier (it could be the last one),
+    -- so its last link is taken again (by index, not by all links),
+    -- dr / da of the last link are kept if it has none, as for a new link
+    IF old_page_url_domain_id IS NOT NULL AND (
+        old_page_url_domain_id IS DISTINCT FROM new_page_url_domain_id OR new_created_at < old_created_at
+    ) THEN
+        UPDATE page_url_domain
+        SET (link_created_at_last, link_dr_last, link_da_last) = (
+            SELECT link.created_at, COALESCE(link.dr, page_url_domain.link_dr_last),
+                   COALESCE(link.da, page_url_domain.link_da_last)
+            FROM link
+            WHERE link.page_url_domain_id = old_page_url_domain_id
+            ORDER BY link.created_at DESC
+            LIMIT 1
+        )
+        WHERE id = old_page_url_domain_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS update_page_url_domain_link_aggregates_insert_delete on link;
+CREATE TRIGGER update_page_url_domain_link_aggregates_insert_delete
+    AFTER INSERT OR DELETE
+    ON
+        link
+    FOR EACH ROW
+EXECUTE PROCEDURE update_page_url_domain_link_aggregates();
+
+-- link_check_last_* updates of nightly checks don't fire it
+DROP TRIGGER IF EXISTS update_page_url_domain_link_aggregates_update on link;
+CREATE TRIGGER update_page_url_domain_link_aggregates_update
+    AFTER UPDATE OF page_url_domain_id, price, created_at, da, dr
+    ON
+        link
+    FOR EACH ROW
+    WHEN (
+        OLD.page_url_domain_id IS DISTINCT FROM NEW.page_url_domain_id OR
+        OLD.price IS DISTINCT FROM NEW.price OR
+        OLD.created_at IS DISTINCT FROM NEW.created_at OR
+        OLD.da IS DISTINCT FROM NEW.da OR
+        OLD.dr IS DISTINCT FROM NEW.dr
+    )
+EXECUTE PROCEDURE update_page_url_domain_link_aggregates();
+
+-- fill aggregates of existing page_url_domains once
+UPDATE page_url_domain
+SET link_price_sum = aggregates.price_sum,
+    link_price_count = aggregates.price_count,
+    link_price_avg = CASE
+        WHEN aggregates.price_count > 0 THEN ROUND(aggregates.price_sum / aggregates.price_count, 2) ELSE 0 END
+FROM (
+    SELECT page_url_domain.id, COALESCE(SUM(link.price), 0) AS price_sum, COUNT(link.price) AS price_count
+    FROM page_url_domain
+    LEFT JOIN link ON link.page_url_domain_id = page_url_domain.id
+    GROUP BY page_url_domain.id
+) AS aggregates
+WHERE page_url_domain.id = aggregates.id;
+
+UPDATE page_url_domain
+SET link_created_at_last = link_last.created_at,
+    link_dr_last = COALESCE(link_last.dr, page_url_domain.link_dr_last),
+    link_da_last = COALESCE(link_last.da, page_url_domain.link_da_last)
+FROM (
+    SELECT DISTINCT ON (page_url_domain_id) page_url_domain_id, created_at, dr, da
+    FROM link
+    WHERE page_url_domain_id IS NOT NULL
+    ORDER BY page_url_domain_id, created_at DESC
+) AS link_last
+WHERE page_url_domain.id = link_last.page_url_domain_id;
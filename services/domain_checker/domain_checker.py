@@ -20,7 +20,7 @@ from core.shared import (
     get_best_country_proxy,
 )
 from database import SessionLocal
-from database.crud import get_or_create_by_name
+from database.crud import get_or_create_by_name, get_or_create_many_by_name
 from database.models.link import LinkModel
 from database.models.link_url_domain import LinkUrlDomainModel
 from database.models.page_url_domain import PageUrlDomainModel
@@ -48,8 +48,6 @@ def get_domain_name_from_url(page_url) -> str | None:
 def recreate_pudomain(session, link: LinkModel) -> bool:
     pudomain_name = get_domain_name_from_url(link.page_url)
     pudomain, created = get_or_create_by_name(session, PageUrlDomainModel, name=pudomain_name)
-    pudomain.update_pudomain_link_last(link_last=link)
-    pudomain.update_link_price_avg()
     link.page_url_domain = pudomain
     return created
 
@@ -69,6 +67,29 @@ def recreate_domains(session: Session, link: LinkModel) -> tuple[bool, bool]:
     return pudomain_created, ludomain_created
 
 
+def recreate_domains_many(session: Session, links: list[LinkModel]) -> list[int]:
+    """recreate_domains for all links at once: domains are got or created with get_or_create_many_by_name
+    (link aggregates of page_url_domains follow by db triggers)
+
+    returns ids of created page_url_domains"""
+    if not links:
+        return []
+    pudomains, pudomain_created_names = get_or_create_many_by_name(
+        session, PageUrlDomainModel, [get_domain_name_from_url(link.page_url) for link in links])
+    ludomains, _ = get_or_create_many_by_name(
+        session, LinkUrlDomainModel, [get_domain_name_from_url(link.link_url) for link in links])
+
+    for link in links:
+        pudomain_name = get_domain_name_from_url(link.page_url)
+        ludomain_name = get_domain_name_from_url(link.link_url)
+        if link.page_url_domain_id != pudomains[pudomain_name].id:
+            link.page_url_domain = pudomains[pudomain_name]
+        if link.link_url_domain_id != ludomains[ludomain_name].id:
+            link.link_url_domain = ludomains[ludomain_name]
+    session.commit()
+    return [pudomains[name].id for name in pudomain_created_names]
+
+
 def clean_countries_list(countries_list: list) -> list:
     countries_list = countries_list.copy()
     if countries_list:
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import psutil
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright
+
+from core.config import settings
+from core.shared import get_proxy_for_playwright, get_proxy_key
+
+logger = logging.getLogger(name='link_checker')
+
+
+class PooledContext:
+    """browser context shared by several pages of the same site (so cookies and storage of donors don't mix),
+    retired context gets no new pages and is closed as soon as its last page is closed"""
+
+    def __init__(self, context: BrowserContext):
+        self.context = context
+        self.pages_opened = 0
+        self.pages_open = 0
+        self.is_retired = False
+
+    def __repr__(self):
+        return f"<PooledContext> ({self.pages_opened=:}, {self.pages_open=:}, {self.is_retired=:})"
+
+
+class BrowserPool:
+    """playwright runtime and webkit browsers of one event loop (one browser per proxy),
+    so playwright checks don't launch a browser per link.
+
+    pages of the same site (page_url domain) share a context, it is closed when its last page is closed,
+    or recycled after max_pages_per_context pages or when RAM memory % used gets above max_ram_percent"""
+
+    def __init__(self,
+                 max_pages_per_context=settings.PLAYWRIGHT_CONTEXT_MAX_PAGES,
+                 max_ram_percent=settings.PLAYWRIGHT_MAX_RAM_PERCENT):
+        self.max_pages_per_context = max_pages_per_context
+        self.max_ram_percent = max_ram_percent
+        self.playwright: Playwright | None = None
+        self.browsers: dict[str | None, Browser] = {}
+        # (proxy key, site): context
+        self.contexts: dict[tuple[str | None, str | None], PooledContext] = {}
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"<BrowserPool> (id: {id(self)}, proxies: {list(self.browsers)}, contexts: {len(self.contexts)})"
+
+    async def get_browser(self, proxies_dict: dict | None) -> Browser:
+        proxy_key = get_proxy_key(proxies_dict)
+        browser = self.browsers.get(proxy_key)
+        if browser is None or not browser.is_connected():
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            browser = await self.playwright.webkit.launch(
+                proxy=get_proxy_for_playwright(proxies_dict),
+                headless=True
+            )
+            self.browsers[proxy_key] = browser
+            self.contexts = {key: pooled_context for key, pooled_context in self.contexts.items()
+                             if key[0] != proxy_key}
+            logger.debug(f'{self}: launched browser for proxy {proxy_key}')
+        return browser
+
+    async def get_context(self, proxies_dict: dict | None, site: str | None) -> PooledContext:
+        async with self.lock:
+            browser = await self.get_browser(proxies_dict)
+            key = (get_proxy_key(proxies_dict), site)
+            pooled_context = self.contexts.get(key)
+            if pooled_context is None or pooled_context.is_retired:
+                context = await browser.new_context(ignore_https_errors=True)
+                pooled_context = PooledContext(context)
+                self.contexts[key] = pooled_context
+            pooled_context.pages_opened += 1
+            pooled_context.pages_open += 1
+            return pooled_context
+
+    @asynccontextmanager
+    async def new_page(self, proxies_dict: dict | None = None, site: str | None = None) -> AsyncIterator[Page]:
+        """page in the context of site (page_url domain) of the browser of proxies_dict"""
+        key = (get_proxy_key(proxies_dict), site)
+        pooled_context = await self.get_context(proxies_dict, site)
+        page = None
+        try:
+            page = await pooled_context.context.new_page()
+            yield page
+        finally:
+            pooled_context.pages_open -= 1
+            ram_percent_used = psutil.virtual_memory()[2]
+            if pooled_context.pages_opened >= self.max_pages_per_context or ram_percent_used >= self.max_ram_percent:
+                pooled_context.is_retired = True
+            if pooled_context.pages_open == 0:
+                if pooled_context.is_retired:
+                    logger.debug(f'{self}: recycling {pooled_context}, RAM memory % used: {ram_percent_used}')
+                if self.contexts.get(key) is pooled_context:
+                    del self.contexts[key]
+                await pooled_context.context.close()
+            elif page is not None:
+                await page.close()
+
+    async def aclose(self):
+        browsers, self.browsers, self.contexts = self.browsers, {}, {}
+        for browser in browsers.values():
+            await browser.close()
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+
+class LoopBrowserPools:
+    """BrowserPool of every event loop (playwright objects are bound to the loop they were created in),
+    so browsers of the worker loop are kept, while another loop (api sync checks) uses its own pool.
+    pool of a loop is closed by aclose in that loop (see close_worker_loop)"""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.pools: dict[asyncio.AbstractEventLoop, BrowserPool] = {}
+
+    def __repr__(self):
+        return f"<LoopBrowserPools> (id: {id(self)}, pools: {list(self.pools.values())})"
+
+    def get_pool(self) -> BrowserPool:
+        loop = asyncio.get_running_loop()
+        for closed_loop in [pool_loop for pool_loop in self.pools if pool_loop.is_closed()]:
+            logger.error(f'{self}: event loop of {self.pools[closed_loop]} is closed before the pool')
+            del self.pools[closed_loop]
+        if loop not in self.pools:
+            self.pools[loop] = BrowserPool(**self.kwargs)
+        return self.pools[loop]
+
+    def new_page(self, proxies_dict: dict | None = None, site: str | None = None):
+        return self.get_pool().new_page(proxies_dict, site)
+
+    async def aclose(self):
+        pool = self.pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool.aclose()
+
+
+browser_pool = LoopBrowserPools()
@@ -1,91 +1,158 @@
-import asyncio
 import datetime
 
-from sqlalchemy import extract
+from celery import chord
+from celery.signals import worker_process_shutdown, worker_shutdown
+from sqlalchemy import and_, extract, func, or_
 
 from celery_app import celery_app
 from core.config import settings
-from core.shared import chunks_generator
+from core.shared import chunks_generator, keyset_ranges_generator
 from database import SessionLocal
-from database.crud import get
 from database.models import init_models
 from database.models.link import LinkModel
-from services.link_checker.link_checker import LinkChecker, logger
+from services.link_checker.client_pool import close_worker_loop, run_in_worker_loop
+from services.link_checker.inflight_registry import inflight_registry
+from services.link_checker.link_checker import (
+    LinkChecker,
+    check_links_in_chunks,
+    get_link_check_inputs,
+    get_link_chunks,
+    logger
+)
+from services.link_checker.scheduler import lease_due_links
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_link_checker_pools(**kwargs):
+    """close worker-scoped httpx client pools of link checker"""
+    close_worker_loop()
 
 
 @celery_app.task(name='check_link_by_id')
 def check_link_by_id(id):
     init_models()
     session = SessionLocal()
-    link = get(session, LinkModel, id=id)
-    if link:
+    links = get_link_check_inputs(session, [id])
+    # link could be just edited, so its recent result is not reused,
+    # and if it is in flight, it is checked again after that check (which could start before the edit) is done
+    if links and not inflight_registry.claim([id], reuse_results=False):
+        logger.debug(f'check_link_by_id task: link with id={id} is in flight, put off for '
+                     f'{settings.LINK_CHECKER_INFLIGHT_RECHECK_COUNTDOWN} s')
+        check_link_by_id.apply_async(kwargs={'id': id}, countdown=settings.LINK_CHECKER_INFLIGHT_RECHECK_COUNTDOWN)
+    elif links:
         logger.debug('check_link_by_id task')
         linkchecker = LinkChecker(session)
-        asyncio.run(linkchecker.check_links(links=[link]))
+        is_checked = False
+        try:
+            run_in_worker_loop(linkchecker.check_links(links=links))
+            is_checked = True
+        finally:
+            inflight_registry.release([id], is_checked)
     else:
         logger.error(f'check_link_by_id task: no link with id={id} was found to check')
     session.close()
 
 
 @celery_app.task(name='check_links_from_list')
-def check_links_from_list(id_list):
+def check_links_from_list(id_list, reuse_results=False) -> int:
+    """reuse_results - skip links just checked by other tasks (scheduled checks), explicit checks check all,
+    returns count of checked links"""
     init_models()
     session = SessionLocal()
-    links = session.query(LinkModel).filter(LinkModel.id.in_(id_list)).all()
-    if links:
-        for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-            logger.debug(f'check_links_from_list task, LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
-            linkchecker = LinkChecker(session)
-            asyncio.run(linkchecker.check_links(links=link_chunk))
+    link_chunks = get_link_chunks(session, LinkModel.id.in_(id_list))
+    links_count = run_in_worker_loop(check_links_in_chunks(session, link_chunks, reuse_results=reuse_results))
+    if links_count:
+        logger.debug(f'check_links_from_list task: {links_count} links checked, '
+                     f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
     else:
         logger.error('check_links_from_list task: no links in db was found to check')
     session.close()
+    return links_count
 
 
 @celery_app.task(name='check_links_all')
 def check_links_all():
     init_models()
     session = SessionLocal()
-    links = session.query(LinkModel).all()
-    if links:
-        for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-            logger.debug(f'check_links_all task, LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
-            linkchecker = LinkChecker(session)
-            asyncio.run(linkchecker.check_links(links=link_chunk))
+    links_count = run_in_worker_loop(check_links_in_chunks(session, get_link_chunks(session), reuse_results=True))
+    if links_count:
+        logger.debug(f'check_links_all task: {links_count} links checked, '
+                     f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
     else:
         logger.error('check_links_all task: no links in db was found to check')
     session.close()
 
 
+def get_check_every_day_criteria():
+    """
+    mode httpx(None) and carried forward from cache: all
+    mode playwright: status red
+    """
+    httpx_mode = or_(LinkModel.link_check_last_check_mode == None,
+                     LinkModel.link_check_last_check_mode == 'cache')
+    playwright_mode = and_(LinkModel.link_check_last_check_mode == 'playwright',
+                           LinkModel.link_check_last_status == 'red')
+    return httpx_mode, playwright_mode
+
+
 @celery_app.task(name='check_every_day')
 def check_every_day():
     """
-    mode httpx(None): all
-    mode playwright: status red
+    coordinator: links of get_check_every_day_criteria are split to id ranges of LINK_CHECKER_TASK_CHUNK_SIZE links,
+    every range is checked by its own check_every_day_id_range subtask (on any worker),
+    check_links_done is called with their results when all of them are done
     """
     init_models()
     session = SessionLocal()
 
-    links_httpx_mode = session.query(LinkModel) \
-        .filter(LinkModel.link_check_last_check_mode == None).all()
-    links_playwright_mode = session.query(LinkModel) \
-        .filter(LinkModel.link_check_last_check_mode == 'playwright') \
-        .filter(LinkModel.link_check_last_status == 'red') \
-        .all()
-    links = links_httpx_mode + links_playwright_mode
-    if links:
+    httpx_mode, playwright_mode = get_check_every_day_criteria()
+    links_httpx_mode_count = session.query(LinkModel).filter(httpx_mode).count()
+    links_playwright_mode_count = session.query(LinkModel).filter(playwright_mode).count()
+    id_ranges = list(keyset_ranges_generator(session.query(LinkModel).filter(or_(httpx_mode, playwright_mode)),
+                                             LinkModel.id, settings.LINK_CHECKER_TASK_CHUNK_SIZE))
+    if id_ranges:
         logger.debug(f'check_every_day task: START CHECKING LINKS_QTY:\n'
-                     f'HTTP_MODE: {len(links_httpx_mode)}\n'
-                     f'PLAYWRIGHT_MODE: {len(links_playwright_mode)}\n')
-        for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-            logger.debug(f'check_every_day task: LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
-            linkchecker = LinkChecker(session)
-            asyncio.run(linkchecker.check_links(links=link_chunk))
+                     f'HTTP_MODE: {links_httpx_mode_count}\n'
+                     f'PLAYWRIGHT_MODE: {links_playwright_mode_count}\n')
+        logger.debug(f'check_every_day task: {len(id_ranges)} subtasks, '
+                     f'LINK_CHECKER_TASK_CHUNK_SIZE: {settings.LINK_CHECKER_TASK_CHUNK_SIZE}')
+        chord([check_every_day_id_range.s(first_id, last_id) for first_id, last_id in id_ranges])(
+            check_links_done.s())
     else:
         logger.error('check_every_day task: no links in db was found to check')
     session.close()
 
 
+@celery_app.task(name='check_every_day_id_range')
+def check_every_day_id_range(first_id: int, last_id: int) -> int:
+    """check links of get_check_every_day_criteria with ids from first_id to last_id, returns count of checked links"""
+    init_models()
+    session = SessionLocal()
+    httpx_mode, playwright_mode = get_check_every_day_criteria()
+    # one stream of both modes, so links turned to playwright mode by this check are not checked twice
+    link_chunks = get_link_chunks(session, or_(httpx_mode, playwright_mode), LinkModel.id.between(first_id, last_id))
+    links_count = run_in_worker_loop(check_links_in_chunks(session, link_chunks, reuse_results=True))
+    logger.debug(f'check_every_day_id_range task: {links_count} links checked, ids {first_id}-{last_id}, '
+                 f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
+    session.close()
+    return links_count
+
+
+@celery_app.task(name='check_links_done')
+def check_links_done(links_counts: list[int]):
+    """chord callback of check_every_day and dispatch_due_links: log aggregated results and send CHECK_LINKS_DONE_TASKS"""
+    init_models()
+    session = SessionLocal()
+    status_counts = dict(session.query(LinkModel.link_check_last_status, func.count(LinkModel.id))
+                         .group_by(LinkModel.link_check_last_status).all())
+    session.close()
+    logger.debug(f'check_links_done task: {sum(links_counts)} links checked by {len(links_counts)} subtasks, '
+                 f'links by last status: {status_counts}')
+    for task_name in settings.CHECK_LINKS_DONE_TASKS:
+        celery_app.send_task(task_name)
+
+
 @celery_app.task(name='check_monthly')
 def check_monthly():
     """
@@ -95,46 +162,68 @@ def check_monthly():
     session = SessionLocal()
     old_links_date = datetime.datetime.now() - datetime.timedelta(days=settings.OLD_LINKCHECKS_DAYS)
 
-    links = session.query(LinkModel) \
-        .filter(LinkModel.link_check_last_status == 'green') \
-        .filter(LinkModel.link_check_last_created_at <= old_links_date) \
-        .all()
-    if links:
-        for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-            logger.debug(f'check_monthly task: LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
-            linkchecker = LinkChecker(session, start_mode='playwright')
-            asyncio.run(linkchecker.check_links(links=link_chunk))
+    link_chunks = get_link_chunks(session,
+                                  LinkModel.link_check_last_status == 'green',
+                                  LinkModel.link_check_last_created_at <= old_links_date)
+    links_count = run_in_worker_loop(check_links_in_chunks(session, link_chunks, start_mode='playwright',
+                                                           reuse_results=True))
+    if links_count:
+        logger.debug(f'check_monthly task: {links_count} links checked, '
+                     f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
     else:
         logger.error('check_monthly task: no links in db was found to check')
     session.close()
 
 
 @celery_app.task(name='check_links_from_list_playwright')
-def check_links_from_list_playwright(id_list):
+def check_links_from_list_playwright(id_list, reuse_results=False) -> int:
+    """reuse_results - skip links just checked by other tasks (scheduled checks), explicit checks check all,
+    returns count of checked links"""
     init_models()
     session = SessionLocal()
-    links = session.query(LinkModel).filter(LinkModel.id.in_(id_list)).all()
-    if links:
-        for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-            logger.debug(
-                f'check_links_from_list_playwright task: LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
-            linkchecker = LinkChecker(session, start_mode='playwright')
-            asyncio.run(linkchecker.check_links(links=link_chunk))
+    link_chunks = get_link_chunks(session, LinkModel.id.in_(id_list))
+    links_count = run_in_worker_loop(check_links_in_chunks(session, link_chunks, start_mode='playwright',
+                                                           reuse_results=reuse_results))
+    if links_count:
+        logger.debug(f'check_links_from_list_playwright task: {links_count} links checked, '
+                     f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
     else:
         logger.error('check_links_from_list_playwright task: no links in db was found to check')
     session.close()
+    return links_count
 
 
 @celery_app.task(name='check_links_per_year')
 def check_links_per_year(year: int):
     init_models()
     session = SessionLocal()
-    links = session.query(LinkModel).filter(extract('year', LinkModel.created_at) == year).all()
-    if links:
-        for link_chunk in chunks_generator(links, settings.LINK_CHECKER_CHUNK_SIZE):
-            logger.debug(f'check_links_per_year task: LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
-            linkchecker = LinkChecker(session)
-            asyncio.run(linkchecker.check_links(links=link_chunk))
+    link_chunks = get_link_chunks(session, extract('year', LinkModel.created_at) == year)
+    links_count = run_in_worker_loop(check_links_in_chunks(session, link_chunks, reuse_results=True))
+    if links_count:
+        logger.debug(f'check_links_per_year task: {links_count} links checked, '
+                     f'LINK_CHECKER_CHUNK_SIZE: {settings.LINK_CHECKER_CHUNK_SIZE}')
     else:
         logger.error('check_links_per_year task: no links in db was found to check')
     session.close()
+
+
+@celery_app.task(name='dispatch_due_links')
+def dispatch_due_links():
+    """send links due to be checked by their schedule (see scheduler.lease_due_links)
+    to check_links_from_list and check_links_from_list_playwright by LINK_CHECKER_TASK_CHUNK_SIZE links,
+    check_links_done is called with their results when all of them are done"""
+    init_models()
+    session = SessionLocal()
+    link_ids, pw_link_ids = lease_due_links(session)
+    session.close()
+    # scheduled checks go to nightly queue, not to uploads one of check_links_from_list
+    subtasks = [
+        *[check_links_from_list.signature(kwargs={'id_list': id_list, 'reuse_results': True},
+                                          queue=settings.CELERY_QUEUE_NIGHTLY)
+          for id_list in chunks_generator(link_ids, settings.LINK_CHECKER_TASK_CHUNK_SIZE)],
+        *[check_links_from_list_playwright.signature(kwargs={'id_list': id_list, 'reuse_results': True})
+          for id_list in chunks_generator(pw_link_ids, settings.LINK_CHECKER_TASK_CHUNK_SIZE)],
+    ]
+    if subtasks:
+        chord(subtasks)(check_links_done.s())
+    logger.debug(f'dispatch_due_links task: {len(link_ids)} links dispatched, {len(pw_link_ids)} with playwright')
@@ -0,0 +1,81 @@
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+
+from core.shared import get_proxy_key, LIMITS_LINK_CHECKER, TIMEOUT_5
+from services.link_checker.browser_pool import browser_pool
+from services.link_checker.page_parser import shutdown_parse_executor
+
+logger = logging.getLogger(name='link_checker')
+
+# http2 is negotiated only if 'h2' package is installed (httpx[http2]), otherwise clients stay on http1.1
+HTTP2_IS_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+class HttpxClientRegistry:
+    """httpx.AsyncClient pools living as long as the worker process (one per proxy),
+    so keep-alive connections, dns and tls sessions are reused between chunks and proxy retry rounds.
+
+    clients are bound to the event loop they were created in, so every loop has its own clients,
+    clients of a loop are closed by aclose in that loop (see close_worker_loop)"""
+
+    def __init__(self, limits=LIMITS_LINK_CHECKER, timeout=TIMEOUT_5):
+        self.limits = limits
+        self.timeout = timeout
+        self.loop_clients: dict[asyncio.AbstractEventLoop, dict[str | None, httpx.AsyncClient]] = {}
+
+    def __repr__(self):
+        return f"<HttpxClientRegistry> (id: {id(self)}, proxies: {[list(c) for c in self.loop_clients.values()]})"
+
+    def get_client(self, proxies_dict: dict | None = None) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        for closed_loop in [client_loop for client_loop in self.loop_clients if client_loop.is_closed()]:
+            logger.error(f'{self}: event loop of clients {list(self.loop_clients[closed_loop])} '
+                         f'is closed before the clients')
+            del self.loop_clients[closed_loop]
+        clients = self.loop_clients.setdefault(loop, {})
+
+        proxy_key = get_proxy_key(proxies_dict)
+        client = clients.get(proxy_key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits,
+                                       proxies=proxies_dict, http2=HTTP2_IS_AVAILABLE)
+            clients[proxy_key] = client
+            logger.debug(f'{self}: created client for proxy {proxy_key}')
+        return client
+
+    async def aclose(self):
+        clients = self.loop_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+
+client_registry = HttpxClientRegistry()
+
+worker_loop: asyncio.AbstractEventLoop | None = None
+
+
+def run_in_worker_loop(coro):
+    """run coro in the event loop living as long as the worker process (instead of asyncio.run),
+    so the pools of client_registry and browser_pool stay alive between tasks"""
+    global worker_loop
+    if worker_loop is None or worker_loop.is_closed():
+        worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(worker_loop)
+    return worker_loop.run_until_complete(coro)
+
+
+def close_worker_loop():
+    """close pooled clients, browsers, parse processes and the worker event loop,
+    called on worker process shutdown"""
+    global worker_loop
+    shutdown_parse_executor()
+    if worker_loop is None or worker_loop.is_closed():
+        return
+    worker_loop.run_until_complete(client_registry.aclose())
+    worker_loop.run_until_complete(browser_pool.aclose())
+    worker_loop.run_until_complete(worker_loop.shutdown_asyncgens())
+    worker_loop.close()
+    worker_loop = None
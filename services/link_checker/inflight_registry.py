@@ -0,0 +1,138 @@
+import abc
+import logging
+import threading
+import time
+from typing import Iterable
+
+import redis
+
+from core.config import settings
+
+logger = logging.getLogger(name='link_checker')
+
+
+class InFlightRegistry(abc.ABC):
+    """links being checked now (claimed for inflight_ttl seconds, in case their check never releases them)
+    and links checked within result_ttl seconds, so the same link is not checked by several tasks at once,
+    and bulk checks don't check again what was just checked"""
+
+    def __init__(self,
+                 inflight_ttl=settings.LINK_CHECKER_INFLIGHT_TTL,
+                 result_ttl=settings.LINK_CHECKER_RESULT_TTL):
+        self.inflight_ttl = inflight_ttl
+        self.result_ttl = result_ttl
+
+    @abc.abstractmethod
+    def claim(self, link_ids: Iterable[int], reuse_results=True) -> list[int]:
+        """claim links, which are not in flight (and with reuse_results - not checked within result_ttl),
+        returns ids of claimed ones"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release(self, link_ids: Iterable[int], is_checked=True):
+        """links are not in flight any more, is_checked - their linkchecks are saved"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def is_in_flight(self, link_id: int) -> bool:
+        raise NotImplementedError
+
+
+class LocalInFlightRegistry(InFlightRegistry):
+    """registry of one worker process, stand-in for RedisInFlightRegistry when there is no redis"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lock = threading.Lock()
+        # link_id: time.monotonic() it expires at
+        self.inflight: dict[int, float] = {}
+        self.checked: dict[int, float] = {}
+
+    def __repr__(self):
+        return f"<LocalInFlightRegistry> (id: {id(self)}, in flight: {len(self.inflight)})"
+
+    def claim(self, link_ids: Iterable[int], reuse_results=True) -> list[int]:
+        now = time.monotonic()
+        claimed_link_ids = []
+        with self.lock:
+            for link_id in link_ids:
+                if self.inflight.get(link_id, 0) > now or (reuse_results and self.checked.get(link_id, 0) > now):
+                    continue
+                self.inflight[link_id] = now + self.inflight_ttl
+                claimed_link_ids.append(link_id)
+        return claimed_link_ids
+
+    def release(self, link_ids: Iterable[int], is_checked=True):
+        now = time.monotonic()
+        with self.lock:
+            for link_id in link_ids:
+                self.inflight.pop(link_id, None)
+                if is_checked:
+                    self.checked[link_id] = now + self.result_ttl
+            self.checked = {link_id: expires_at for link_id, expires_at in self.checked.items() if expires_at > now}
+
+    def is_in_flight(self, link_id: int) -> bool:
+        with self.lock:
+            return self.inflight.get(link_id, 0) > time.monotonic()
+
+
+class RedisInFlightRegistry(InFlightRegistry):
+    """registry shared by all workers: link_checker:inflight:<link_id> and link_checker:checked:<link_id> keys,
+    expiring in their ttl. when redis is not available, links are claimed anyway (checked as without registry)"""
+
+    def __init__(self, redis_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.redis = redis.Redis.from_url(redis_url)
+
+    def __repr__(self):
+        return f"<RedisInFlightRegistry> (id: {id(self)})"
+
+    @staticmethod
+    def get_inflight_key(link_id: int) -> str:
+        return f'link_checker:inflight:{link_id}'
+
+    @staticmethod
+    def get_checked_key(link_id: int) -> str:
+        return f'link_checker:checked:{link_id}'
+
+    def claim(self, link_ids: Iterable[int], reuse_results=True) -> list[int]:
+        link_ids = list(link_ids)
+        if not link_ids:
+            return []
+        try:
+            if reuse_results:
+                checked = self.redis.mget([self.get_checked_key(link_id) for link_id in link_ids])
+                link_ids = [link_id for link_id, is_checked in zip(link_ids, checked) if is_checked is None]
+            pipeline = self.redis.pipeline(transaction=False)
+            for link_id in link_ids:
+                pipeline.set(self.get_inflight_key(link_id), 1, nx=True, ex=self.inflight_ttl)
+            return [link_id for link_id, is_claimed in zip(link_ids, pipeline.execute()) if is_claimed]
+        except redis.RedisError as e:
+            logger.error(f'{self}.claim: {e.__class__.__name__} {e}, links are claimed without registry')
+            return link_ids
+
+    def release(self, link_ids: Iterable[int], is_checked=True):
+        pipeline = self.redis.pipeline(transaction=False)
+        for link_id in link_ids:
+            pipeline.delete(self.get_inflight_key(link_id))
+            if is_checked:
+                pipeline.set(self.get_checked_key(link_id), 1, ex=self.result_ttl)
+        try:
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.error(f'{self}.release: {e.__class__.__name__} {e}')
+
+    def is_in_flight(self, link_id: int) -> bool:
+        try:
+            return bool(self.redis.exists(self.get_inflight_key(link_id)))
+        except redis.RedisError:
+            return False
+
+
+def get_inflight_registry(redis_url: str | None = settings.LINK_CHECKER_INFLIGHT_REDIS_URL) -> InFlightRegistry:
+    if redis_url and redis_url.startswith(('redis://', 'rediss://')):
+        return RedisInFlightRegistry(redis_url)
+    return LocalInFlightRegistry()
+
+
+inflight_registry = get_inflight_registry()
@@ -1,38 +1,67 @@
 import asyncio
+import hashlib
+import itertools
 import logging
 import os
 import ssl
-import subprocess
+import time
+from typing import AsyncIterator, Iterable, Iterator, NamedTuple
 
 import httpx
 import psutil
-from bs4 import BeautifulSoup
+import sqlalchemy as sa
 from playwright.async_api import (
-    async_playwright,
+    Page,
     TimeoutError as PlaywrightTimeoutError,
     Error as PlaywrightError
 )
+from sqlalchemy import or_
+from sqlalchemy.orm import Query, Session
 
 from core.config import settings
-from core.exceptions import CheckWithPlaywrightException
+from core.exceptions import CheckWithPlaywrightException, PageThrottledException
+from core.metrics import (
+    LINK_CHECKER_CHUNK_STAGE_SECONDS,
+    LINK_CHECKER_STAGE_SECONDS,
+    count_linkchecks,
+    observe_seconds
+)
 from core.shared import (
     chunks_generator,
+    keyset_chunks_generator,
     normalize,
-    remove_https,
     update_links,
-    get_proxy_for_playwright,
-    get_next_proxy,
+    LINK_CHECK_LAST_COLUMNS,
     get_proxies_dict,
-    get_visit_from, LIMITS_5, TIMEOUT_2, TIMEOUT_5
+    get_visit_from, TIMEOUT_2, TIMEOUT_5
 )
-from database.crud import create_many
+from database import SessionLocal
+from database.crud import insert_many
 from database.models.link import LinkModel
 from database.models.link_check import LinkCheckModel
+from database.models.link_url_domain import LinkUrlDomainModel
+from database.models.page_url_domain import PageUrlDomainModel
 from database.schemas.link_check import LinkCheckCreateSerializer
 from services.domain_checker.celery_tasks import check_pudomains_with_similarweb
 from services.domain_checker.domain_checker import (
     get_domain_name_from_url,
-    recreate_domains
+    recreate_domains_many
+)
+from services.link_checker.browser_pool import browser_pool
+from services.link_checker.client_pool import client_registry
+from services.link_checker.inflight_registry import InFlightRegistry, inflight_registry
+from services.link_checker.page_parser import (
+    LinkMatchSpec,
+    get_page_match_default,
+    parse_page_async,
+)
+from services.link_checker.proxy_manager import PROXY_FAILURE_RESPONSE_CODES, ProxyManager, proxy_manager
+from services.link_checker.rate_limiter import HostRateLimiter, host_rate_limiter
+from services.link_checker.scheduler import update_link_schedules
+from services.ssl_checker.ssl_checker import (
+    get_ssl_expiration_dates_cached,
+    update_linkchecks_ssl,
+    update_pudomains_ssl,
 )
 
 logger = logging.getLogger(name='link_checker')
@@ -98,15 +127,309 @@ def get_status_and_message(
     return status, message
 
 
+async def read_response_content(response: httpx.Response, max_bytes=settings.LINK_CHECKER_MAX_PAGE_BYTES) -> bytes:
+    """read body of streamed response, but not more than max_bytes, the rest of the body is dropped"""
+    content = bytearray()
+    async for chunk in response.aiter_bytes():
+        content += chunk
+        if len(content) >= max_bytes:
+            logger.debug(f'read_response_content: {response.url} is cut to {max_bytes} bytes')
+            del content[max_bytes:]
+            break
+    return bytes(content)
+
+
+class LinkCheckInput(NamedTuple):
+    """what LinkChecker needs of a link, is selected with its domain names by one joined query
+    (get_link_check_inputs_query) instead of loading LinkModel with its domains, and is picklable"""
+    id: int
+    page_url: str
+    link_url: str
+    anchor: str | None
+    page_url_domain_name: str | None
+    link_url_domain_name: str | None
+    link_check_last_id: int | None = None
+
+
+def get_link_check_inputs_query(session: Session) -> Query:
+    return session.query(
+        LinkModel.id,
+        LinkModel.page_url,
+        LinkModel.link_url,
+        LinkModel.anchor,
+        PageUrlDomainModel.name.label('page_url_domain_name'),
+        LinkUrlDomainModel.name.label('link_url_domain_name'),
+        LinkModel.link_check_last_id,
+    ) \
+        .outerjoin(PageUrlDomainModel, LinkModel.page_url_domain_id == PageUrlDomainModel.id) \
+        .outerjoin(LinkUrlDomainModel, LinkModel.link_url_domain_id == LinkUrlDomainModel.id)
+
+
+def get_link_check_inputs(session: Session, link_ids: Iterable[int]) -> list[LinkCheckInput]:
+    link_ids = list(link_ids)
+    if not link_ids:
+        return []
+    return [LinkCheckInput(*row) for row in get_link_check_inputs_query(session)
+            .filter(LinkModel.id.in_(link_ids)).order_by(LinkModel.id).all()]
+
+
+def get_link_chunks(session: Session, *criteria,
+                    chunk_size=settings.LINK_CHECKER_CHUNK_SIZE) -> Iterator[list[LinkCheckInput]]:
+    """link check inputs of links filtered by criteria, streamed by chunks (keyset pagination on id)"""
+    query = get_link_check_inputs_query(session).filter(*criteria)
+    for chunk in keyset_chunks_generator(query, LinkModel.id, chunk_size):
+        yield [LinkCheckInput(*row) for row in chunk]
+
+
+def is_link_check_input_domains_actual(link: LinkCheckInput) -> bool:
+    return link.page_url_domain_name == get_domain_name_from_url(link.page_url) and \
+        link.link_url_domain_name == get_domain_name_from_url(link.link_url)
+
+
+def get_page_url_domain_name(link: LinkCheckInput) -> str:
+    return link.page_url_domain_name or get_domain_name_from_url(link.page_url)
+
+
+def interleave_by_host(pages_links: Iterable[list[LinkCheckInput]]) -> list[list[LinkCheckInput]]:
+    """links of pages reordered round-robin by page host: first page of every host, then second ones and so on,
+    so a host with many pages doesn't take all the first places in the queue"""
+    pages_links_by_host: dict[str, list[list[LinkCheckInput]]] = {}
+    for page_links in pages_links:
+        pages_links_by_host.setdefault(get_page_url_domain_name(page_links[0]), []).append(page_links)
+    return [page_links for pages_links_round in itertools.zip_longest(*pages_links_by_host.values())
+            for page_links in pages_links_round if page_links is not None]
+
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+
+
+class HttpxStageTrace:
+    """httpx (httpcore) trace extension of page requests, observes in LINK_CHECKER_STAGE_SECONDS
+    stages connect (dns and tcp), tls_handshake and ttfb (request sent .. response headers received)
+    of every request of the page, including redirects. reused keep-alive connections have no connect"""
+
+    STAGES = {
+        'connection.connect_tcp': 'connect',
+        'connection.start_tls': 'tls_handshake',
+    }
+
+    def __init__(self):
+        self.started_at: dict[str, float] = {}
+
+    async def __call__(self, event_name: str, info: dict):
+        name, _, event = event_name.rpartition('.')
+        # http11.send_request_headers .. http11.receive_response_headers, the same for http2
+        step = name.partition('.')[2]
+        if step == 'send_request_headers' and event == 'started':
+            self.started_at['ttfb'] = time.perf_counter()
+        elif step == 'receive_response_headers' and event == 'complete':
+            self.observe('ttfb')
+        elif name in self.STAGES:
+            if event == 'started':
+                self.started_at[self.STAGES[name]] = time.perf_counter()
+            elif event == 'complete':
+                self.observe(self.STAGES[name])
+
+    def observe(self, stage: str):
+        started_at = self.started_at.pop(stage, None)
+        if started_at is not None:
+            LINK_CHECKER_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started_at)
+
+
+class PageResponse:
+    """response of page_url, fetched once for all links placed on it,
+    is filled while fetching, so on errors it keeps what was got before them"""
+
+    def __init__(self):
+        self.response_code: int | None = None
+        self.redirect_codes_list: list[int] = []
+        self.redirect_url = ''
+        self.content = b''
+        self.charset: str | None = None
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.content_hash: str | None = None
+        self.retry_after: str | None = None
+
+    def __repr__(self):
+        return f"<PageResponse> ({self.response_code=:}, {self.redirect_codes_list=:}, {len(self.content)=:})"
+
+
+def get_match_spec_hash(link: LinkCheckInput) -> str:
+    """hash of what the page is matched with for link, linkcheck results are carried forward only to the same one"""
+    match_spec = '\n'.join(value or '' for value in (link.link_url, link.anchor, link.page_url_domain_name,
+                                                      link.link_url_domain_name))
+    return hashlib.sha1(match_spec.encode('utf-8')).hexdigest()
+
+
+def get_conditional_headers(link_checks_last: list[LinkCheckModel | None]) -> dict:
+    """If-None-Match / If-Modified-Since request headers from page validators of the last linkchecks
+    of all links on the page, only if every link has one and all of them have the same validators"""
+    if not link_checks_last or any(link_check_last is None for link_check_last in link_checks_last):
+        return {}
+    validators = {(link_check_last.response_etag, link_check_last.response_last_modified)
+                  for link_check_last in link_checks_last}
+    if len(validators) != 1:
+        return {}
+    etag, last_modified = validators.pop()
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def get_link_check_ser_from_cache(link_check_last: LinkCheckModel,
+                                  response_etag: str | None = None,
+                                  response_last_modified: str | None = None) -> LinkCheckCreateSerializer:
+    """new linkcheck with results of link_check_last carried forward, for the page not changed since it"""
+    fields = {field: getattr(link_check_last, field) for field in LinkCheckCreateSerializer.__fields__}
+    fields.update(
+        ssl_expiration_date=None,
+        ssl_expires_in_days=None,
+        check_mode='cache',
+        response_etag=response_etag or link_check_last.response_etag,
+        response_last_modified=response_last_modified or link_check_last.response_last_modified,
+    )
+    return LinkCheckCreateSerializer(**fields)
+
+
+def get_link_check_ser_from_page(link: LinkCheckInput, page_response: PageResponse, page_match: dict,
+                                 status: str, result_message: str, mode=None) -> LinkCheckCreateSerializer:
+    return LinkCheckCreateSerializer(
+        link_id=link.id,
+        response_code=page_response.response_code,
+        redirect_codes_list=str(page_response.redirect_codes_list),
+        redirect_url=page_response.redirect_url,
+        anchor_text_found=page_match['anchor_text_found'],
+        anchor_count=page_match['anchor_count'],
+        link_url_others_count=page_match['link_url_others_count'],
+        href_is_found=page_match['href_is_found'],
+        href_has_rel=page_match['href_has_rel'],
+        rel_has_nofollow=page_match['rel_has_nofollow'],
+        rel_has_sponsored=page_match['rel_has_sponsored'],
+        meta_robots_has_noindex=page_match['meta_robots_has_noindex'],
+        meta_robots_has_nofollow=page_match['meta_robots_has_nofollow'],
+        status=status,
+        result_message=result_message,
+        check_mode=mode,
+        response_etag=page_response.etag,
+        response_last_modified=page_response.last_modified,
+        content_hash=page_response.content_hash,
+        match_spec_hash=get_match_spec_hash(link),
+    )
+
+
+# js mirror of page_parser.is_href_of_link_url, true when page has <a> with href of every one of link_urls
+HAS_ANCHOR_WITH_LINK_URL_JS = """linkUrls => {
+    const strip = s => s.replace(/^\\/+|\\/+$/g, '');
+    const hrefs = Array.from(document.querySelectorAll('a[href]')).map(a => a.getAttribute('href'));
+    return linkUrls.every(linkUrl => {
+        const linkUrlStripped = strip(linkUrl);
+        const linkUrlWithoutHttpsStripped = strip(linkUrl.replaceAll('https:', ''));
+        return hrefs.some(href =>
+            href === linkUrl || strip(href) === linkUrlStripped || strip(href) === linkUrlWithoutHttpsStripped);
+    });
+}"""
+
+
+async def wait_for_page_rendered(page: Page, link_urls: list[str] | None = None,
+                                 wait_mode=settings.PLAYWRIGHT_WAIT_MODE,
+                                 timeout=settings.PLAYWRIGHT_WAIT_TIMEOUT):
+    """wait until page is rendered by js scripts, but not longer than timeout ms, then page is taken as it is
+
+    wait_mode 'anchor': until <a> with href of every one of link_urls appears on page
+    wait_mode 'networkidle': until page network is idle"""
+    try:
+        if wait_mode == 'anchor' and link_urls:
+            await page.wait_for_function(HAS_ANCHOR_WITH_LINK_URL_JS, arg=link_urls, timeout=timeout,
+                                         polling=settings.PLAYWRIGHT_WAIT_POLLING)
+        else:
+            await page.wait_for_load_state('networkidle', timeout=timeout)
+    except PlaywrightTimeoutError:
+        logger.debug(f'wait_for_page_rendered: {page.url} is not rendered after {timeout} ms, {wait_mode=:}')
+
+
+async def fetch_page_with_httpx(client: httpx.AsyncClient, page_response: PageResponse, page_url: str,
+                                headers: dict, timeout=TIMEOUT_5):
+    """fill page_response following redirects by hand, body of redirect responses is not read at all"""
+    request = client.build_request("GET", page_url, headers=headers, timeout=timeout,
+                                   extensions={'trace': HttpxStageTrace()})
+    while request is not None:
+        response = await client.send(request, stream=True)
+        try:
+            page_response.response_code = response.status_code
+            page_response.redirect_codes_list.append(response.status_code)
+            if len(page_response.redirect_codes_list) > 20:
+                break
+            if response.next_request:
+                page_response.redirect_url = str(response.next_request.url)
+            else:
+                page_response.retry_after = response.headers.get('retry-after')
+                page_response.etag = response.headers.get('etag')
+                page_response.last_modified = response.headers.get('last-modified')
+                if response.status_code != 304:
+                    with observe_seconds(LINK_CHECKER_STAGE_SECONDS, 'body_download'):
+                        page_response.content = await read_response_content(response)
+                    page_response.charset = response.charset_encoding
+                    page_response.content_hash = hashlib.sha1(page_response.content).hexdigest()
+        finally:
+            await response.aclose()
+
+        request = response.next_request
+
+
+async def fetch_page_with_playwright(page_response: PageResponse, page_url: str, link_urls: list[str],
+                                     proxies_dict: dict | None = None):
+    """fill page_response with page rendered by pooled playwright browser"""
+
+    async def set_response_code(response_status):
+        page_response.response_code = response_status
+
+    async def append_redirect_codes_list(response_status):
+        redirect_codes_list = page_response.redirect_codes_list
+        if response_status == 200 and redirect_codes_list.count(200) > 0:
+            pass
+        else:
+            redirect_codes_list.append(response_status)
+        logger.debug(f'fetch_page_with_playwright: {page_url} formed {redirect_codes_list=:}')
+
+    async with browser_pool.new_page(proxies_dict, get_domain_name_from_url(page_url)) as page:
+        await page.set_extra_http_headers({"Cache-Control": "no-cache"})
+        page.on("response", lambda response: set_response_code(response.status))
+        page.on("response", lambda response: append_redirect_codes_list(response.status))
+        logger.debug(f'playwright working on {page_url=:}, RAM memory % used: {psutil.virtual_memory()[2]}')
+        await page.goto(page_url)
+        await wait_for_page_rendered(page, link_urls=link_urls)
+        page_response.content = (await page.content()).encode('utf-8')
+        page_response.charset = 'utf-8'
+        logger.debug(f'playwright closing {page_url=:}, RAM memory % used: {psutil.virtual_memory()[2]}')
+
+
 class LinkChecker:
 
-    def __init__(self, session, start_mode=None):
+    def __init__(self, session, start_mode=None,
+                 concurrency=settings.LINK_CHECKER_CONCURRENCY,
+                 concurrency_per_host=settings.LINK_CHECKER_CONCURRENCY_PER_HOST,
+                 rate_limiter: HostRateLimiter = host_rate_limiter,
+                 proxy_manager: ProxyManager = proxy_manager):
 
         self.session = session
         self.start_mode = start_mode
         self.lcs_list = []
         self.check_with_proxies_link_ids = []
         self.check_with_pw_link_ids = []
+        # link_id: link check input, links are rechecked with proxies and playwright by their ids
+        self.links: dict[int, LinkCheckInput] = {}
+        # link_id: last linkcheck, which results can be carried forward
+        self.link_checks_last: dict[int, LinkCheckModel] = {}
+        self.concurrency = concurrency
+        self.concurrency_per_host = concurrency_per_host
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self.rate_limiter = rate_limiter
+        self.proxy_manager = proxy_manager
         os.environ["BROWSER_CONTEXT_SHARING_ENABLED"] = "true"
 
     def __repr__(self):
@@ -116,17 +439,38 @@ class LinkChecker:
         {self.check_with_pw_link_ids:=})"""
 
     async def check_links(
-            self, links: list[LinkModel],
-            timeout=TIMEOUT_5, limits=LIMITS_5,
+            self, links: list[LinkCheckInput],
+            timeout=TIMEOUT_5,
             mode: str | None = None,
             proxies_dict: dict | None = None,
             visit_from: str | None = None,
     ):
+        hostnames = {link.id: get_page_url_domain_name(link) for link in links}
+        ssl_task = asyncio.create_task(get_ssl_expiration_dates_cached(self.session, hostnames.values()))
+        self.lcs_list = await self.fetch_linkchecks(links, timeout=timeout, mode=mode,
+                                                    proxies_dict=proxies_dict, visit_from=visit_from)
+        # linkchecks are saved in threads, so with their own session, self.session is used by ssl_task in the loop
+        write_session = Session(bind=self.session.get_bind(), autoflush=False)
+        try:
+            await save_linkchecks_with_ssl(write_session, self.lcs_list, hostnames, ssl_task)
+        finally:
+            write_session.close()
+
+    async def fetch_linkchecks(
+            self, links: list[LinkCheckInput],
+            timeout=TIMEOUT_5,
+            mode: str | None = None,
+            proxies_dict: dict | None = None,
+            visit_from: str | None = None,
+    ) -> list[LinkCheckCreateSerializer]:
+        """network part of check_links: get link_check_serializer_list (lcs_list) for links
+        with all the rechecks with proxies and playwright, without writing anything to db"""
+        self.links = {link.id: link for link in links}
         if self.start_mode is None:
             # first fill link_check_serializer_list (lcs_list),
             self.lcs_list = await self.get_linkcheck_ser_list(
                 links,
-                timeout=timeout, limits=limits,
+                timeout=timeout,
                 mode=mode, proxies_dict=proxies_dict, visit_from=visit_from,
             )
 
@@ -141,38 +485,26 @@ class LinkChecker:
         if self.check_with_pw_link_ids:
             await self.check_links_with_playwright()
 
-        # then create linkchecks based on this lcs_list
-        linkchecks = create_many(self.session, LinkCheckModel, serializers=self.lcs_list)
-
-        # then update link.link_check_last_id, link.link_check_last_status, link.link_check_last_result_message
-        update_links(self.session, links, linkchecks)
-
-        # then start SSL checking of created links
-        linkchecks_id_list = [str(linkcheck.id) for linkcheck in linkchecks]
-        subprocess.run(
-            ["python3.10", "ssl_cli.py", "-l", *linkchecks_id_list],
-        )
+        return self.lcs_list
 
     async def check_links_with_proxies(self):
-        # current_proxy = ('AT Austria, Vienna', ('10.0.2.9', 3128))
-        current_proxy = get_next_proxy(proxy_ord_dict=settings.LINK_CHECKER_PROXY_ORDERED_DICT)
-        while self.check_with_proxies_link_ids and current_proxy is not None:
-            current_proxies_dict = get_proxies_dict(current_proxy)
-            current_visit_from = get_visit_from(current_proxy)
-
+        # proxies = [('AT Austria, Vienna', ('10.0.2.9', 3128)), ...], the healthiest first
+        proxies = self.proxy_manager.get_healthy_proxies()
+        race_size = settings.LINK_CHECKER_PROXY_RACE_SIZE
+        for race_proxies in chunks_generator(proxies, chunk_size=race_size):
+            if not self.check_with_proxies_link_ids:
+                break
             self.remove_errored_from_lcs_list(self.check_with_proxies_link_ids)
 
-            links = self.session.query(LinkModel).filter(LinkModel.id.in_(self.check_with_proxies_link_ids)).all()
+            links = [self.links[link_id] for link_id in self.check_with_proxies_link_ids]
             self.check_with_proxies_link_ids = []
             lcs_list_new = await self.get_linkcheck_ser_list(
                 links,
-                timeout=TIMEOUT_2, limits=LIMITS_5,
-                mode=None, proxies_dict=current_proxies_dict, visit_from=current_visit_from
+                timeout=TIMEOUT_2,
+                mode=None, race_proxies=race_proxies
             )
             self.lcs_list.extend(lcs_list_new)
-            current_proxy = get_next_proxy(proxy_ord_dict=settings.LINK_CHECKER_PROXY_ORDERED_DICT,
-                                           current_proxy=current_proxy)
-            # if still timeout_link_ids, then check with another proxy
+            # if still timeout_link_ids, then race the next proxies
         # if still timeout_link_ids after all proxies, then check with playwright
         if self.check_with_proxies_link_ids:
             self.check_with_pw_link_ids.extend(self.check_with_proxies_link_ids)
@@ -181,11 +513,11 @@ class LinkChecker:
     async def check_links_with_playwright(self):
         self.remove_errored_from_lcs_list(self.check_with_pw_link_ids)
 
-        current_proxy = get_next_proxy(proxy_ord_dict=settings.LINK_CHECKER_PROXY_ORDERED_DICT)
+        current_proxy = next(iter(self.proxy_manager.get_healthy_proxies(1)), None)
         current_proxies_dict = get_proxies_dict(current_proxy)
         current_visit_from = get_visit_from(current_proxy)
 
-        check_with_pw_links = self.session.query(LinkModel).filter(LinkModel.id.in_(self.check_with_pw_link_ids)).all()
+        check_with_pw_links = [self.links[link_id] for link_id in self.check_with_pw_link_ids]
         self.check_with_pw_link_ids = []
 
         for link_chunk in chunks_generator(check_with_pw_links, chunk_size=settings.PLAYWRIGHT_LINK_CHUNK_SIZE):
@@ -197,234 +529,407 @@ class LinkChecker:
             self.lcs_list.extend(lcs_list_new)
 
     async def get_linkcheck_ser_list(self,
-                                     links: list[LinkModel],
-                                     timeout=TIMEOUT_5, limits=LIMITS_5,
-                                     mode=None, proxies_dict=None, visit_from=None
+                                     links: list[LinkCheckInput],
+                                     timeout=TIMEOUT_5,
+                                     mode=None, proxies_dict=None, visit_from=None, race_proxies=None
                                      ) -> list:
-        async with httpx.AsyncClient(timeout=timeout, limits=limits, proxies=proxies_dict) as client:
-            for link in links:
-                pudomain_created, ludomain_created = recreate_domains(self.session, link)
-                if pudomain_created:
-                    check_pudomains_with_similarweb.delay(id_list=[link.page_url_domain_id])
-
-                tasks = [
-                    self.get_link_check_ser(client, link, mode=mode, proxies_dict=proxies_dict, visit_from=visit_from)
-                    for link in links]
-            link_check_ser_list = list(await asyncio.gather(*tasks))
-            return link_check_ser_list
-
-    async def get_link_check_ser(self, client: httpx.AsyncClient, link: LinkModel,
-                                 mode=None, proxies_dict=None, visit_from=None):
-        logger.debug(f'LinkChecker.get_link_check_ser({link.id=:}, {mode=:}, {proxies_dict=:}, {visit_from=:}')
-
-        response_code = None
-        redirect_codes_list = []
-        redirect_url = ''
-
-        anchor_text_found = ''
-        anchor_count = 0
-        link_url_others_count = 0
-        href_has_link_url_domain = False
-        href_with_link_url_domain = ''
-        href_is_found = False
-        href_has_rel = False
-        rel_has_nofollow = False
-        rel_has_sponsored = False
-        meta_robots_has_noindex = False
-        meta_robots_has_nofollow = False
-        page_content = ''
-
-        link_url_without_https = remove_https(link.link_url)
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-
-        async def set_response_code(response_status):
-            nonlocal response_code
-            response_code = response_status
-
-        async def append_redirect_codes_list(response_status):
-            nonlocal redirect_codes_list
-            if response_status == 200 and redirect_codes_list.count(200) > 0:
-                pass
-            else:
-                redirect_codes_list.append(response_status)
-            print(f'formed {redirect_codes_list=:}')
+        """link_check_ser of every link, checked with client of proxies_dict,
+        or through all of race_proxies at once (see fetch_page_racing_proxies)"""
+        links = self.recreate_domains(links)
+
+        if mode is None and settings.LINK_CHECKER_CONDITIONAL_RECHECKS:
+            self.link_checks_last = self.get_link_checks_last(links)
+
+        client = client_registry.get_client(proxies_dict)
+        link_check_ser_list = [
+            link_check_ser async for link_check_ser in self.iter_linkcheck_ser(
+                client, links, timeout=timeout, mode=mode, proxies_dict=proxies_dict, visit_from=visit_from,
+                race_proxies=race_proxies)
+        ]
+        return link_check_ser_list
+
+    def recreate_domains(self, links: list[LinkCheckInput]) -> list[LinkCheckInput]:
+        """recreate_domains_many for links, whose domain names are not the ones of their urls,
+        only those links are loaded as LinkModel, returns links with actual domain names"""
+        recreated_link_ids = [link.id for link in links if not is_link_check_input_domains_actual(link)]
+        if not recreated_link_ids:
+            return links
+        with observe_seconds(LINK_CHECKER_CHUNK_STAGE_SECONDS, 'domain_resolution'):
+            pudomain_created_ids = recreate_domains_many(
+                self.session, self.session.query(LinkModel).filter(LinkModel.id.in_(recreated_link_ids)).all())
+        if pudomain_created_ids:
+            check_pudomains_with_similarweb.delay(id_list=pudomain_created_ids)
+        self.links.update({link.id: link for link in get_link_check_inputs(self.session, recreated_link_ids)})
+        return [self.links.get(link.id, link) for link in links]
+
+    def get_link_checks_last(self, links: list[LinkCheckInput]) -> dict[int, LinkCheckModel]:
+        """last linkchecks of links, which can be carried forward if the page is not changed:
+        green ones, checked with httpx (or carried forward themselves), having page validators,
+        of the same link_url, anchor and domains the links have now"""
+        link_check_last_ids = [link.link_check_last_id for link in links if link.link_check_last_id]
+        if not link_check_last_ids:
+            return {}
+        link_checks_last = self.session.query(LinkCheckModel) \
+            .filter(LinkCheckModel.id.in_(link_check_last_ids)) \
+            .filter(LinkCheckModel.status == 'green') \
+            .filter(or_(LinkCheckModel.check_mode == None, LinkCheckModel.check_mode == 'cache')) \
+            .filter(or_(LinkCheckModel.response_etag != None,
+                        LinkCheckModel.response_last_modified != None,
+                        LinkCheckModel.content_hash != None)) \
+            .filter(LinkCheckModel.match_spec_hash != None) \
+            .all()
+        match_spec_hashes = {link.id: get_match_spec_hash(link) for link in links}
+        return {link_check.link_id: link_check for link_check in link_checks_last
+                if link_check.match_spec_hash == match_spec_hashes.get(link_check.link_id)}
+
+    async def iter_linkcheck_ser(self, client: httpx.AsyncClient, links: list[LinkCheckInput], timeout=TIMEOUT_5,
+                                 mode=None, proxies_dict=None, visit_from=None, race_proxies=None
+                                 ) -> AsyncIterator[LinkCheckCreateSerializer]:
+        """yield link_check_ser for every link as soon as its page is checked,
+        links placed on the same page_url are checked together with one fetch and parse of the page,
+        not more than self.concurrency pages at once and not more than self.concurrency_per_host
+        pages of the same page_url_domain at once, as fast as self.rate_limiter lets for page_url_domain.
+        throttled (429/503) pages are requested again when their host lets"""
+        links_by_page_url: dict[str, list[LinkCheckInput]] = {}
+        for link in links:
+            links_by_page_url.setdefault(link.page_url, []).append(link)
+
+        async def get_page_link_check_sers_bounded(page_links):
+            host = get_page_url_domain_name(page_links[0])
+            # host slot and host token are taken first, so pages waiting for a busy donor don't hold the common slots
+            async with self.get_host_semaphore(page_links[0]):
+                for retries_left in range(settings.LINK_CHECKER_THROTTLED_RETRIES, -1, -1):
+                    await self.rate_limiter.acquire(host)
+                    async with self.semaphore:
+                        try:
+                            return await self.get_page_link_check_sers(
+                                client, page_links, timeout=timeout, mode=mode, proxies_dict=proxies_dict,
+                                visit_from=visit_from, race_proxies=race_proxies, retry_throttled=retries_left > 0)
+                        except PageThrottledException as e:
+                            logger.debug(f'LinkChecker.iter_linkcheck_ser: {e}, retrying in {e.retry_delay} s')
+
+        # tasks are created here, not by as_completed (it makes them from a set, in arbitrary order),
+        # so pages take the slots in the order of interleave_by_host
+        for link_check_sers in asyncio.as_completed(
+                [asyncio.create_task(get_page_link_check_sers_bounded(page_links))
+                 for page_links in interleave_by_host(links_by_page_url.values())]):
+            for link_check_ser in await link_check_sers:
+                yield link_check_ser
+
+    def get_host_semaphore(self, link: LinkCheckInput) -> asyncio.Semaphore:
+        host = get_page_url_domain_name(link)
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.concurrency_per_host)
+        return self.host_semaphores[host]
+
+    async def get_page_link_check_sers(self, client: httpx.AsyncClient, links: list[LinkCheckInput], timeout=TIMEOUT_5,
+                                       mode=None, proxies_dict=None, visit_from=None, race_proxies=None,
+                                       retry_throttled=False) -> list[LinkCheckCreateSerializer]:
+        """link_check_ser of every link placed on the same page_url (in order of links),
+        the page is fetched and parsed once for all of them,
+        with race_proxies - through all of them at once, visit_from is the one of the proxy answered first.
+
+        with retry_throttled - PageThrottledException is raised if the page host throttled the request
+        and asked to wait not longer than self.rate_limiter backoff_max"""
+        page_url = links[0].page_url
+        logger.debug(f'LinkChecker.get_page_link_check_sers({[link.id for link in links]}, {mode=:}, '
+                     f'{proxies_dict=:}, {visit_from=:}')
+        page_response = PageResponse()
+        link_checks_last = [self.link_checks_last.get(link.id) if mode is None else None for link in links]
+        # link edited since its last linkcheck (links_update) is checked as a new one
+        link_checks_last = [link_check_last if link_check_last is not None and
+                            link_check_last.match_spec_hash == get_match_spec_hash(link) else None
+                            for link, link_check_last in zip(links, link_checks_last)]
 
         try:
-            # get response_code and page_content with playwright
+            # get response_code and page content with playwright
             if mode == 'playwright':
-                async with async_playwright() as p:
-                    browser = await p.webkit.launch(
-                        proxy=get_proxy_for_playwright(proxies_dict),
-                        headless=True
-                    )
-                    context = await browser.new_context(ignore_https_errors=True)
-                    page = await context.new_page()
-                    await page.set_extra_http_headers({"Cache-Control": "no-cache"})
-                    page.on("response", lambda response: set_response_code(response.status))
-                    page.on("response", lambda response: append_redirect_codes_list(response.status))
-                    logger.debug(
-                        f'playwright working on {link.id=:}, {link.page_url=:}, RAM memory % used: {psutil.virtual_memory()[2]}')
-                    await page.goto(link.page_url)
-                    await page.wait_for_timeout(15000)
-                    page_content = await page.content()
-                    logger.debug(
-                        f'playwright closing {link.id=:}, {link.page_url=:}, RAM memory % used: {psutil.virtual_memory()[2]}')
-                    await context.clear_cookies()
-                    await browser.close()
-
-            # get response_code and page_content with httpx.AsyncClient
+                await fetch_page_with_playwright(page_response, page_url, [link.link_url for link in links],
+                                                 proxies_dict=proxies_dict)
+
+            # get response_code and page content with httpx.AsyncClient
             else:
-                request = client.build_request("GET", link.page_url, headers=headers)
-                while request is not None:
-                    response = await client.send(request)
-                    response_code = response.status_code
-                    redirect_codes_list.append(response_code)
-                    if len(redirect_codes_list) > 20:
-                        break
-                    if response.next_request:
-                        redirect_url = str(response.next_request.url)
-                    try:
-                        page_content = response.content.decode('utf-8', 'strict')
-                    except UnicodeDecodeError:
-                        try:
-                            page_content = response.content.decode('latin-1', 'strict')
-                        except UnicodeDecodeError:
-                            page_content = response.content.decode('utf-8', 'ignore')
-
-                    request = response.next_request
-                if response_code == 403 or response_code == 503:
-                    raise CheckWithPlaywrightException(f'forbidden with response code {response_code}',
-                                                       response_code=response_code)
-
-            # getting soup data
-            soup = BeautifulSoup(page_content, 'html.parser')
-            for m in soup.find_all('meta'):
-                m_name = m.get('name')
-                if m_name == 'robots':
-                    m_content = m.get('content')
-                    if 'noindex' in m_content:
-                        meta_robots_has_noindex = True
-                    if 'nofollow' in m_content:
-                        meta_robots_has_nofollow = True
-                    break
-            found_anchors = soup.find_all('a')
-
-            # count anchor.link_url == link.link_url from all found_anchors
-            for a in found_anchors:
-                current_a_href = a.get('href')
-                if current_a_href is None:
-                    continue
-                if current_a_href == link.link_url \
-                        or current_a_href.strip('/') == link.link_url.strip('/') \
-                        or current_a_href.strip('/') == link_url_without_https.strip('/'):
-                    anchor_count += 1
-
-            # check matches with link
-            for a in found_anchors:
-
-                current_a_href = a.get('href')
-                if current_a_href is None:
-                    continue
-                current_a_href_domain_name = get_domain_name_from_url(current_a_href) if current_a_href else None
-                if current_a_href_domain_name:
-                    # check if current_a_href goes to other domain
-                    if current_a_href_domain_name not in (link.page_url_domain.name,
-                                                          link.link_url_domain.name):
-                        link_url_others_count += 1
-                        continue
-                    # check if current_a_href goes to acceptor domain
-                    if current_a_href_domain_name == link.link_url_domain.name:
-                        href_has_link_url_domain = True
-                        href_with_link_url_domain = current_a_href
-                        # check if current_a_href is the same as link_url
-                        if current_a_href == link.link_url \
-                                or current_a_href.strip('/') == link.link_url.strip('/') \
-                                or current_a_href.strip('/') == link_url_without_https.strip('/'):
-                            href_is_found = True
-                            anchor_text_found = a.getText()
-
-                            rel = a.get('rel')
-                            if rel:
-                                href_has_rel = True
-                                if 'nofollow' in rel:
-                                    rel_has_nofollow = True
-                                if 'sponsored' in rel:
-                                    rel_has_sponsored = True
-                            # if at least once href_is_found, no need to seek further
-                            break
+                headers = {**HEADERS, **get_conditional_headers(link_checks_last)}
+                if race_proxies:
+                    page_response, proxy = await self.fetch_page_racing_proxies(page_url, headers, timeout, race_proxies)
+                    visit_from = get_visit_from(proxy)
+                else:
+                    await fetch_page_with_httpx(client, page_response, page_url, headers=headers, timeout=timeout)
+                retry_delay = self.rate_limiter.on_response(get_page_url_domain_name(links[0]),
+                                                            page_response.response_code, page_response.retry_after)
+                if retry_throttled and retry_delay is not None:
+                    raise PageThrottledException(
+                        f'{page_url} throttled with response code {page_response.response_code}',
+                        response_code=page_response.response_code, retry_delay=retry_delay)
+                if page_response.response_code == 403 or page_response.response_code == 503:
+                    raise CheckWithPlaywrightException(
+                        f'forbidden with response code {page_response.response_code}',
+                        response_code=page_response.response_code)
+        except PageThrottledException:
+            raise
+        except Exception as e:
+            page_match = get_page_match_default()
+            return [self.get_link_check_ser_errored(link, page_response, page_match, e, mode=mode,
+                                                    visit_from=visit_from) for link in links]
+
+        link_check_sers: list[LinkCheckCreateSerializer | None] = [None for _ in links]
+        parse_indexes = []
+        for i, link_check_last in enumerate(link_checks_last):
+            # page is not changed since link_check_last, so its results are carried forward without parsing
+            if link_check_last is not None and (
+                    page_response.response_code == 304 or
+                    (page_response.content_hash is not None and
+                     page_response.content_hash == link_check_last.content_hash)
+            ):
+                logger.debug(f'LinkChecker.get_page_link_check_sers: {links[i].id=:} is not changed, '
+                             f'{page_response.response_code=:}')
+                link_check_sers[i] = get_link_check_ser_from_cache(link_check_last, page_response.etag,
+                                                                   page_response.last_modified)
+            else:
+                parse_indexes.append(i)
+
+        if parse_indexes:
+            # getting page data of every link from one parse of the page
+            link_match_specs = [LinkMatchSpec(link_url=links[i].link_url,
+                                              page_url_domain_name=links[i].page_url_domain_name,
+                                              link_url_domain_name=links[i].link_url_domain_name)
+                                for i in parse_indexes]
+            try:
+                page_matches = await parse_page_async(page_response.content, link_match_specs, page_response.charset)
+            except Exception as e:
+                page_matches = [get_page_match_default() for _ in parse_indexes]
+                for i, page_match in zip(parse_indexes, page_matches):
+                    link_check_sers[i] = self.get_link_check_ser_errored(links[i], page_response, page_match, e,
+                                                                         mode=mode, visit_from=visit_from)
+            else:
+                for i, page_match in zip(parse_indexes, page_matches):
+                    link_check_sers[i] = self.get_link_check_ser(links[i], page_response, page_match,
+                                                                 mode=mode, visit_from=visit_from)
+        return link_check_sers
+
+    async def fetch_page_racing_proxies(self, page_url: str, headers: dict, timeout, proxies: list[tuple]
+                                        ) -> tuple[PageResponse, tuple]:
+        """page_response of page_url requested through all proxies at once and the proxy which answered first,
+        the other requests are cancelled. proxy which didn't answer at all (transport error)
+        or answered with PROXY_FAILURE_RESPONSE_CODES loses the race,
+        if none of them answered - timeout one (if any of them timed out, so the link is rechecked in the next race
+        or with playwright as a timed out one) is raised, otherwise the first proxy failure response is returned
+        or the last transport error is raised.
+        self.proxy_manager gets latency of the first proxy, failures of ones failed before it
+        and latency of the cancelled ones (not less than the first one's)"""
+
+        started_at = time.monotonic()
+
+        async def fetch_page_with_proxy(proxy):
+            page_response = PageResponse()
+            try:
+                await fetch_page_with_httpx(client_registry.get_client(get_proxies_dict(proxy)), page_response,
+                                            page_url, headers=headers, timeout=timeout)
+            except httpx.TransportError:
+                self.proxy_manager.on_failure(proxy)
+                raise
+            except asyncio.CancelledError:
+                self.proxy_manager.on_cancelled(proxy, time.monotonic() - started_at)
+                raise
+            if page_response.response_code in PROXY_FAILURE_RESPONSE_CODES:
+                self.proxy_manager.on_failure(proxy)
+            else:
+                self.proxy_manager.on_success(proxy, time.monotonic() - started_at)
+            return page_response, proxy
 
+        fetch_tasks = [asyncio.create_task(fetch_page_with_proxy(proxy)) for proxy in proxies]
+        try:
+            transport_error, timeout_error, proxy_failure_result = None, None, None
+            for fetch_task in asyncio.as_completed(fetch_tasks):
+                try:
+                    page_response, proxy = await fetch_task
+                except httpx.TimeoutException as e:
+                    timeout_error = e
+                except httpx.TransportError as e:
+                    transport_error = e
+                else:
+                    if page_response.response_code not in PROXY_FAILURE_RESPONSE_CODES:
+                        return page_response, proxy
+                    proxy_failure_result = proxy_failure_result or (page_response, proxy)
+            if timeout_error is None and proxy_failure_result is not None:
+                return proxy_failure_result
+            raise timeout_error or transport_error
+        finally:
+            for fetch_task in fetch_tasks:
+                fetch_task.cancel()
+            await asyncio.gather(*fetch_tasks, return_exceptions=True)
+
+    def get_link_check_ser(self, link: LinkCheckInput, page_response: PageResponse, page_match: dict,
+                           mode=None, visit_from=None) -> LinkCheckCreateSerializer:
+        """link_check_ser of link from response of its page and page data of link"""
+        try:
             # issue #70: for cases that require loading js scripts first and then parsing data
             # issue #75: there are sites that render hrefs depending on current location, so better check with playwright and proxy
             if (
                     mode is None and
                     visit_from is None and
-                    response_code == 200 and
-                    not href_has_link_url_domain and
-                    not href_is_found
+                    page_response.response_code == 200 and
+                    not page_match['href_has_link_url_domain'] and
+                    not page_match['href_is_found']
             ):
                 raise CheckWithPlaywrightException(
                     f'response code: 200, but havn\'t found project domain or acceptor, trying to load js script first',
-                    response_code=response_code)
+                    response_code=page_response.response_code)
 
             status, result_message = get_status_and_message(
-                response_code=response_code,
-                redirect_codes_list=redirect_codes_list,
-                href_has_link_url_domain=href_has_link_url_domain,
-                href_with_link_url_domain=href_with_link_url_domain,
-                href_is_found=href_is_found,
-                rel_has_nofollow=rel_has_nofollow,
-                rel_has_sponsored=rel_has_sponsored,
-                meta_robots_has_noindex=meta_robots_has_noindex,
-                meta_robots_has_nofollow=meta_robots_has_nofollow,
+                response_code=page_response.response_code,
+                redirect_codes_list=page_response.redirect_codes_list,
+                href_has_link_url_domain=page_match['href_has_link_url_domain'],
+                href_with_link_url_domain=page_match['href_with_link_url_domain'],
+                href_is_found=page_match['href_is_found'],
+                rel_has_nofollow=page_match['rel_has_nofollow'],
+                rel_has_sponsored=page_match['rel_has_sponsored'],
+                meta_robots_has_noindex=page_match['meta_robots_has_noindex'],
+                meta_robots_has_nofollow=page_match['meta_robots_has_nofollow'],
                 anchor_text=link.anchor,
-                anchor_text_found=anchor_text_found,
+                anchor_text_found=page_match['anchor_text_found'],
                 mode=mode,
                 visit_from=visit_from)
+        except Exception as e:
+            return self.get_link_check_ser_errored(link, page_response, page_match, e, mode=mode, visit_from=visit_from)
 
-        except (CheckWithPlaywrightException, ssl.SSLError, ssl.SSLCertVerificationError) as e:
-            status = 'red'
-            result_message = f"error: {str(e.__class__).replace('<', '').replace('>', '')} {str(e)}, {mode=:}, {visit_from=:}"
-            self.check_with_pw_link_ids.append(link.id)
-            logger.error(result_message)
-        except httpx.TimeoutException as e:
-            status = 'red'
+        return get_link_check_ser_from_page(link, page_response, page_match, status, result_message, mode=mode)
+
+    def get_link_check_ser_errored(self, link: LinkCheckInput, page_response: PageResponse, page_match: dict,
+                                   e: Exception, mode=None, visit_from=None) -> LinkCheckCreateSerializer:
+        """red link_check_ser of link, which check failed with e,
+        link is put to be rechecked with proxies (on timeout) or with playwright (when page needs a real browser)"""
+        if isinstance(e, httpx.TimeoutException):
             result_message = f"error: httpx.TimeoutException, {str(e)}, {mode=:}, {visit_from=:}"
             self.check_with_proxies_link_ids.append(link.id)
-            logger.error(result_message)
-        except (PlaywrightError, PlaywrightTimeoutError) as e:
-            status = 'red'
-            result_message = f"error: {str(e.__class__).replace('<', '').replace('>', '')} {str(e)}, {mode=:}, {visit_from=:}"
-            self.check_with_pw_link_ids.append(link.id)
-            logger.error(result_message)
-        except Exception as e:
-            status = 'red'
+        else:
             result_message = f"error: {str(e.__class__).replace('<', '').replace('>', '')} {str(e)}, {mode=:}, {visit_from=:}"
-            logger.error(result_message)
-
-        link_check_ser = LinkCheckCreateSerializer(
-            link_id=link.id,
-            # page_content=page_content if mode == 'playwright' else None,
-            response_code=response_code,
-            redirect_codes_list=str(redirect_codes_list),
-            redirect_url=redirect_url,
-            anchor_text_found=anchor_text_found,
-            anchor_count=anchor_count,
-            link_url_others_count=link_url_others_count,
-            href_is_found=href_is_found,
-            href_has_rel=href_has_rel,
-            rel_has_nofollow=rel_has_nofollow,
-            rel_has_sponsored=rel_has_sponsored,
-            meta_robots_has_noindex=meta_robots_has_noindex,
-            meta_robots_has_nofollow=meta_robots_has_nofollow,
-            status=status,
-            result_message=result_message,
-            check_mode=mode
-        )
-
-        return link_check_ser
+            if isinstance(e, (CheckWithPlaywrightException, ssl.SSLError, ssl.SSLCertVerificationError,
+                              PlaywrightError, PlaywrightTimeoutError)):
+                self.check_with_pw_link_ids.append(link.id)
+        logger.error(result_message)
+        return get_link_check_ser_from_page(link, page_response, page_match, 'red', result_message, mode=mode)
 
     def remove_errored_from_lcs_list(self, error_link_ids):
         error_lcs_list = [lcs for lcs in self.lcs_list if lcs.link_id in error_link_ids]
 
         for error_lcs in error_lcs_list:
             self.lcs_list.remove(error_lcs)
+
+
+def save_linkchecks(session: Session, lcs_list: list[LinkCheckCreateSerializer]) -> list[sa.engine.Row]:
+    """db part of check_links: create linkchecks from lcs_list, update their links and schedules in one transaction,
+    returns rows of created linkchecks (link_id and LINK_CHECK_LAST_COLUMNS)"""
+    # first create linkchecks based on this lcs_list
+    linkchecks = insert_many(session, LinkCheckModel, lcs_list,
+                             LinkCheckModel.link_id,
+                             *[LinkCheckModel.__table__.c[name] for name in LINK_CHECK_LAST_COLUMNS])
+
+    # then update link.link_check_last_id, link.link_check_last_status, link.link_check_last_result_message
+    update_links(session, linkchecks)
+    # and the next check time of the links
+    update_link_schedules(session, linkchecks)
+    session.commit()
+    count_linkchecks(lcs_list)
+    return linkchecks
+
+
+async def save_linkchecks_with_ssl(session: Session, lcs_list: list[LinkCheckCreateSerializer],
+                                   hostnames: dict[int, str],
+                                   ssl_task: asyncio.Task) -> list[sa.engine.Row]:
+    """save_linkchecks in a thread, then write ssl expiration dates of their page hosts (link_id: hostname),
+    got by ssl_task (get_ssl_expiration_dates_cached) while links were being checked"""
+    started_at = time.perf_counter()
+    linkchecks = await asyncio.to_thread(save_linkchecks, session, lcs_list)
+    db_write_seconds = time.perf_counter() - started_at
+    ssl_expiration_dates, ssl_expiration_dates_probed = await ssl_task
+    started_at = time.perf_counter()
+    await asyncio.to_thread(update_pudomains_ssl, session, ssl_expiration_dates_probed)
+    await asyncio.to_thread(update_linkchecks_ssl, session, {
+        linkcheck.id: ssl_expiration_dates.get(hostnames.get(linkcheck.link_id)) for linkcheck in linkchecks
+    })
+    # db_write of the chunk is its linkchecks and their ssl, without waiting for ssl_task between them
+    LINK_CHECKER_CHUNK_STAGE_SECONDS.labels('db_write').observe(db_write_seconds + time.perf_counter() - started_at)
+    return linkchecks
+
+
+async def save_linkchecks_and_release(session: Session, lcs_list: list[LinkCheckCreateSerializer],
+                                      hostnames: dict[int, str], ssl_task: asyncio.Task,
+                                      registry: InFlightRegistry) -> list[sa.engine.Row]:
+    """save_linkchecks_with_ssl, then release links of hostnames (link_id: hostname) from in-flight registry,
+    as checked if their linkchecks are saved"""
+    is_saved = False
+    try:
+        linkchecks = await save_linkchecks_with_ssl(session, lcs_list, hostnames, ssl_task)
+        is_saved = True
+        return linkchecks
+    finally:
+        await asyncio.to_thread(registry.release, hostnames.keys(), is_saved)
+
+
+async def check_links_in_chunks(session: Session, link_chunks: Iterable[list[LinkCheckInput]],
+                                start_mode: str | None = None, write_session: Session | None = None,
+                                registry: InFlightRegistry = inflight_registry, reuse_results=False) -> int:
+    """check all link_chunks in one event loop, chunk by chunk:
+    while linkchecks of the previous chunk are being saved to db (in a thread, with write_session),
+    the next chunk is already being fetched (in the loop, with session),
+    ssl certificates of page hosts of every chunk are probed in the same loop.
+
+    links in flight in other tasks are skipped (see registry),
+    with reuse_results (scheduled and bulk checks) - also ones checked within LINK_CHECKER_RESULT_TTL
+
+    write_session (SessionLocal() if not given) is closed here only if it was not given
+
+    returns count of checked links"""
+    is_write_session_created = write_session is None
+    write_session = write_session or SessionLocal()
+    save_task = None
+    links_count = 0
+    try:
+        for chunk_num, link_chunk in enumerate(link_chunks, start=1):
+            claimed_link_ids = set(await asyncio.to_thread(
+                registry.claim, [link.id for link in link_chunk], reuse_results))
+            if len(claimed_link_ids) < len(link_chunk):
+                skipped_link_ids = [link.id for link in link_chunk if link.id not in claimed_link_ids]
+                if reuse_results:
+                    logger.debug(f'check_links_in_chunks: {len(skipped_link_ids)} links of chunk {chunk_num} '
+                                 f'are skipped, they are in flight or just checked')
+                else:
+                    logger.error(f'check_links_in_chunks: links of chunk {chunk_num} are not checked, '
+                                 f'they are in flight in other tasks: {skipped_link_ids}')
+                link_chunk = [link for link in link_chunk if link.id in claimed_link_ids]
+            if not link_chunk:
+                continue
+            logger.debug(f'check_links_in_chunks: fetching chunk {chunk_num} of {len(link_chunk)} links')
+            linkchecker = LinkChecker(session, start_mode=start_mode)
+            # ssl certificates of chunk's page hosts are probed meanwhile links are checked
+            hostnames = {link.id: get_page_url_domain_name(link) for link in link_chunk}
+            ssl_task = asyncio.create_task(get_ssl_expiration_dates_cached(session, hostnames.values()))
+            fetch_started_at = time.perf_counter()
+            try:
+                with observe_seconds(LINK_CHECKER_CHUNK_STAGE_SECONDS, 'fetch'):
+                    lcs_list = await linkchecker.fetch_linkchecks(link_chunk)
+            except BaseException:
+                ssl_task.cancel()
+                await asyncio.to_thread(registry.release, claimed_link_ids, False)
+                raise
+            links_count += len(link_chunk)
+            logger.debug(f'check_links_in_chunks: chunk={chunk_num} links={len(link_chunk)} '
+                         f'linkchecks={len(lcs_list)} fetch_s={time.perf_counter() - fetch_started_at:.3f}')
+
+            # only one chunk is being saved at a time, write_session is not shared between threads
+            if save_task is not None:
+                await save_task
+            save_task = asyncio.create_task(
+                save_linkchecks_and_release(write_session, lcs_list, hostnames, ssl_task, registry))
+        if save_task is not None:
+            await save_task
+    finally:
+        # on errors the previous chunk could be still being saved with write_session in a thread
+        if save_task is not None and not save_task.done():
+            await asyncio.wait([save_task])
+            if not save_task.cancelled() and save_task.exception() is not None:
+                logger.error(f'check_links_in_chunks: previous chunk is not saved, {save_task.exception()!r}')
+        if is_write_session_created:
+            write_session.close()
+    return links_count
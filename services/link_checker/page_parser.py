@@ -0,0 +1,305 @@
+import asyncio
+import codecs
+import logging
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+from billiard.pool import Pool
+from bs4 import BeautifulSoup
+
+from core.config import settings
+from core.metrics import LINK_CHECKER_STAGE_SECONDS
+from core.shared import remove_https
+from services.domain_checker.domain_checker import get_domain_name_from_url
+
+logger = logging.getLogger(name='link_checker')
+
+
+class LinkMatchSpec(NamedTuple):
+    """what is looked for on the page for one link"""
+    link_url: str
+    page_url_domain_name: str
+    link_url_domain_name: str
+
+
+def get_page_match_default() -> dict:
+    """page data of one link, is passed to get_status_and_message and LinkCheckCreateSerializer"""
+    return {
+        'anchor_text_found': '',
+        'anchor_count': 0,
+        'link_url_others_count': 0,
+        'href_has_link_url_domain': False,
+        'href_with_link_url_domain': '',
+        'href_is_found': False,
+        'href_has_rel': False,
+        'rel_has_nofollow': False,
+        'rel_has_sponsored': False,
+        'meta_robots_has_noindex': False,
+        'meta_robots_has_nofollow': False,
+    }
+
+
+def is_href_of_link_url(href: str, link_url: str) -> bool:
+    """if href of found <a> is considered to be link_url (the same as, or without https: or surrounding slashes)"""
+    link_url_without_https = remove_https(link_url)
+    return href == link_url \
+        or href.strip('/') == link_url.strip('/') \
+        or href.strip('/') == link_url_without_https.strip('/')
+
+
+def set_meta_robots(page_match: dict, meta_content: str | None) -> None:
+    meta_content = meta_content or ''
+    if 'noindex' in meta_content:
+        page_match['meta_robots_has_noindex'] = True
+    if 'nofollow' in meta_content:
+        page_match['meta_robots_has_nofollow'] = True
+
+
+def set_rel(page_match: dict, rel: list[str] | None) -> None:
+    if rel:
+        page_match['href_has_rel'] = True
+        if 'nofollow' in rel:
+            page_match['rel_has_nofollow'] = True
+        if 'sponsored' in rel:
+            page_match['rel_has_sponsored'] = True
+
+
+def get_page_match_soup(page_content: str, spec: LinkMatchSpec) -> dict:
+    """page data of one link from the full BeautifulSoup tree of page_content"""
+    return get_page_match_from_soup(BeautifulSoup(page_content, 'html.parser'), spec)
+
+
+def get_page_match_from_soup(soup: BeautifulSoup, spec: LinkMatchSpec) -> dict:
+    """page data of one link from already built BeautifulSoup tree of the page"""
+    page_match = get_page_match_default()
+    for m in soup.find_all('meta'):
+        if m.get('name') == 'robots':
+            set_meta_robots(page_match, m.get('content'))
+            break
+    found_anchors = soup.find_all('a')
+
+    # count anchor.link_url == link.link_url from all found_anchors
+    for a in found_anchors:
+        current_a_href = a.get('href')
+        if current_a_href is None:
+            continue
+        if is_href_of_link_url(current_a_href, spec.link_url):
+            page_match['anchor_count'] += 1
+
+    # check matches with link
+    for a in found_anchors:
+        current_a_href = a.get('href')
+        if current_a_href is None:
+            continue
+        current_a_href_domain_name = get_domain_name_from_url(current_a_href) if current_a_href else None
+        if current_a_href_domain_name:
+            # check if current_a_href goes to other domain
+            if current_a_href_domain_name not in (spec.page_url_domain_name, spec.link_url_domain_name):
+                page_match['link_url_others_count'] += 1
+                continue
+            # check if current_a_href goes to acceptor domain
+            if current_a_href_domain_name == spec.link_url_domain_name:
+                page_match['href_has_link_url_domain'] = True
+                page_match['href_with_link_url_domain'] = current_a_href
+                # check if current_a_href is the same as link_url
+                if is_href_of_link_url(current_a_href, spec.link_url):
+                    page_match['href_is_found'] = True
+                    page_match['anchor_text_found'] = a.getText()
+                    set_rel(page_match, a.get('rel'))
+                    # if at least once href_is_found, no need to seek further
+                    break
+    return page_match
+
+
+class LinkScanner(HTMLParser):
+    """one pass (SAX-style) scanner of page html, doesn't build any tree,
+    only looks at <meta name="robots"> and <a> tags and collects page data for every spec
+    by the same rules as get_page_match_soup.
+
+    the whole page is read, as anchor_count and meta robots after the found href are saved as exact,
+    the page is limited by LINK_CHECKER_MAX_PAGE_BYTES when it is read"""
+
+    def __init__(self, specs: list[LinkMatchSpec]):
+        super().__init__(convert_charrefs=True)
+        self.specs = specs
+        self.page_matches = [get_page_match_default() for _ in specs]
+        self.is_match_finished = [False for _ in specs]
+        self.is_meta_robots_found = False
+        # indexes of specs, whose anchor text is being read from the currently open <a>
+        self.reading_text_spec_indexes: list[int] = []
+        self.a_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta' and not self.is_meta_robots_found:
+            attrs = dict(attrs)
+            if attrs.get('name') == 'robots':
+                self.is_meta_robots_found = True
+                for page_match in self.page_matches:
+                    set_meta_robots(page_match, attrs.get('content'))
+        elif tag == 'a':
+            self.a_depth += 1
+            attrs = dict(attrs)
+            href = attrs.get('href')
+            if href is not None:
+                self.handle_href(href, attrs.get('rel'))
+
+    def handle_href(self, href: str, rel: str | None):
+        href_domain_name = get_domain_name_from_url(href) if href else None
+        for i, spec in enumerate(self.specs):
+            page_match = self.page_matches[i]
+            is_href_of_spec = is_href_of_link_url(href, spec.link_url)
+            if is_href_of_spec:
+                page_match['anchor_count'] += 1
+            if self.is_match_finished[i] or not href_domain_name:
+                continue
+            # check if href goes to other domain
+            if href_domain_name not in (spec.page_url_domain_name, spec.link_url_domain_name):
+                page_match['link_url_others_count'] += 1
+                continue
+            # check if href goes to acceptor domain
+            if href_domain_name == spec.link_url_domain_name:
+                page_match['href_has_link_url_domain'] = True
+                page_match['href_with_link_url_domain'] = href
+                if is_href_of_spec:
+                    page_match['href_is_found'] = True
+                    set_rel(page_match, rel.split() if rel is not None else None)
+                    self.is_match_finished[i] = True
+                    self.reading_text_spec_indexes.append(i)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self.a_depth > 0:
+            self.a_depth -= 1
+            if self.a_depth == 0:
+                self.reading_text_spec_indexes = []
+
+    def handle_data(self, data):
+        for i in self.reading_text_spec_indexes:
+            self.page_matches[i]['anchor_text_found'] += data
+
+
+def get_page_matches_scanner(page_content: str, specs: list[LinkMatchSpec], feed_size=64 * 1024) -> list[dict]:
+    """page data of every spec from one pass of LinkScanner over page_content, fed by feed_size pieces"""
+    scanner = LinkScanner(specs)
+    for i in range(0, len(page_content), feed_size):
+        scanner.feed(page_content[i:i + feed_size])
+    scanner.close()
+    return scanner.page_matches
+
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+
+
+def get_page_encoding(content: bytes, charset: str | None = None) -> str | None:
+    """encoding of page content: charset from response content-type header,
+    or from <meta charset> / <meta http-equiv="content-type"> in the beginning of the page, or None if not declared"""
+    if charset is None:
+        match = META_CHARSET_RE.search(content[:4096])
+        charset = match.group(1).decode('ascii') if match else None
+    if charset is not None:
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            return None
+    return None
+
+
+def decode_page_content(content: bytes, charset: str | None = None) -> str:
+    """decode content with its declared encoding,
+    not declared is taken as utf-8 (a cut multibyte char at the end is dropped) or latin-1 if it is not utf-8"""
+    encoding = get_page_encoding(content, charset)
+    if encoding is not None:
+        return content.decode(encoding, 'replace')
+    try:
+        return content.decode('utf-8', 'strict')
+    except UnicodeDecodeError as e:
+        if e.reason == 'unexpected end of data':
+            return content[:e.start].decode('utf-8', 'strict')
+        return content.decode('latin-1', 'strict')
+
+
+def parse_page(content: bytes, specs: list[LinkMatchSpec], charset: str | None = None,
+               parser=settings.LINK_CHECKER_PAGE_PARSER) -> list[dict]:
+    """page data of every spec with configured parser: 'scanner' (LinkScanner) or 'soup' (BeautifulSoup),
+    takes and returns only picklable objects, so can be run in parse_executor process"""
+    return parse_page_timed(content, specs, charset, parser)[0]
+
+
+def parse_page_timed(content: bytes, specs: list[LinkMatchSpec], charset: str | None = None,
+                     parser=settings.LINK_CHECKER_PAGE_PARSER) -> tuple[list[dict], float, float]:
+    """parse_page, with its seconds of parse (decoding, and building the tree with soup) and of match (looking for specs,
+    LinkScanner parses and matches in the same pass, so its pass is all match)"""
+    started_at = time.perf_counter()
+    page_content = decode_page_content(content, charset)
+    if parser == 'soup':
+        soup = BeautifulSoup(page_content, 'html.parser')
+        parsed_at = time.perf_counter()
+        page_matches = [get_page_match_from_soup(soup, spec) for spec in specs]
+    else:
+        parsed_at = time.perf_counter()
+        page_matches = get_page_matches_scanner(page_content, specs)
+    return page_matches, parsed_at - started_at, time.perf_counter() - parsed_at
+
+
+parse_executor: Pool | None = None
+parse_executor_lock = threading.Lock()
+
+
+def get_parse_executor() -> Pool | None:
+    """process pool living as long as the worker process, None if LINK_CHECKER_PARSE_PROCESSES is 0.
+    it is billiard pool, as celery prefork pool processes are daemonic
+    and multiprocessing doesn't let daemonic processes have children, billiard does.
+    starting the pool forks its processes, so it is called in a thread, not in the event loop"""
+    global parse_executor
+    with parse_executor_lock:
+        if parse_executor is None and settings.LINK_CHECKER_PARSE_PROCESSES > 0:
+            parse_executor = Pool(processes=settings.LINK_CHECKER_PARSE_PROCESSES)
+        return parse_executor
+
+
+def shutdown_parse_executor():
+    global parse_executor
+    with parse_executor_lock:
+        if parse_executor is not None:
+            parse_executor.terminate()
+            parse_executor.join()
+            parse_executor = None
+
+
+async def apply_in_parse_executor(executor: Pool, func, *args):
+    """result of func(*args) run in executor process, awaited in the event loop.
+    job of a process died while running it is never done in billiard pool (its process is replaced),
+    so it is awaited not longer than LINK_CHECKER_PARSE_TIMEOUT seconds"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_future(set_result_or_exception, value):
+        if not future.done():
+            set_result_or_exception(value)
+
+    executor.apply_async(
+        func, args,
+        callback=lambda result: loop.call_soon_threadsafe(set_future, future.set_result, result),
+        error_callback=lambda exception: loop.call_soon_threadsafe(set_future, future.set_exception, exception),
+    )
+    return await asyncio.wait_for(future, timeout=settings.LINK_CHECKER_PARSE_TIMEOUT)
+
+
+async def parse_page_async(content: bytes, specs: list[LinkMatchSpec], charset: str | None = None) -> list[dict]:
+    """parse_page in parse_executor process, so big pages don't block the event loop and use other cpu cores,
+    pages smaller than LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES (or all pages without parse_executor)
+    are parsed right in the loop.
+    seconds of parse and match are observed in LINK_CHECKER_STAGE_SECONDS of this process"""
+    executor = None
+    if len(content) >= settings.LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES:
+        executor = parse_executor or await asyncio.to_thread(get_parse_executor)
+    if executor is None:
+        page_matches, parse_seconds, match_seconds = parse_page_timed(content, specs, charset)
+    else:
+        page_matches, parse_seconds, match_seconds = await apply_in_parse_executor(
+            executor, parse_page_timed, content, specs, charset)
+    LINK_CHECKER_STAGE_SECONDS.labels('parse').observe(parse_seconds)
+    LINK_CHECKER_STAGE_SECONDS.labels('match').observe(match_seconds)
+    return page_matches
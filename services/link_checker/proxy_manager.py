@@ -0,0 +1,81 @@
+import logging
+import time
+from collections import OrderedDict
+
+from core.config import settings
+from core.shared import get_proxies_dict, get_proxy_key
+
+logger = logging.getLogger(name='link_checker')
+
+# response codes proxy answers with itself when it can't get the page (auth required, upstream failed or timed out)
+PROXY_FAILURE_RESPONSE_CODES = (407, 502, 503, 504)
+
+
+class ProxyStats:
+    """health of one proxy: exponentially weighted moving averages of its success and latency"""
+
+    def __init__(self):
+        self.success_rate = 1.0
+        self.latency = 0.0
+        self.failures_in_row = 0
+        self.dead_until = 0.0
+
+    def __repr__(self):
+        return f"<ProxyStats> ({self.success_rate=:}, {self.latency=:}, {self.failures_in_row=:})"
+
+
+class ProxyManager:
+    """proxies of proxy_ord_dict ranked by their health, living as long as the worker process.
+
+    proxy failed (not answered at all) dead_failures times in a row is dead and is skipped for cooldown seconds,
+    healthy ones are ranked by success rate, then by latency, proxies with equal health keep the order of proxy_ord_dict"""
+
+    def __init__(self,
+                 proxy_ord_dict: OrderedDict = settings.LINK_CHECKER_PROXY_ORDERED_DICT,
+                 alpha=settings.LINK_CHECKER_PROXY_EWMA_ALPHA,
+                 dead_failures=settings.LINK_CHECKER_PROXY_DEAD_FAILURES,
+                 cooldown=settings.LINK_CHECKER_PROXY_COOLDOWN):
+        # proxy tuples ('AT Austria, Vienna', ('10.0.2.9', 3128))
+        self.proxies: list[tuple] = list(proxy_ord_dict.items())
+        self.alpha = alpha
+        self.dead_failures = dead_failures
+        self.cooldown = cooldown
+        self.stats: dict[str, ProxyStats] = {self.get_key(proxy): ProxyStats() for proxy in self.proxies}
+
+    def __repr__(self):
+        return f"<ProxyManager> (id: {id(self)}, proxies: {len(self.proxies)})"
+
+    @staticmethod
+    def get_key(proxy: tuple) -> str:
+        return get_proxy_key(get_proxies_dict(proxy))
+
+    def get_healthy_proxies(self, count: int | None = None) -> list[tuple]:
+        """count (all if None) best proxies, which are not dead now"""
+        now = time.monotonic()
+        healthy_proxies = [proxy for proxy in self.proxies if self.stats[self.get_key(proxy)].dead_until <= now]
+        healthy_proxies.sort(key=lambda proxy: (-self.stats[self.get_key(proxy)].success_rate,
+                                                self.stats[self.get_key(proxy)].latency))
+        return healthy_proxies[:count]
+
+    def on_success(self, proxy: tuple, latency: float):
+        stats = self.stats[self.get_key(proxy)]
+        stats.success_rate += self.alpha * (1 - stats.success_rate)
+        stats.latency += self.alpha * (latency - stats.latency)
+        stats.failures_in_row = 0
+
+    def on_cancelled(self, proxy: tuple, latency: float):
+        """proxy was slower than latency (lost the race), its success is not known"""
+        stats = self.stats[self.get_key(proxy)]
+        stats.latency += self.alpha * (max(latency, stats.latency) - stats.latency)
+
+    def on_failure(self, proxy: tuple):
+        stats = self.stats[self.get_key(proxy)]
+        stats.success_rate -= self.alpha * stats.success_rate
+        stats.failures_in_row += 1
+        if stats.failures_in_row >= self.dead_failures:
+            stats.dead_until = time.monotonic() + self.cooldown
+            stats.failures_in_row = 0
+            logger.debug(f'{self}: proxy {proxy} is dead for {self.cooldown} s, {stats}')
+
+
+proxy_manager = ProxyManager()
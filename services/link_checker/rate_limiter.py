@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from core.config import settings
+
+logger = logging.getLogger(name='link_checker')
+
+THROTTLED_RESPONSE_CODES = (429, 503)
+
+
+def get_retry_after_seconds(retry_after: str | None) -> float | None:
+    """seconds of Retry-After response header, given as seconds or as http date, None if it is absent or invalid"""
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_after_date = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_after_date.tzinfo is None:
+        retry_after_date = retry_after_date.replace(tzinfo=timezone.utc)
+    return max((retry_after_date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class HostBucket:
+    """token bucket of one host, its waiters take tokens one by one under lock"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled_count = 0
+        self.lock: asyncio.Lock | None = None
+        self.lock_loop: asyncio.AbstractEventLoop | None = None
+
+    def __repr__(self):
+        return f"<HostBucket> ({self.rate=:}, {self.tokens=:}, {self.throttled_count=:})"
+
+    def get_lock(self) -> asyncio.Lock:
+        """lock of the running event loop (asyncio.Lock is bound to the loop it is first waited in)"""
+        loop = asyncio.get_running_loop()
+        if self.lock is None or self.lock_loop is not loop:
+            self.lock, self.lock_loop = asyncio.Lock(), loop
+        return self.lock
+
+
+class HostRateLimiter:
+    """token bucket per donor host (page_url_domain name) living as long as the worker process,
+    so pages of the same donor are requested not faster than rate per second (burst at once).
+
+    the rate is adaptive: on 429/503 it is halved (not below rate_min) and the host is blocked
+    for Retry-After seconds or for growing backoff, every other response brings it back by rate / 10"""
+
+    def __init__(self,
+                 rate=settings.LINK_CHECKER_HOST_RATE,
+                 rate_min=settings.LINK_CHECKER_HOST_RATE_MIN,
+                 backoff=settings.LINK_CHECKER_HOST_BACKOFF,
+                 backoff_max=settings.LINK_CHECKER_HOST_BACKOFF_MAX):
+        self.rate = rate
+        self.rate_min = rate_min
+        self.burst = max(rate, 1)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.buckets: dict[str, HostBucket] = {}
+
+    def __repr__(self):
+        return f"<HostRateLimiter> (id: {id(self)}, hosts: {len(self.buckets)})"
+
+    def get_bucket(self, host: str) -> HostBucket:
+        if host not in self.buckets:
+            self.buckets[host] = HostBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def get_delay(self, host: str) -> float:
+        """seconds until the next request to host can be sent"""
+        bucket = self.get_bucket(host)
+        now = time.monotonic()
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * bucket.rate)
+        bucket.updated_at = now
+        token_delay = 0.0 if bucket.tokens >= 1 else (1 - bucket.tokens) / bucket.rate
+        return max(bucket.blocked_until - now, token_delay)
+
+    async def acquire(self, host: str):
+        """wait for a token of host and take it,
+        waiters of host wait one by one, and tokens are counted again after every sleep
+        (host could be blocked or refilled tokens could be taken meanwhile), so they never go below 0"""
+        bucket = self.get_bucket(host)
+        async with bucket.get_lock():
+            while (delay := self.get_delay(host)) > 0:
+                await asyncio.sleep(delay)
+            bucket.tokens -= 1
+
+    def on_response(self, host: str, response_code: int | None, retry_after: str | None = None) -> float | None:
+        """adapt rate of host to response_code of its page,
+        returns seconds host is blocked for if it throttled the request (429/503),
+        None if it didn't, or if it asked to wait longer than backoff_max (then it is blocked for backoff_max)"""
+        bucket = self.get_bucket(host)
+        if response_code not in THROTTLED_RESPONSE_CODES:
+            bucket.rate = min(self.rate, bucket.rate + self.rate / 10)
+            bucket.throttled_count = 0
+            return None
+
+        delay = get_retry_after_seconds(retry_after)
+        if delay is None:
+            delay = self.backoff * 2 ** bucket.throttled_count
+        bucket.rate = max(self.rate_min, bucket.rate / 2)
+        bucket.throttled_count += 1
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + min(delay, self.backoff_max))
+        logger.debug(f'{self}: {host} throttled with {response_code}, {retry_after=:}, blocked for {delay} s, '
+                     f'rate {bucket.rate}')
+        return delay if delay <= self.backoff_max else None
+
+
+host_rate_limiter = HostRateLimiter()
@@ -0,0 +1,144 @@
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from database.models.link import LinkModel
+from database.models.link_schedule import LinkScheduleModel
+
+logger = logging.getLogger(name='link_checker')
+
+
+def get_check_risk(status: str, is_flipped: bool, status_flip_rate: float, pudomain_flip_rate: float,
+                   link_age_days: float, price: Decimal | float | None) -> float:
+    """0 (stable link, checked every LINK_SCHEDULER_INTERVAL_MAX_HOURS) .. 1 (checked every LINK_SCHEDULER_INTERVAL_MIN_HOURS)
+
+    just flipped link is 1, otherwise the highest of its own flip rate, half of flip rate of its donor domain,
+    half of its newness and LINK_SCHEDULER_NOT_GREEN_RISK if it is not green, raised by its price"""
+    if is_flipped:
+        return 1.0
+    risk = max(
+        status_flip_rate,
+        pudomain_flip_rate / 2,
+        max(0.0, 1 - link_age_days / settings.LINK_SCHEDULER_NEW_LINK_DAYS) / 2,
+        settings.LINK_SCHEDULER_NOT_GREEN_RISK if status != 'green' else 0.0,
+    )
+    price = float(price or 0)
+    price_weight = price / (price + settings.LINK_SCHEDULER_PRICE_SCALE) if price > 0 else 0.0
+    return min(1.0, risk + (1 - risk) * price_weight / 2)
+
+
+def get_check_interval_hours(risk: float, interval_max: float | None = None) -> float:
+    """hours between checks, geometric from interval_max (LINK_SCHEDULER_INTERVAL_MAX_HOURS by default, risk 0)
+    to LINK_SCHEDULER_INTERVAL_MIN_HOURS (risk 1)"""
+    interval_min = settings.LINK_SCHEDULER_INTERVAL_MIN_HOURS
+    interval_max = interval_max or settings.LINK_SCHEDULER_INTERVAL_MAX_HOURS
+    return interval_max * (interval_min / interval_max) ** risk
+
+
+def get_link_schedule_insert(session: Session):
+    """INSERT INTO link_schedule of the session dialect, to be finished with ON CONFLICT (link_id) DO NOTHING:
+    schedule of a link can be created meanwhile by another transaction (update_link_schedules of another worker
+    or create_missing_link_schedules), and IntegrityError would roll back the whole chunk"""
+    dialect_insert = postgresql.insert if session.bind.dialect.name == 'postgresql' else sqlite.insert
+    return dialect_insert(LinkScheduleModel.__table__)
+
+
+def update_link_schedules(session: Session, linkchecks: list[sa.engine.Row]):
+    """next check time of links of just created linkchecks (link_id, status, check_mode, created_at),
+    from their history, with 3 selects for all of them (and insert and select of new schedules), doesn't commit"""
+    if not linkchecks:
+        return
+    link_ids = {linkcheck.link_id for linkcheck in linkchecks}
+    links = {link.id: link for link in session.query(LinkModel.id, LinkModel.created_at, LinkModel.price,
+                                                     LinkModel.page_url_domain_id)
+             .filter(LinkModel.id.in_(link_ids))}
+    link_schedules = {link_schedule.link_id: link_schedule for link_schedule in session.query(LinkScheduleModel)
+                      .filter(LinkScheduleModel.link_id.in_(link_ids))}
+    new_link_ids = links.keys() - link_schedules.keys()
+    if new_link_ids:
+        checked_at = {linkcheck.link_id: linkcheck.created_at for linkcheck in linkchecks}
+        session.execute(
+            get_link_schedule_insert(session)
+            .values([{'link_id': link_id, 'next_check_at': checked_at[link_id], 'status_flip_rate': 0.0}
+                     for link_id in new_link_ids])
+            .on_conflict_do_nothing(index_elements=['link_id'])
+        )
+        link_schedules.update({link_schedule.link_id: link_schedule for link_schedule in session.query(LinkScheduleModel)
+                               .filter(LinkScheduleModel.link_id.in_(new_link_ids))})
+    pudomain_ids = {link.page_url_domain_id for link in links.values() if link.page_url_domain_id}
+    pudomain_flip_rates = dict(
+        session.query(LinkModel.page_url_domain_id, sa.func.avg(LinkScheduleModel.status_flip_rate))
+        .join(LinkScheduleModel, LinkScheduleModel.link_id == LinkModel.id)
+        .filter(LinkModel.page_url_domain_id.in_(pudomain_ids))
+        .group_by(LinkModel.page_url_domain_id)
+    ) if pudomain_ids else {}
+
+    alpha = settings.LINK_SCHEDULER_FLIP_RATE_ALPHA
+    for linkcheck in linkchecks:
+        link = links.get(linkcheck.link_id)
+        if link is None:
+            continue
+        link_schedule = link_schedules[link.id]
+        is_flipped = link_schedule.last_status is not None and link_schedule.last_status != linkcheck.status
+        link_schedule.status_flip_rate += alpha * (is_flipped - link_schedule.status_flip_rate)
+        link_schedule.last_status = linkcheck.status
+        risk = get_check_risk(
+            status=linkcheck.status,
+            is_flipped=is_flipped,
+            status_flip_rate=link_schedule.status_flip_rate,
+            pudomain_flip_rate=pudomain_flip_rates.get(link.page_url_domain_id) or 0.0,
+            link_age_days=(linkcheck.created_at - link.created_at).total_seconds() / 86400,
+            price=link.price,
+        )
+        # the most expensive playwright check of stable green links is not done more often than it was monthly
+        interval_max = settings.LINK_SCHEDULER_PLAYWRIGHT_INTERVAL_MAX_HOURS \
+            if linkcheck.check_mode == 'playwright' and linkcheck.status == 'green' else None
+        link_schedule.check_interval_hours = get_check_interval_hours(risk, interval_max)
+        link_schedule.next_check_at = linkcheck.created_at + timedelta(hours=link_schedule.check_interval_hours)
+    session.flush()
+
+
+def create_missing_link_schedules(session: Session, now: datetime):
+    """links without schedule (new ones) are due now, with one INSERT ... SELECT"""
+    link_schedule_table = LinkScheduleModel.__table__
+    session.execute(
+        get_link_schedule_insert(session).from_select(
+            ['link_id', 'next_check_at', 'status_flip_rate'],
+            sa.select(LinkModel.id, sa.literal(now, sa.DateTime), sa.literal(0.0, sa.Float))
+            .where(~sa.exists().where(link_schedule_table.c.link_id == LinkModel.id))
+        ).on_conflict_do_nothing(index_elements=['link_id'])
+    )
+
+
+def lease_due_links(session: Session, limit=settings.LINK_SCHEDULER_DISPATCH_MAX_LINKS
+                    ) -> tuple[list[int], list[int]]:
+    """ids of links due to be checked (the most overdue first): to be checked as usual and with playwright
+    (green ones of the last check with playwright), they are not due again for LINK_SCHEDULER_DISPATCH_LEASE_HOURS,
+    by then their check moves next_check_at"""
+    now = session.query(sa.func.now()).scalar()
+    create_missing_link_schedules(session, now)
+    due_links = session.query(LinkModel.id, LinkModel.link_check_last_check_mode, LinkModel.link_check_last_status) \
+        .join(LinkScheduleModel, LinkScheduleModel.link_id == LinkModel.id) \
+        .filter(LinkScheduleModel.next_check_at <= now) \
+        .order_by(LinkScheduleModel.next_check_at) \
+        .limit(limit) \
+        .all()
+    if due_links:
+        session.query(LinkScheduleModel) \
+            .filter(LinkScheduleModel.link_id.in_([link.id for link in due_links])) \
+            .update({LinkScheduleModel.next_check_at: now + timedelta(hours=settings.LINK_SCHEDULER_DISPATCH_LEASE_HOURS)},
+                    synchronize_session=False)
+    session.commit()
+
+    link_ids, pw_link_ids = [], []
+    for link in due_links:
+        if link.link_check_last_check_mode == 'playwright' and link.link_check_last_status == 'green':
+            pw_link_ids.append(link.id)
+        else:
+            link_ids.append(link.id)
+    return link_ids, pw_link_ids
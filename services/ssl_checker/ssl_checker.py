@@ -1,9 +1,20 @@
+import asyncio
+import base64
 import logging
-import subprocess
+import ssl
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Iterable
+from urllib.parse import unquote, urlsplit
+
+import sqlalchemy as sa
+from cryptography import x509
+from sqlalchemy.orm import Session
 
 from core.config import settings
+from core.metrics import LINK_CHECKER_CHUNK_STAGE_SECONDS, LINK_CHECKER_STAGE_SECONDS, observe_seconds
+from database.models.link_check import LinkCheckModel
+from database.models.page_url_domain import PageUrlDomainModel
 
 logger = logging.getLogger(name='ssl_checker')
 logger.setLevel(logging.DEBUG)
@@ -13,24 +24,152 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
 
-def get_ssl_expiration_date(hostname):
-    date_fmt = r'%b %d %H:%M:%S %Y GMT'
-    url = f'https://{hostname}'
+def get_ssl_context() -> ssl.SSLContext:
+    """certificate is not verified, so expiration date is got for expired and self-signed certificates as well"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def open_tunnel(hostname: str, port: int, proxy_url: str
+                      ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """connection to hostname:port through http proxy_url with CONNECT request"""
+    proxy = urlsplit(proxy_url)
+    reader, writer = await asyncio.open_connection(proxy.hostname, proxy.port or 80)
+    request = f'CONNECT {hostname}:{port} HTTP/1.1\r\nHost: {hostname}:{port}\r\n'
+    if proxy.username:
+        credentials = f'{unquote(proxy.username)}:{unquote(proxy.password or "")}'
+        request += f'Proxy-Authorization: Basic {base64.b64encode(credentials.encode()).decode()}\r\n'
+    try:
+        writer.write(f'{request}\r\n'.encode())
+        await writer.drain()
+        response_head = await reader.readuntil(b'\r\n\r\n')
+        status_line = response_head.split(b'\r\n', 1)[0].decode('latin-1')
+        if status_line.split()[1:2] != ['200']:
+            raise ConnectionError(f'proxy {proxy.hostname}:{proxy.port} refused CONNECT: {status_line}')
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
 
-    http_proxy = settings.HTTP_PROXY
-    export_http_proxy_str = f'export http_proxy={http_proxy} && ' if http_proxy else ''
-    https_proxy = settings.HTTPS_PROXY
-    export_https_proxy_str = f'export http_proxy={https_proxy} && ' if https_proxy else ''
+async def get_peer_certificate(hostname: str, port=443, proxy_url: str | None = None) -> bytes:
+    """DER certificate of hostname got by tls handshake, directly or through proxy_url tunnel"""
+    context = get_ssl_context()
+    if proxy_url:
+        reader, writer = await open_tunnel(hostname, port, proxy_url)
+        # the tunnel is closed also when tls handshake through it fails or is cancelled by timeout
+        transport = writer.transport
+    else:
+        reader, writer = await asyncio.open_connection(hostname, port, ssl=context, server_hostname=hostname)
+        transport = writer.transport
     try:
-        date_str = subprocess.getoutput(
-            f"{export_http_proxy_str}"
-            f"{export_https_proxy_str}"
-            f'curl {url} -m 5 -vI --stderr - | grep "expire date" | cut -d":" -f 2-'
-        ).strip()
+        if proxy_url:
+            transport = await asyncio.get_running_loop().start_tls(transport, transport.get_protocol(), context,
+                                                                   server_hostname=hostname)
+        return transport.get_extra_info('ssl_object').getpeercert(binary_form=True)
+    finally:
+        transport.close()
 
-        ssl_expiration_date = datetime.strptime(date_str, date_fmt) if date_str else None
-        return ssl_expiration_date
 
-    except Exception:
-        logger.error(traceback.format_exc())
+async def get_ssl_expiration_date(hostname: str, port=443,
+                                  proxy_url: str | None = settings.HTTPS_PROXY or settings.HTTP_PROXY,
+                                  timeout=5) -> datetime | None:
+    """expiration date (utc) of ssl certificate of hostname, None if it can't be got in timeout seconds"""
+    try:
+        with observe_seconds(LINK_CHECKER_STAGE_SECONDS, 'ssl_probe'):
+            certificate = await asyncio.wait_for(get_peer_certificate(hostname, port, proxy_url), timeout=timeout)
+        # naive utc, as ssl expiration dates are stored and compared with datetime.utcnow()
+        return x509.load_der_x509_certificate(certificate).not_valid_after_utc.replace(tzinfo=None)
+    except Exception as e:
+        logger.error(f'get_ssl_expiration_date({hostname=:}): {e.__class__.__name__} {e}')
+        logger.debug(traceback.format_exc())
         return None
+
+
+async def get_ssl_expiration_dates(hostnames: Iterable[str],
+                                   concurrency=settings.SSL_CHECKER_CONCURRENCY) -> dict[str, datetime | None]:
+    """hostname: ssl expiration date, for every one of hostnames probed concurrently"""
+    hostnames = list(set(hostnames))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_ssl_expiration_date_bounded(hostname):
+        async with semaphore:
+            return await get_ssl_expiration_date(hostname)
+
+    ssl_expiration_dates = await asyncio.gather(*[get_ssl_expiration_date_bounded(hostname) for hostname in hostnames])
+    return dict(zip(hostnames, ssl_expiration_dates))
+
+
+def get_ssl_expires_in_days(ssl_expiration_date: datetime | None) -> int:
+    return (ssl_expiration_date - datetime.utcnow()).days if ssl_expiration_date else -1
+
+
+def is_ssl_expiration_date_fresh(ssl_expiration_date: datetime | None, ssl_checked_at: datetime | None) -> bool:
+    """cached ssl expiration date is used for SSL_CACHE_TTL_DAYS after probing,
+    but not after failed probe, and not when certificate expires within SSL_EXPIRATION_DAYS (it may be renewed any day)"""
+    return (
+            ssl_expiration_date is not None and
+            ssl_checked_at is not None and
+            datetime.utcnow() - ssl_checked_at < timedelta(days=settings.SSL_CACHE_TTL_DAYS) and
+            get_ssl_expires_in_days(ssl_expiration_date) > settings.SSL_EXPIRATION_DAYS
+    )
+
+
+async def get_ssl_expiration_dates_cached(session: Session, hostnames: Iterable[str]
+                                          ) -> tuple[dict[str, datetime | None], dict[str, datetime | None]]:
+    """ssl expiration dates of hostnames (page_url_domain names), taken from page_url_domain cache when it is fresh,
+    the rest are probed
+
+    returns (hostname: ssl expiration date) for all hostnames and for probed hostnames only, to be cached"""
+    hostnames = set(hostnames)
+    pudomains_ssl = session.query(PageUrlDomainModel.name,
+                                  PageUrlDomainModel.ssl_expiration_date,
+                                  PageUrlDomainModel.ssl_checked_at) \
+        .filter(PageUrlDomainModel.name.in_(hostnames)).all() if hostnames else []
+    ssl_expiration_dates = {
+        name: ssl_expiration_date for name, ssl_expiration_date, ssl_checked_at in pudomains_ssl
+        if is_ssl_expiration_date_fresh(ssl_expiration_date, ssl_checked_at)
+    }
+    with observe_seconds(LINK_CHECKER_CHUNK_STAGE_SECONDS, 'ssl_probe'):
+        ssl_expiration_dates_probed = await get_ssl_expiration_dates(hostnames - ssl_expiration_dates.keys())
+    logger.debug(f'get_ssl_expiration_dates_cached: {len(ssl_expiration_dates)} from cache, '
+                 f'{len(ssl_expiration_dates_probed)} probed')
+    return {**ssl_expiration_dates, **ssl_expiration_dates_probed}, ssl_expiration_dates_probed
+
+
+def update_pudomains_ssl(session: Session, ssl_expiration_dates: dict[str, datetime | None]):
+    """cache probed ssl expiration dates of page_url_domains (name: ssl expiration date) with one executemany UPDATE,
+    failed probes (None) are not cached, so the last good date is kept and they are probed again next time"""
+    ssl_expiration_dates = {name: date for name, date in ssl_expiration_dates.items() if date is not None}
+    if not ssl_expiration_dates:
+        return
+    ssl_checked_at = datetime.utcnow()
+    pudomain_table = PageUrlDomainModel.__table__
+    session.execute(
+        pudomain_table.update()
+        .where(pudomain_table.c.name == sa.bindparam('pudomain_name'))
+        .values(ssl_expiration_date=sa.bindparam('pudomain_ssl_expiration_date'), ssl_checked_at=ssl_checked_at),
+        [
+            {'pudomain_name': name, 'pudomain_ssl_expiration_date': ssl_expiration_date}
+            for name, ssl_expiration_date in ssl_expiration_dates.items()
+        ]
+    )
+    session.commit()
+
+
+def update_linkchecks_ssl(session: Session, ssl_expiration_dates: dict[int, datetime | None]):
+    """write ssl_expiration_date and ssl_expires_in_days of linkchecks (linkcheck id: ssl expiration date)
+    with one executemany UPDATE"""
+    if not ssl_expiration_dates:
+        return
+    session.bulk_update_mappings(LinkCheckModel, [
+        {
+            'id': linkcheck_id,
+            'ssl_expiration_date': ssl_expiration_date,
+            'ssl_expires_in_days': get_ssl_expires_in_days(ssl_expiration_date),
+        }
+        for linkcheck_id, ssl_expiration_date in ssl_expiration_dates.items()
+    ])
+    session.commit()
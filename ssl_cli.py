@@ -1,80 +1,45 @@
 import argparse
-import os
-import subprocess
-import time
-from datetime import datetime
+import asyncio
 
 from database import SessionLocal
-from database.crud import get
 from database.models import init_models
 from database.models.link import LinkModel
 from database.models.link_check import LinkCheckModel
-from services.ssl_checker.ssl_checker import get_ssl_expiration_date
+from services.ssl_checker.ssl_checker import get_ssl_expiration_dates, update_linkchecks_ssl
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-id', '--id', type=int)
 parser.add_argument('-l', '--list', nargs='+', type=int)
 parser.add_argument('-a', '--all', action='store_const', const=True, default=False)
 namespace = parser.parse_args()
-PARALLELPROC = 5
+
+
+def check_linkchecks_ssl(db, linkchecks: list[LinkCheckModel]):
+    """probe ssl certificates of page hosts of linkchecks concurrently in one event loop and write them at once"""
+    hostnames = {linkcheck.id: linkcheck.link.page_url_domain.name for linkcheck in linkchecks}
+    print(f'Started ssl_cli with namespace: {namespace} for linkchecks {list(hostnames)}...')
+    ssl_expiration_dates = asyncio.run(get_ssl_expiration_dates(hostnames.values()))
+    update_linkchecks_ssl(db, {
+        linkcheck_id: ssl_expiration_dates[hostname] for linkcheck_id, hostname in hostnames.items()
+    })
+    print(f'Finished ssl_cli with namespace: {namespace} for linkchecks {list(hostnames)}...')
+
 
 init_models()
 db = SessionLocal()
-pid = os.getpid()
 
 if namespace.id:
     # check one by id
-    linkcheck_id = namespace.id
-    linkcheck = get(db, LinkCheckModel, id=linkcheck_id)
-    page_url_domain_name = linkcheck.link.page_url_domain.name
-    print(f'Started ssl_cli on process {pid}, with namespace: {namespace} for {page_url_domain_name}...')
-    ssl_expiration_date = get_ssl_expiration_date(page_url_domain_name)
-
-    linkcheck.ssl_expiration_date = ssl_expiration_date
-    linkcheck.ssl_expires_in_days = (
-            ssl_expiration_date - datetime.now()).days if ssl_expiration_date else -1
-    db.commit()
-    print(f'Finished ssl_cli on process {pid}, with namespace: {namespace} for {page_url_domain_name}...')
-    os.kill(pid, 9)
-
+    linkcheck_list = db.query(LinkCheckModel).filter(LinkCheckModel.id == namespace.id).all()
 elif namespace.list:
     # check many from list
-    linkschecks_id_list = namespace.list
-    print(f'Started ssl_cli on process {pid}, with namespace: {namespace} for linkchecks {linkschecks_id_list}...')
-    process_list = []
-
-    for linkcheck_id in linkschecks_id_list:
-        p = subprocess.Popen(
-            ["python3.10", "ssl_cli.py", "-id", str(linkcheck_id)],
-        )
-
-        process_list.append(p)
-        while len(process_list) > PARALLELPROC:
-            time.sleep(0.5)
-            for p in process_list:
-                if p.poll() is not None:
-                    process_list.remove(p)
-    print(f'Finished ssl_cli on process {pid}, with namespace: {namespace} for linkchecks {linkschecks_id_list}...')
-    os.kill(pid, 9)
-
+    linkcheck_list = db.query(LinkCheckModel).filter(LinkCheckModel.id.in_(namespace.list)).all()
 elif namespace.all:
     # check all
-    link_list: list[LinkModel] = db.query(LinkModel).all()
+    link_list: list[LinkModel] = db.query(LinkModel).filter(LinkModel.link_check_last_id != None).all()
     linkcheck_list = [link.link_check_last for link in link_list]
-    linkchecks_id_list = [str(linkcheck.id) for linkcheck in linkcheck_list]
-    print(f'Started ssl_cli on process {pid}, with namespace: {namespace} for linkchecks {linkchecks_id_list}...')
-    process_list = []
-
-    for linkcheck_id in linkchecks_id_list:
-        p = subprocess.Popen(
-            ["python3.10", "ssl_cli.py", "-id", str(linkcheck_id)],
-        )
+else:
+    linkcheck_list = []
 
-        process_list.append(p)
-        while len(process_list) > PARALLELPROC:
-            time.sleep(0.5)
-            for p in process_list:
-                if p.poll() is not None:
-                    process_list.remove(p)
-    print(f'Finished ssl_cli on process {pid}, with namespace: {namespace} for linkchecks {linkchecks_id_list}...')
-    os.kill(pid, 9)
+check_linkchecks_ssl(db, linkcheck_list)
+db.close()
@@ -0,0 +1,34 @@
+from database.models.link import LinkModel
+from database.models.link_url_domain import LinkUrlDomainModel
+from database.models.page_url_domain import PageUrlDomainModel
+from services.domain_checker.domain_checker import recreate_domains_many
+
+
+def test_recreate_domains_many(session_in_memory):
+    """test
+    - domains of all links are got or created at once, only created page_url_domains are returned
+    - domains already got are not created again
+    """
+    session = session_in_memory
+    pudomain_existing = PageUrlDomainModel(name='donor-name1.com')
+    session.add(pudomain_existing)
+    session.commit()
+    links = [
+        LinkModel(page_url='https://donor-name1.com/1', link_url='https://project-name1.com/url/', anchor='a'),
+        LinkModel(page_url='https://www.donor-name1.com/2', link_url='https://project-name2.com/url/', anchor='a'),
+        LinkModel(page_url='https://donor-name1.com/3', link_url='https://project-name1.com/url/', anchor='a'),
+        LinkModel(page_url='https://donor-name2.com/1', link_url='https://project-name1.com/url/', anchor='a'),
+    ]
+    session.add_all(links)
+    session.commit()
+
+    pudomain_created_ids = recreate_domains_many(session, links)
+    pudomain_1, pudomain_2 = session.query(PageUrlDomainModel).order_by(PageUrlDomainModel.id).all()
+    assert pudomain_1 is pudomain_existing and pudomain_created_ids == [pudomain_2.id]
+    assert [link.page_url_domain for link in links] == [pudomain_1, pudomain_1, pudomain_1, pudomain_2]
+    assert [link.link_url_domain.name for link in links] == ['project-name1.com', 'project-name2.com',
+                                                             'project-name1.com', 'project-name1.com']
+    assert session.query(LinkUrlDomainModel).count() == 2
+
+    assert recreate_domains_many(session, links) == []
+    assert session.query(PageUrlDomainModel).count() == 2
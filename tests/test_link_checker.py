@@ -0,0 +1,1031 @@
+import asyncio
+import datetime
+import pickle
+from collections import OrderedDict
+import time
+from types import SimpleNamespace
+
+import billiard
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from core.config import settings
+from core.metrics import LINK_CHECKER_STAGE_SECONDS, count_linkchecks, get_metrics_latest
+from benchmarks.fake_donor import fake_donor_app, get_page_url
+from core.shared import TIMEOUT_5, get_proxies_dict
+from database.models.link import LinkModel
+from database.models.link_schedule import LinkScheduleModel
+from database.models.link_url_domain import LinkUrlDomainModel
+from database.models.page_url_domain import PageUrlDomainModel
+from database.schemas.link_check import LinkCheckCreateSerializer
+from services.link_checker.browser_pool import BrowserPool, LoopBrowserPools
+from services.link_checker.client_pool import HttpxClientRegistry
+from services.link_checker.inflight_registry import LocalInFlightRegistry
+from services.link_checker import celery_tasks, link_checker, page_parser
+from services.link_checker.link_checker import (
+    HttpxStageTrace,
+    LinkChecker,
+    LinkCheckInput,
+    check_links_in_chunks,
+    get_link_chunks,
+    read_response_content,
+)
+from services.link_checker.proxy_manager import ProxyManager
+from services.link_checker.rate_limiter import HostRateLimiter, get_retry_after_seconds
+from services.link_checker.scheduler import (
+    get_check_interval_hours,
+    get_check_risk,
+    lease_due_links,
+    update_link_schedules,
+)
+from services.link_checker.page_parser import (
+    LinkMatchSpec,
+    decode_page_content,
+    get_page_match_soup,
+    get_page_matches_scanner,
+    is_href_of_link_url,
+    parse_page,
+    parse_page_async,
+)
+
+
+def get_link(id, page_url):
+    return LinkCheckInput(id=id, page_url=page_url, link_url='', anchor='',
+                          page_url_domain_name=None, link_url_domain_name=None)
+
+
+def test_iter_linkcheck_ser_respects_concurrency_limits():
+    """test
+    - not more than concurrency links are checked at once
+    - not more than concurrency_per_host links to the same donor are checked at once
+    - results are yielded in order of completion, not in order of links
+    """
+    linkchecker = LinkChecker(session=None, concurrency=3, concurrency_per_host=1)
+    links = [get_link(1, 'https://slow-donor.com/1'),
+             get_link(2, 'https://slow-donor.com/2'),
+             get_link(3, 'https://donor-2.com/1'),
+             get_link(4, 'https://donor-3.com/1'),
+             get_link(5, 'https://donor-4.com/1')]
+    in_progress = {'all': 0, 'slow-donor.com': 0}
+    max_in_progress = {'all': 0, 'slow-donor.com': 0}
+
+    async def get_page_link_check_sers(client, page_links, **kwargs):
+        link, = page_links
+        is_slow_donor = 'slow-donor.com' in link.page_url
+        in_progress['all'] += 1
+        in_progress['slow-donor.com'] += is_slow_donor
+        max_in_progress['all'] = max(max_in_progress['all'], in_progress['all'])
+        max_in_progress['slow-donor.com'] = max(max_in_progress['slow-donor.com'], in_progress['slow-donor.com'])
+        await asyncio.sleep(0.05 if is_slow_donor else 0.01)
+        in_progress['all'] -= 1
+        in_progress['slow-donor.com'] -= is_slow_donor
+        return [link.id]
+
+    linkchecker.get_page_link_check_sers = get_page_link_check_sers
+
+    async def collect():
+        return [link_id async for link_id in linkchecker.iter_linkcheck_ser(None, links)]
+
+    link_ids = asyncio.run(collect())
+    assert sorted(link_ids) == [1, 2, 3, 4, 5]
+    assert link_ids[-1] == 2
+    assert max_in_progress == {'all': 3, 'slow-donor.com': 1}
+
+
+def test_client_registry_reuses_client_per_proxy():
+    """test
+    - the same client is returned for the same proxy within one event loop
+    - different proxies get different clients
+    - clients are recreated when requested from another event loop after aclose
+    """
+    registry = HttpxClientRegistry()
+    proxies_dict = get_proxies_dict(('AT Austria, Vienna', ('10.0.2.9', 3128)))
+
+    async def get_clients():
+        clients = (registry.get_client(), registry.get_client(get_proxies_dict(None)),
+                   registry.get_client(proxies_dict), registry.get_client(proxies_dict))
+        await registry.aclose()
+        return clients
+
+    client_1, client_2, proxy_client_1, proxy_client_2 = asyncio.run(get_clients())
+    assert client_1 is client_2
+    assert proxy_client_1 is proxy_client_2
+    assert client_1 is not proxy_client_1
+    assert client_1.is_closed and proxy_client_1.is_closed
+
+    client_3, *_ = asyncio.run(get_clients())
+    assert client_3 is not client_1
+
+
+def test_httpx_client_registry_keeps_clients_of_every_loop():
+    """test
+    - clients of a loop are not dropped, when another loop requests clients
+    - aclose closes clients of its own loop only
+    - clients of a loop closed without aclose are dropped
+    """
+    registry = HttpxClientRegistry()
+
+    async def get_client():
+        return registry.get_client()
+
+    loop_1, loop_2 = asyncio.new_event_loop(), asyncio.new_event_loop()
+    try:
+        client_1 = loop_1.run_until_complete(get_client())
+        client_2 = loop_2.run_until_complete(get_client())
+        assert client_2 is not client_1
+        assert loop_1.run_until_complete(get_client()) is client_1
+
+        loop_2.run_until_complete(registry.aclose())
+        assert client_2.is_closed and not client_1.is_closed
+        assert list(registry.loop_clients) == [loop_1]
+        loop_1.run_until_complete(registry.aclose())
+        assert client_1.is_closed and not registry.loop_clients
+
+        loop_1.run_until_complete(get_client())
+    finally:
+        loop_1.close()
+        loop_2.close()
+    asyncio.run(get_client())
+    assert loop_1 not in registry.loop_clients
+
+
+def test_check_links_in_chunks_overlaps_fetching_and_saving(monkeypatch):
+    """test
+    - all chunks are fetched and saved in order
+    - next chunk is fetched while the previous one is being saved
+    """
+    events = []
+
+    async def fetch_linkchecks(self, links, **kwargs):
+        events.append(f'fetch {links[0].id} start')
+        await asyncio.sleep(0.05)
+        events.append(f'fetch {links[0].id} end')
+        return links
+
+    def save_linkchecks(session, lcs_list):
+        events.append(f'save {lcs_list[0].id} start')
+        time.sleep(0.1)
+        events.append(f'save {lcs_list[0].id} end')
+        return []
+
+    async def get_ssl_expiration_dates_cached(session, hostnames):
+        return {}, {}
+
+    monkeypatch.setattr(LinkChecker, 'fetch_linkchecks', fetch_linkchecks)
+    monkeypatch.setattr(link_checker, 'save_linkchecks', save_linkchecks)
+    monkeypatch.setattr(link_checker, 'get_ssl_expiration_dates_cached', get_ssl_expiration_dates_cached)
+    link_chunks = [[get_link(1, 'https://donor.com/1')], [get_link(2, 'https://donor.com/2')]]
+
+    links_count = asyncio.run(check_links_in_chunks(None, link_chunks, write_session=SimpleNamespace(close=lambda: None),
+                                                    registry=LocalInFlightRegistry()))
+    assert links_count == 2
+    assert [e for e in events if e.startswith('save')] == ['save 1 start', 'save 1 end', 'save 2 start', 'save 2 end']
+    assert events.index('fetch 2 end') < events.index('save 1 end')
+
+
+def test_check_links_saves_with_its_own_session(monkeypatch):
+    """test linkchecks are saved (in threads) with a session of their own, not with LinkChecker.session,
+    which is used by ssl_task in the loop meanwhile"""
+    saved_with_sessions = []
+
+    async def fetch_linkchecks(self, links, **kwargs):
+        return links
+
+    async def get_ssl_expiration_dates_cached(session, hostnames):
+        return {}, {}
+
+    async def save_linkchecks_with_ssl(session, lcs_list, hostnames, ssl_task):
+        await ssl_task
+        saved_with_sessions.append(session)
+
+    monkeypatch.setattr(LinkChecker, 'fetch_linkchecks', fetch_linkchecks)
+    monkeypatch.setattr(link_checker, 'get_ssl_expiration_dates_cached', get_ssl_expiration_dates_cached)
+    monkeypatch.setattr(link_checker, 'save_linkchecks_with_ssl', save_linkchecks_with_ssl)
+    session = SimpleNamespace(get_bind=lambda: None)
+    asyncio.run(LinkChecker(session).check_links([get_link(1, 'https://donor.com/1')]))
+    write_session, = saved_with_sessions
+    assert write_session is not session
+
+
+def test_check_links_in_chunks_closes_write_session_after_saving(monkeypatch):
+    """test
+    - when fetching of a chunk fails, write_session is closed only after the previous chunk is saved
+    - write_session given by the caller is not closed
+    """
+    events = []
+
+    async def fetch_linkchecks(self, links, **kwargs):
+        if links[0].id == 2:
+            raise RuntimeError('fetch failed')
+        return links
+
+    def save_linkchecks(session, lcs_list):
+        time.sleep(0.1)
+        events.append('save end')
+        return []
+
+    async def get_ssl_expiration_dates_cached(session, hostnames):
+        return {}, {}
+
+    monkeypatch.setattr(LinkChecker, 'fetch_linkchecks', fetch_linkchecks)
+    monkeypatch.setattr(link_checker, 'save_linkchecks', save_linkchecks)
+    monkeypatch.setattr(link_checker, 'get_ssl_expiration_dates_cached', get_ssl_expiration_dates_cached)
+    monkeypatch.setattr(link_checker, 'SessionLocal', lambda: SimpleNamespace(close=lambda: events.append('close')))
+    link_chunks = [[get_link(1, 'https://donor.com/1')], [get_link(2, 'https://donor.com/2')]]
+
+    for write_session in (None, SimpleNamespace(close=lambda: events.append('close given'))):
+        events.clear()
+        with pytest.raises(RuntimeError, match='fetch failed'):
+            asyncio.run(check_links_in_chunks(None, link_chunks, write_session=write_session,
+                                              registry=LocalInFlightRegistry()))
+        assert events == (['save end', 'close'] if write_session is None else ['save end'])
+
+
+def test_inflight_registry():
+    """test
+    - link in flight is not claimed again until it is released
+    - link checked within result_ttl is not claimed, unless its result is not reused
+    - link released without result is claimed again
+    """
+    registry = LocalInFlightRegistry(inflight_ttl=60, result_ttl=60)
+    assert registry.claim([1, 2]) == [1, 2]
+    assert registry.claim([1, 2, 3]) == [3]
+    assert registry.is_in_flight(1)
+
+    registry.release([1])
+    registry.release([2], is_checked=False)
+    assert not registry.is_in_flight(1)
+    assert registry.claim([1, 2]) == [2]
+    assert registry.claim([1], reuse_results=False) == [1]
+
+
+def test_check_link_by_id_puts_off_link_in_flight(monkeypatch):
+    """test
+    - link in flight is not checked, check_link_by_id of it is enqueued again with countdown, without waiting
+    - after its check in flight is released, the link is checked, though its result is recent
+    """
+    registry = LocalInFlightRegistry(inflight_ttl=60, result_ttl=60)
+    link = LinkCheckInput(id=1, page_url='https://donor-name1.com/', link_url='https://project-name1.com/url/',
+                          anchor='anchor', page_url_domain_name='donor-name1.com',
+                          link_url_domain_name='project-name1.com')
+    checked_link_ids, enqueued = [], []
+
+    class FakeLinkChecker:
+        def __init__(self, session, **kwargs):
+            pass
+
+        async def check_links(self, links):
+            checked_link_ids.extend(link.id for link in links)
+
+    monkeypatch.setattr(celery_tasks, 'inflight_registry', registry)
+    monkeypatch.setattr(celery_tasks, 'SessionLocal', lambda: SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(celery_tasks, 'get_link_check_inputs', lambda session, link_ids: [link])
+    monkeypatch.setattr(celery_tasks, 'LinkChecker', FakeLinkChecker)
+    monkeypatch.setattr(celery_tasks.check_link_by_id, 'apply_async', lambda **kwargs: enqueued.append(kwargs))
+
+    registry.claim([1])
+    celery_tasks.check_link_by_id(1)
+    assert checked_link_ids == []
+    assert enqueued == [{'kwargs': {'id': 1}, 'countdown': settings.LINK_CHECKER_INFLIGHT_RECHECK_COUNTDOWN}]
+
+    registry.release([1])
+    celery_tasks.check_link_by_id(1)
+    assert checked_link_ids == [1] and len(enqueued) == 1
+    assert not registry.is_in_flight(1)
+
+
+def test_dispatch_due_links_calls_check_links_done(monkeypatch):
+    """test
+    - due links are sent by LINK_CHECKER_TASK_CHUNK_SIZE links, httpx ones to nightly queue
+    - check_links_done is the chord callback of all of them
+    - no chord is started without due links
+    """
+    chords = []
+    due_links = (list(range(1, 6)), [6])
+    monkeypatch.setattr(settings, 'LINK_CHECKER_TASK_CHUNK_SIZE', 3)
+    monkeypatch.setattr(celery_tasks, 'SessionLocal', lambda: SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(celery_tasks, 'lease_due_links', lambda session: due_links)
+    monkeypatch.setattr(celery_tasks, 'chord', lambda subtasks: lambda callback: chords.append((subtasks, callback)))
+
+    celery_tasks.dispatch_due_links()
+    (subtasks, callback), = chords
+    assert [(subtask.task, subtask.kwargs['id_list'], subtask.options.get('queue')) for subtask in subtasks] == [
+        ('check_links_from_list', [1, 2, 3], settings.CELERY_QUEUE_NIGHTLY),
+        ('check_links_from_list', [4, 5], settings.CELERY_QUEUE_NIGHTLY),
+        ('check_links_from_list_playwright', [6], None),
+    ]
+    assert callback.task == 'check_links_done'
+
+    due_links = ([], [])
+    celery_tasks.dispatch_due_links()
+    assert len(chords) == 1
+
+
+def test_check_links_in_chunks_skips_claimed_links(monkeypatch):
+    """test
+    - links in flight in another task are not fetched again
+    - with reuse_results (scheduled checks) just checked links are not fetched again, without it they are
+    - checked links are released from registry as checked
+    """
+    fetched_ids = []
+
+    async def fetch_linkchecks(self, links, **kwargs):
+        fetched_ids.extend(link.id for link in links)
+        return links
+
+    async def get_ssl_expiration_dates_cached(session, hostnames):
+        return {}, {}
+
+    monkeypatch.setattr(LinkChecker, 'fetch_linkchecks', fetch_linkchecks)
+    monkeypatch.setattr(link_checker, 'save_linkchecks', lambda session, lcs_list: [])
+    monkeypatch.setattr(link_checker, 'get_ssl_expiration_dates_cached', get_ssl_expiration_dates_cached)
+    registry = LocalInFlightRegistry(inflight_ttl=60, result_ttl=60)
+    registry.claim([1])
+    link_chunks = [[get_link(1, 'https://donor.com/1'), get_link(2, 'https://donor.com/2')],
+                   [get_link(3, 'https://donor.com/3')]]
+    write_session = SimpleNamespace(close=lambda: None)
+
+    assert asyncio.run(check_links_in_chunks(None, link_chunks, write_session=write_session, registry=registry,
+                                             reuse_results=True)) == 2
+    assert fetched_ids == [2, 3]
+    assert not registry.is_in_flight(2)
+    assert asyncio.run(check_links_in_chunks(None, link_chunks, write_session=write_session, registry=registry,
+                                             reuse_results=True)) == 0
+    assert fetched_ids == [2, 3]
+    assert asyncio.run(check_links_in_chunks(None, link_chunks, write_session=write_session, registry=registry)) == 2
+    assert fetched_ids == [2, 3, 2, 3]
+
+
+def test_browser_pool_recycles_contexts():
+    """test
+    - pages of the same site share one browser context until max_pages_per_context pages are opened
+    - retired context is closed only after its last open page is closed
+    - pages of other sites get their own contexts, context is closed with its last page
+    - failed page opening doesn't leave the context counted as having an open page
+    - every event loop gets its own pool
+    """
+
+    class FakePage:
+        async def close(self):
+            pass
+
+    class FakeContext:
+        def __init__(self):
+            self.is_closed = False
+            self.fails = False
+
+        async def new_page(self):
+            if self.fails:
+                raise RuntimeError('page crashed')
+            return FakePage()
+
+        async def close(self):
+            self.is_closed = True
+
+    class FakeBrowser:
+        async def new_context(self, **kwargs):
+            return FakeContext()
+
+    pool = BrowserPool(max_pages_per_context=2, max_ram_percent=101)
+
+    async def get_browser(proxies_dict):
+        return FakeBrowser()
+
+    pool.get_browser = get_browser
+
+    async def open_pages():
+        async with pool.new_page(site='donor.com'):
+            context_1 = pool.contexts[(None, 'donor.com')]
+            async with pool.new_page(site='donor.com'):
+                assert pool.contexts[(None, 'donor.com')] is context_1
+                async with pool.new_page(site='other-donor.com'):
+                    context_2 = pool.contexts[(None, 'other-donor.com')]
+                    assert context_2 is not context_1
+                assert context_2.context.is_closed and (None, 'other-donor.com') not in pool.contexts
+            assert context_1.is_retired and not context_1.context.is_closed
+        assert context_1.context.is_closed
+        async with pool.new_page(site='donor.com'):
+            context_3 = pool.contexts[(None, 'donor.com')]
+            assert context_3 is not context_1
+            context_3.context.fails = True
+            try:
+                async with pool.new_page(site='donor.com'):
+                    pass
+            except RuntimeError:
+                pass
+            assert context_3.pages_open == 1
+        assert context_3.context.is_closed
+
+    asyncio.run(open_pages())
+
+    pools = LoopBrowserPools()
+
+    async def get_pool():
+        return pools.get_pool()
+
+    loop = asyncio.new_event_loop()
+    try:
+        pool_1 = loop.run_until_complete(get_pool())
+        assert asyncio.run(get_pool()) is not pool_1
+        assert loop.run_until_complete(get_pool()) is pool_1
+    finally:
+        loop.close()
+
+
+def test_is_href_of_link_url():
+    assert is_href_of_link_url('https://project-name1.com/url/', 'https://project-name1.com/url/')
+    assert is_href_of_link_url('https://project-name1.com/url', 'https://project-name1.com/url/')
+    assert is_href_of_link_url('//project-name1.com/url', 'https://project-name1.com/url/')
+    assert not is_href_of_link_url('https://project-name1.com/other/', 'https://project-name1.com/url/')
+
+
+page_content = """<html><head><meta name="robots" content="index, nofollow"></head><body>
+<a href="https://other-donor.com/">other</a>
+<a href="/about">about</a>
+<a href="https://project-name1.com/other/">project other</a>
+<a href="https://project-name1.com/url" rel="nofollow noopener">anchor <b>text</b>1 &amp; more</a>
+<a href="https://other-donor-2.com/">other 2</a>
+<a href="//project-name1.com/url/">again</a>
+</body></html>"""
+spec_1 = LinkMatchSpec(link_url='https://project-name1.com/url/',
+                       page_url_domain_name='donor-name1.com', link_url_domain_name='project-name1.com')
+spec_2 = LinkMatchSpec(link_url='https://project-name2.com/url/',
+                       page_url_domain_name='donor-name1.com', link_url_domain_name='project-name2.com')
+
+
+def test_scanner_finds_the_same_as_soup():
+    """test LinkScanner reading the whole page collects the same page data as BeautifulSoup parsing"""
+    for spec in (spec_1, spec_2):
+        page_match_scanner, = get_page_matches_scanner(page_content, [spec], feed_size=50)
+        assert page_match_scanner == get_page_match_soup(page_content, spec)
+
+    page_match_1 = get_page_match_soup(page_content, spec_1)
+    assert page_match_1['href_is_found'] and page_match_1['rel_has_nofollow'] and page_match_1['meta_robots_has_nofollow']
+    assert page_match_1['anchor_text_found'] == 'anchor text1 & more'
+    assert page_match_1['anchor_count'] == 2
+    assert page_match_1['link_url_others_count'] == 1
+
+
+def test_scanner_reads_the_whole_page_after_found_href():
+    """test LinkScanner counts anchors and reads meta robots placed after the found href of the only spec"""
+    content = """<html><body><a href="https://project-name1.com/url/">anchor</a>
+<meta name="robots" content="noindex"><a href="https://project-name1.com/url/">again</a></body></html>"""
+    page_match_1, = get_page_matches_scanner(content, [spec_1], feed_size=50)
+    assert page_match_1['href_is_found'] and page_match_1['anchor_text_found'] == 'anchor'
+    assert page_match_1['anchor_count'] == 2 and page_match_1['meta_robots_has_noindex']
+    assert page_match_1 == get_page_match_soup(content, spec_1)
+
+
+def test_parse_page_async_in_process(monkeypatch):
+    """test big pages are parsed in parse_executor process with the same page data as in the loop"""
+    monkeypatch.setattr(settings, 'LINK_CHECKER_PARSE_PROCESSES', 1)
+    monkeypatch.setattr(settings, 'LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES', 0)
+    content = page_content.encode('utf-8')
+    try:
+        page_matches = asyncio.run(parse_page_async(content, [spec_1, spec_2]))
+        assert page_parser.parse_executor is not None
+    finally:
+        page_parser.shutdown_parse_executor()
+    assert page_matches == parse_page(content, [spec_1, spec_2])
+
+
+def parse_page_async_in_daemonic_process(connection, content: bytes, specs: list[LinkMatchSpec]):
+    try:
+        page_matches = asyncio.run(parse_page_async(content, specs))
+        connection.send((page_matches, page_parser.parse_executor is not None))
+    finally:
+        page_parser.shutdown_parse_executor()
+
+
+def test_parse_page_async_pool_start(monkeypatch):
+    """test
+    - small pages don't start parse_executor
+    - in daemonic process (celery prefork pool) big pages are parsed in parse_executor process
+    """
+    monkeypatch.setattr(settings, 'LINK_CHECKER_PARSE_PROCESSES', 1)
+    content = page_content.encode('utf-8')
+    expected_page_matches = parse_page(content, [spec_1, spec_2])
+
+    monkeypatch.setattr(settings, 'LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES', len(content) + 1)
+    assert asyncio.run(parse_page_async(content, [spec_1, spec_2])) == expected_page_matches
+    assert page_parser.parse_executor is None
+
+    monkeypatch.setattr(settings, 'LINK_CHECKER_PARSE_IN_PROCESS_MIN_BYTES', 0)
+    parent_connection, child_connection = billiard.Pipe()
+    process = billiard.Process(
+        target=parse_page_async_in_daemonic_process, args=(child_connection, content, [spec_1, spec_2]), daemon=True)
+    process.start()
+    try:
+        assert parent_connection.poll(30)
+        assert parent_connection.recv() == (expected_page_matches, True)
+    finally:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+
+
+def test_get_link_check_ser_streams_page_body():
+    """test
+    - body of redirect response is not read
+    - page body is cut to LINK_CHECKER_MAX_PAGE_BYTES
+    - page is decoded with charset from content-type header
+    """
+    redirect_body_is_read = False
+
+    class RedirectBody(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            nonlocal redirect_body_is_read
+            redirect_body_is_read = True
+            yield b'x' * 1024
+
+    anchor_text = 'ссылка'
+    page = f'<html><body><a href="https://project-name1.com/url/">{anchor_text}</a>'.encode('windows-1251')
+
+    def handler(request):
+        if request.url.path == '/url':
+            return httpx.Response(301, headers={'location': 'https://donor-name1.com/final'}, stream=RedirectBody())
+        return httpx.Response(200, headers={'content-type': 'text/html; charset=windows-1251'},
+                              content=page + b'<p>tail</p>' * 1024 * 1024)
+
+    link = LinkCheckInput(id=1, page_url='https://donor-name1.com/url', link_url='https://project-name1.com/url/',
+                          anchor=anchor_text, page_url_domain_name='donor-name1.com',
+                          link_url_domain_name='project-name1.com')
+
+    async def get_link_check_ser():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            link_check_ser, = await LinkChecker(session=None).get_page_link_check_sers(client, [link])
+            return link_check_ser
+
+    link_check_ser = asyncio.run(get_link_check_ser())
+    assert not redirect_body_is_read
+    assert link_check_ser.redirect_codes_list == '[301, 200]'
+    assert link_check_ser.status == 'green'
+    assert link_check_ser.anchor_text_found == anchor_text
+
+
+def test_read_response_content_is_cut_to_max_bytes():
+    async def read():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, content=b'x' * 100000))) as client:
+            response = await client.send(client.build_request('GET', 'https://donor-name1.com/'), stream=True)
+            content = await read_response_content(response, max_bytes=1000)
+            await response.aclose()
+            return content
+
+    assert asyncio.run(read()) == b'x' * 1000
+
+
+def test_decode_page_content():
+    text = 'ссылка'
+    assert decode_page_content(f'<meta charset="windows-1251">{text}'.encode('cp1251')).endswith(text)
+    assert decode_page_content(text.encode('koi8-r'), charset='koi8-r') == text
+    assert decode_page_content(text.encode('utf-8')[:-1]) == text[:-1]
+    assert decode_page_content('<p>café</p>'.encode('latin-1')) == '<p>café</p>'
+
+
+def test_get_link_check_ser_carries_forward_not_changed_page():
+    """test
+    - page validators of the last linkcheck are sent as conditional request headers
+    - on 304 or the same page content hash, results of the last linkcheck are carried forward with check_mode 'cache'
+    - changed page is checked as usual
+    - edited link (other link_url or anchor) is checked as usual on not changed page
+    """
+    page = b'<html><body><a href="https://project-name1.com/url/">anchor</a></body></html>'
+    pages = {'etag': page, 'no-etag': page}
+
+    def handler(request):
+        if request.url.path == '/etag':
+            if request.headers.get('if-none-match') == '"v1"':
+                return httpx.Response(304, headers={'etag': '"v1"'})
+            return httpx.Response(200, headers={'etag': '"v1"'}, content=pages['etag'])
+        return httpx.Response(200, content=pages['no-etag'])
+
+    def get_link(path):
+        return LinkCheckInput(id=1, page_url=f'https://donor-name1.com/{path}', link_url='https://project-name1.com/url/',
+                              anchor='anchor', page_url_domain_name='donor-name1.com',
+                              link_url_domain_name='project-name1.com')
+
+    async def get_link_check_ser(link, link_check_last=None):
+        linkchecker = LinkChecker(session=None)
+        if link_check_last is not None:
+            linkchecker.link_checks_last = {link.id: SimpleNamespace(**link_check_last.dict())}
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            link_check_ser, = await linkchecker.get_page_link_check_sers(client, [link])
+            return link_check_ser
+
+    for path in ('etag', 'no-etag'):
+        link_check_ser_1 = asyncio.run(get_link_check_ser(get_link(path)))
+        assert link_check_ser_1.status == 'green' and link_check_ser_1.check_mode is None
+        assert link_check_ser_1.content_hash is not None
+
+        link_check_ser_2 = asyncio.run(get_link_check_ser(get_link(path), link_check_ser_1))
+        assert link_check_ser_2.check_mode == 'cache'
+        assert link_check_ser_2.status == 'green' and link_check_ser_2.anchor_text_found == 'anchor'
+        assert link_check_ser_2.content_hash == link_check_ser_1.content_hash
+
+    assert link_check_ser_1.response_etag is None and link_check_ser_2.response_etag is None
+    pages['no-etag'] = page.replace(b'anchor<', b'other anchor<')
+    link_check_ser_3 = asyncio.run(get_link_check_ser(get_link('no-etag'), link_check_ser_1))
+    assert link_check_ser_3.check_mode is None and link_check_ser_3.status == 'red'
+
+    link_check_ser_1 = asyncio.run(get_link_check_ser(get_link('etag')))
+    link_edited = get_link('etag')._replace(anchor='other anchor')
+    link_check_ser_4 = asyncio.run(get_link_check_ser(link_edited, link_check_ser_1))
+    assert link_check_ser_4.check_mode is None and link_check_ser_4.status == 'red'
+
+
+def test_iter_linkcheck_ser_fetches_page_once_for_all_its_links():
+    """test links placed on the same page_url are checked with one request of the page, but each by its own data"""
+    requested_urls = []
+    page = b'''<html><body><a href="https://project-name1.com/url/">anchor 1</a>
+<a href="https://project-name2.com/url/" rel="sponsored">anchor 2</a></body></html>'''
+
+    def handler(request):
+        requested_urls.append(str(request.url))
+        return httpx.Response(200, content=page)
+
+    def get_link(id, project_num, anchor):
+        return LinkCheckInput(id=id, page_url='https://donor-name1.com/page', anchor=anchor,
+                              link_url=f'https://project-name{project_num}.com/url/',
+                              page_url_domain_name='donor-name1.com',
+                              link_url_domain_name=f'project-name{project_num}.com')
+
+    links = [get_link(1, 1, 'anchor 1'), get_link(2, 2, 'anchor 2'), get_link(3, 1, 'other anchor')]
+
+    async def collect():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return [link_check_ser async for link_check_ser in LinkChecker(session=None).iter_linkcheck_ser(client, links)]
+
+    link_check_sers = {link_check_ser.link_id: link_check_ser for link_check_ser in asyncio.run(collect())}
+    assert requested_urls == ['https://donor-name1.com/page']
+    assert link_check_sers[1].status == 'green'
+    assert link_check_sers[2].status == 'red' and link_check_sers[2].rel_has_sponsored
+    assert link_check_sers[3].status == 'red' and link_check_sers[3].anchor_text_found == 'anchor 1'
+
+
+def test_save_linkchecks_updates_links(session_in_memory):
+    """test linkchecks are inserted and link_check_last_* of their links are set from them"""
+    links = [LinkModel(page_url=f'https://donor-name1.com/{i}', link_url='https://project-name1.com/url/', anchor='a')
+             for i in range(3)]
+    session_in_memory.add_all(links)
+    session_in_memory.commit()
+    lcs_list = [
+        LinkCheckCreateSerializer(link_id=links[0].id, status='green', result_message='ok;\n'),
+        LinkCheckCreateSerializer(link_id=links[2].id, status='red', result_message='code: 404;\n', check_mode='cache'),
+    ]
+
+    linkchecks = link_checker.save_linkchecks(session_in_memory, lcs_list)
+    session_in_memory.expire_all()
+    assert [linkcheck.link_id for linkcheck in linkchecks] == [links[0].id, links[2].id]
+    assert links[0].link_check_last_id == linkchecks[0].id and links[0].link_check_last_status == 'green'
+    assert links[0].link_check_last_created_at == linkchecks[0].created_at
+    assert links[1].link_check_last_id is None
+    assert links[2].link_check_last.result_message == 'code: 404;\n' and links[2].link_check_last_check_mode == 'cache'
+
+
+def test_get_link_chunks_selects_link_check_inputs(session_in_memory):
+    """test
+    - link check inputs are selected with domain names of links by chunks, links without domains have None
+    - link check inputs are picklable
+    """
+    session = session_in_memory
+    pudomain = PageUrlDomainModel(name='donor-name1.com')
+    ludomain = LinkUrlDomainModel(name='project-name1.com')
+    session.add_all([
+        LinkModel(page_url='https://donor-name1.com/1', link_url='https://project-name1.com/url/', anchor='a',
+                  page_url_domain=pudomain, link_url_domain=ludomain),
+        LinkModel(page_url='https://donor-name1.com/2', link_url='https://project-name1.com/url/', anchor='b',
+                  page_url_domain=pudomain, link_url_domain=ludomain),
+        LinkModel(page_url='https://donor-name2.com/1', link_url='https://project-name1.com/url/', anchor='c'),
+    ])
+    session.commit()
+
+    link_chunks = list(get_link_chunks(session, LinkModel.anchor != 'b', chunk_size=1))
+    assert link_chunks == [
+        [LinkCheckInput(1, 'https://donor-name1.com/1', 'https://project-name1.com/url/', 'a',
+                        'donor-name1.com', 'project-name1.com', None)],
+        [LinkCheckInput(3, 'https://donor-name2.com/1', 'https://project-name1.com/url/', 'c', None, None, None)],
+    ]
+    assert pickle.loads(pickle.dumps(link_chunks)) == link_chunks
+
+
+def test_host_rate_limiter_backs_off_on_throttling():
+    """test
+    - requests to a host are delayed when its tokens are spent, other hosts are not
+    - on 429/503 rate of host is halved and host is blocked for Retry-After, or for doubling backoff without it
+    - other responses bring the rate back, Retry-After longer than backoff_max is not retried
+    """
+    rate_limiter = HostRateLimiter(rate=2, rate_min=0.5, backoff=1, backoff_max=10)
+
+    async def acquire(host, times):
+        for _ in range(times):
+            await rate_limiter.acquire(host)
+
+    asyncio.run(acquire('donor-name1.com', 2))
+    assert 0.4 < rate_limiter.get_delay('donor-name1.com') <= 0.5
+    assert rate_limiter.get_delay('donor-name2.com') == 0
+
+    assert rate_limiter.on_response('donor-name1.com', 503, retry_after='3') == 3
+    assert 2.9 < rate_limiter.get_delay('donor-name1.com') <= 3
+    assert rate_limiter.on_response('donor-name1.com', 429) == 2
+    assert rate_limiter.on_response('donor-name1.com', 429, retry_after='20') is None
+    assert rate_limiter.get_bucket('donor-name1.com').rate == 0.5
+    assert 9.9 < rate_limiter.get_delay('donor-name1.com') <= 10
+
+    assert rate_limiter.on_response('donor-name1.com', 200) is None
+    assert rate_limiter.get_bucket('donor-name1.com').rate == 0.7
+    assert rate_limiter.get_bucket('donor-name1.com').throttled_count == 0
+
+    assert get_retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert get_retry_after_seconds('soon') is None
+
+
+def test_host_rate_limiter_waiters_take_tokens_one_by_one(monkeypatch):
+    """test
+    - waiters of the same host don't take more tokens than there are, the host is requested not faster than rate
+    - waiters wait one by one, so they are not all woken to count tokens again when one token is refilled
+    """
+    rate_limiter = HostRateLimiter(rate=20)
+    acquired_at, tokens = [], []
+    get_delay = rate_limiter.get_delay
+    get_delay_calls = []
+    monkeypatch.setattr(rate_limiter, 'get_delay', lambda host: get_delay_calls.append(host) or get_delay(host))
+
+    async def acquire():
+        await rate_limiter.acquire('donor-name1.com')
+        acquired_at.append(time.monotonic())
+        tokens.append(rate_limiter.get_bucket('donor-name1.com').tokens)
+
+    async def acquire_all():
+        await asyncio.gather(*[acquire() for _ in range(30)])
+
+    asyncio.run(acquire_all())
+    assert min(tokens) >= 0
+    # burst of 20 at once, then 10 more at 20 per second
+    assert acquired_at[-1] - acquired_at[0] >= 0.45
+    # every waiter counts tokens once when it comes and once after its sleep, not after every other waiter's one
+    assert len(get_delay_calls) <= 30 + 10 + 5
+
+
+def test_get_page_link_check_sers_retries_throttled_page():
+    """test page throttled with 503 and Retry-After is requested again after it instead of being sent to playwright"""
+    response_codes = [503, 200]
+
+    def handler(request):
+        response_code = response_codes.pop(0)
+        if response_code == 503:
+            return httpx.Response(503, headers={'retry-after': '0.1'})
+        return httpx.Response(200, content=b'<a href="https://project-name1.com/url/">anchor</a>')
+
+    link = LinkCheckInput(id=1, page_url='https://donor-name1.com/page', link_url='https://project-name1.com/url/',
+                          anchor='anchor', page_url_domain_name='donor-name1.com',
+                          link_url_domain_name='project-name1.com')
+    linkchecker = LinkChecker(session=None, rate_limiter=HostRateLimiter(rate=10))
+
+    async def collect():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return [link_check_ser async for link_check_ser in linkchecker.iter_linkcheck_ser(client, [link])]
+
+    link_check_ser, = asyncio.run(collect())
+    assert link_check_ser.status == 'green' and link_check_ser.redirect_codes_list == '[200]'
+    assert not response_codes and not linkchecker.check_with_pw_link_ids
+
+
+PROXY_ORD_DICT = OrderedDict({'AT Austria, Vienna': ('10.0.2.9', 3128),
+                              'DE Germany, Berlin': ('10.0.2.10', 3128),
+                              'NL Netherlands, Amsterdam': ('10.0.2.11', 3128)})
+
+
+def test_proxy_manager_ranks_proxies_by_health():
+    """test
+    - proxies of equal health keep their order, failed ones go after successful ones, faster ones go first
+    - proxy failed dead_failures times in a row is skipped for cooldown
+    """
+    proxy_manager = ProxyManager(PROXY_ORD_DICT, alpha=0.5, dead_failures=2, cooldown=60)
+    at, de, nl = proxy_manager.get_healthy_proxies()
+    assert proxy_manager.get_healthy_proxies(2) == [at, de]
+
+    proxy_manager.on_failure(at)
+    proxy_manager.on_success(de, latency=2)
+    proxy_manager.on_success(nl, latency=1)
+    assert proxy_manager.get_healthy_proxies() == [nl, de, at]
+
+    proxy_manager.on_failure(at)
+    assert proxy_manager.get_healthy_proxies() == [nl, de]
+
+
+def test_get_page_link_check_sers_races_proxies(monkeypatch):
+    """test
+    - page is requested through all race proxies at once, the first answer is taken
+    - proxies which didn't answer are counted as failed, slower requests are cancelled and ranked after the first
+    """
+    proxy_manager = ProxyManager(PROXY_ORD_DICT, dead_failures=1)
+    at, de, nl = proxy_manager.get_healthy_proxies()
+    cancelled_proxies = []
+
+    def get_client(proxies_dict=None):
+        async def handler(request):
+            if proxies_dict == get_proxies_dict(at):
+                raise httpx.ConnectTimeout('timed out', request=request)
+            try:
+                await asyncio.sleep(0.01 if proxies_dict == get_proxies_dict(de) else 1)
+            except asyncio.CancelledError:
+                cancelled_proxies.append(proxies_dict['http://'])
+                raise
+            return httpx.Response(200, content=b'<a href="https://project-name1.com/url/">anchor</a>')
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr(link_checker.client_registry, 'get_client', get_client)
+    link = LinkCheckInput(id=1, page_url='https://donor-name1.com/page', link_url='https://project-name1.com/url/',
+                          anchor='anchor', page_url_domain_name='donor-name1.com',
+                          link_url_domain_name='project-name1.com')
+    linkchecker = LinkChecker(session=None, proxy_manager=proxy_manager)
+
+    async def get_link_check_ser():
+        link_check_ser, = await linkchecker.get_page_link_check_sers(None, [link], race_proxies=[at, de, nl])
+        return link_check_ser
+
+    link_check_ser = asyncio.run(get_link_check_ser())
+    assert link_check_ser.status == 'green'
+    assert cancelled_proxies == [get_proxies_dict(nl)['http://']]
+    assert proxy_manager.get_healthy_proxies() == [de, nl]
+
+
+def test_fetch_page_racing_proxies_raises_timeout(monkeypatch):
+    """test when none of race proxies answered, timeout is raised if any of them timed out,
+    though other ones failed after it"""
+    proxy_manager = ProxyManager(PROXY_ORD_DICT)
+    at, de, nl = proxy_manager.get_healthy_proxies()
+
+    def get_client(proxies_dict=None):
+        async def handler(request):
+            if proxies_dict == get_proxies_dict(at):
+                raise httpx.ReadTimeout('timed out', request=request)
+            await asyncio.sleep(0.01)
+            raise httpx.ConnectError('connection refused', request=request)
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr(link_checker.client_registry, 'get_client', get_client)
+    linkchecker = LinkChecker(session=None, proxy_manager=proxy_manager)
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(linkchecker.fetch_page_racing_proxies('https://donor-name1.com/page', {}, TIMEOUT_5,
+                                                          [at, de, nl]))
+
+
+def test_fetch_page_racing_proxies_skips_proxy_failure_responses(monkeypatch):
+    """test
+    - proxy answered with PROXY_FAILURE_RESPONSE_CODES loses the race and is counted as failed,
+      the race waits for the other proxies
+    - if all proxies answered so, the first proxy failure response is returned
+    """
+    proxy_manager = ProxyManager(PROXY_ORD_DICT, dead_failures=1)
+    at, de, nl = proxy_manager.get_healthy_proxies()
+    response_codes = {get_proxies_dict(at)['http://']: 502, get_proxies_dict(de)['http://']: 407,
+                      get_proxies_dict(nl)['http://']: 200}
+
+    def get_client(proxies_dict=None):
+        async def handler(request):
+            await asyncio.sleep(0.01 if proxies_dict == get_proxies_dict(at) else 0.05)
+            return httpx.Response(response_codes[proxies_dict['http://']])
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr(link_checker.client_registry, 'get_client', get_client)
+    linkchecker = LinkChecker(session=None, proxy_manager=proxy_manager)
+    page_response, proxy = asyncio.run(linkchecker.fetch_page_racing_proxies(
+        'https://donor-name1.com/page', {}, TIMEOUT_5, [at, de, nl]))
+    assert page_response.response_code == 200 and proxy == nl
+    assert proxy_manager.get_healthy_proxies() == [nl]
+
+    response_codes[get_proxies_dict(nl)['http://']] = 504
+    page_response, proxy = asyncio.run(linkchecker.fetch_page_racing_proxies(
+        'https://donor-name1.com/page', {}, TIMEOUT_5, [at, de, nl]))
+    assert page_response.response_code == 502 and proxy == at
+
+
+def test_get_check_risk():
+    """test just flipped links are checked hourly, stable old cheap greens weekly, not green ones about daily,
+    newness, price and flips of link and its donor shorten the interval"""
+    stable_green = dict(status='green', is_flipped=False, status_flip_rate=0, pudomain_flip_rate=0,
+                        link_age_days=365, price=None)
+    assert get_check_interval_hours(get_check_risk(**{**stable_green, 'is_flipped': True})) == 1
+    assert get_check_interval_hours(get_check_risk(**stable_green)) == 24 * 7
+    assert 20 < get_check_interval_hours(get_check_risk(**{**stable_green, 'status': 'red'})) < 24
+    for risky_field in ({'status_flip_rate': 0.3}, {'pudomain_flip_rate': 0.5},
+                        {'link_age_days': 1}, {'price': 100}):
+        assert get_check_risk(**{**stable_green, **risky_field}) > 0
+    assert get_check_risk(**{**stable_green, 'price': 1000}) > get_check_risk(**{**stable_green, 'price': 100})
+
+
+def test_link_schedules(session_in_memory):
+    """test
+    - links without schedule are due at once, dispatched links are not due again
+    - green links of the last check with playwright are dispatched to be checked with playwright
+    - next check time is moved by every check, just flipped link is checked in an hour
+    - stable green link of the last check with playwright is checked monthly
+    - schedule of link checked before it is dispatched is created by its check
+    """
+    session = session_in_memory
+    links = [LinkModel(page_url=f'https://donor-name1.com/{i}', link_url='https://project-name1.com/url/', anchor='a',
+                       created_at=datetime.datetime(2020, 1, 1))
+             for i in range(3)]
+    links[2].link_check_last_check_mode, links[2].link_check_last_status = 'playwright', 'green'
+    session.add_all(links)
+    session.commit()
+
+    assert lease_due_links(session) == ([links[0].id, links[1].id], [links[2].id])
+    assert lease_due_links(session) == ([], [])
+
+    checked_at = datetime.datetime(2023, 1, 1)
+    update_link_schedules(session, [SimpleNamespace(link_id=links[0].id, status='green', check_mode=None,
+                                                    created_at=checked_at)])
+    session.commit()
+    link_schedule = session.query(LinkScheduleModel).filter(LinkScheduleModel.link_id == links[0].id).one()
+    assert link_schedule.next_check_at == checked_at + datetime.timedelta(hours=24 * 7)
+    assert lease_due_links(session) == ([links[0].id], [])
+
+    update_link_schedules(session, [SimpleNamespace(link_id=links[0].id, status='red', check_mode=None,
+                                                    created_at=checked_at)])
+    session.commit()
+    assert link_schedule.next_check_at == checked_at + datetime.timedelta(hours=1)
+    assert link_schedule.status_flip_rate > 0 and link_schedule.last_status == 'red'
+
+    update_link_schedules(session, [SimpleNamespace(link_id=links[2].id, status='green', check_mode='playwright',
+                                                    created_at=checked_at)])
+    session.commit()
+    link_schedule = session.query(LinkScheduleModel).filter(LinkScheduleModel.link_id == links[2].id).one()
+    assert link_schedule.next_check_at == checked_at + datetime.timedelta(hours=24 * 30)
+
+    link_new = LinkModel(page_url='https://donor-name1.com/new', link_url='https://project-name1.com/url/', anchor='a',
+                         created_at=datetime.datetime(2020, 1, 1))
+    session.add(link_new)
+    session.commit()
+    update_link_schedules(session, [SimpleNamespace(link_id=link_new.id, status='green', check_mode=None,
+                                                    created_at=checked_at)])
+    session.commit()
+    link_schedule = session.query(LinkScheduleModel).filter(LinkScheduleModel.link_id == link_new.id).one()
+    assert link_schedule.next_check_at == checked_at + datetime.timedelta(hours=24 * 7)
+    assert link_schedule.last_status == 'green'
+
+
+def test_fake_donor_app():
+    """test
+    - benchmark fake donor page is redirected redirects times, then has hrefs of all its links
+    - page with status is answered with it
+    """
+
+    async def get_responses():
+        async with httpx.AsyncClient(app=fake_donor_app, follow_redirects=True) as client:
+            page_url = get_page_url('127.0.0.1', 80, 1, bytes=1024, redirects=2, href_prefix='https://acceptor.com/',
+                                    hrefs=2, anchor='acceptor')
+            return await client.get(page_url), await client.get(get_page_url('127.0.0.1', 80, 2, status=403))
+
+    response, forbidden_response = asyncio.run(get_responses())
+    assert [r.status_code for r in response.history] == [301, 301]
+    assert response.status_code == 200
+    assert '<a href="https://acceptor.com/0">acceptor</a>' in response.text
+    assert '<a href="https://acceptor.com/1">acceptor</a>' in response.text
+    assert forbidden_response.status_code == 403
+
+
+def get_stage_count(stage: str) -> float:
+    return REGISTRY.get_sample_value('link_checker_stage_seconds_count', {'stage': stage}) or 0.0
+
+
+def test_stage_metrics():
+    """test
+    - connect, tls_handshake and ttfb of httpx request are observed from its trace events
+    - parse and match of the page are observed, soup parser finds the same as scanner
+    - linkchecks are counted by status and check_mode (None is httpx), and exposed in prometheus format
+    """
+    stage_counts = {stage: get_stage_count(stage) for stage in ('connect', 'tls_handshake', 'ttfb', 'parse', 'match')}
+
+    async def trace_request(trace):
+        for event_name in ('connection.connect_tcp.started', 'connection.connect_tcp.complete',
+                           'connection.start_tls.started', 'connection.start_tls.complete',
+                           'http11.send_request_headers.started', 'http11.send_request_headers.complete',
+                           'http11.receive_response_headers.started', 'http11.receive_response_headers.complete',
+                           # reused connection: no connect, failed request: no ttfb
+                           'http2.send_request_headers.started', 'http2.receive_response_headers.failed'):
+            await trace(event_name, {})
+
+    asyncio.run(trace_request(HttpxStageTrace()))
+    assert get_stage_count('connect') == stage_counts['connect'] + 1
+    assert get_stage_count('tls_handshake') == stage_counts['tls_handshake'] + 1
+    assert get_stage_count('ttfb') == stage_counts['ttfb'] + 1
+
+    content = page_content.encode('utf-8')
+    assert asyncio.run(parse_page_async(content, [spec_1, spec_2])) == parse_page(content, [spec_1, spec_2])
+    assert parse_page(content, [spec_1, spec_2], parser='soup') == \
+        parse_page(content, [spec_1, spec_2], parser='scanner')
+    assert get_stage_count('parse') == stage_counts['parse'] + 1
+    assert get_stage_count('match') == stage_counts['match'] + 1
+
+    labels = {'status': 'green', 'check_mode': 'httpx'}
+    linkchecks_count = REGISTRY.get_sample_value('link_checker_linkchecks_total', labels) or 0.0
+    count_linkchecks([SimpleNamespace(status='green', check_mode=None), SimpleNamespace(status='red', check_mode=None)])
+    assert REGISTRY.get_sample_value('link_checker_linkchecks_total', labels) == linkchecks_count + 1
+    assert b'link_checker_linkchecks_total{check_mode="httpx",status="green"}' in get_metrics_latest()
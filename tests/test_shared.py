@@ -1,4 +1,5 @@
-from core.shared import get_year_month_period
+from core.shared import get_year_month_period, keyset_chunks_generator, keyset_ranges_generator
+from database.models.tag import TagModel
 
 year_month_period_from_october_2022_upto_feb_2023 = [
     (2022, 10),
@@ -35,3 +36,24 @@ def test_get_year_month_period():
     year_month_period = get_year_month_period({'year_from': 2022, 'month_from': 11,
                                                'year_upto': 2024, 'month_upto': 1})
     assert year_month_period == year_month_period_from_november_2022_upto_jan_2024
+
+
+def test_keyset_chunks_generator(session_in_memory):
+    """test query rows are yielded by chunks in order of key, and the filter of query is kept"""
+    session_in_memory.add_all([TagModel(name=f'tag{i}', ref_property='language' if i != 3 else 'country')
+                               for i in range(1, 7)])
+    session_in_memory.commit()
+    query = session_in_memory.query(TagModel).filter(TagModel.ref_property == 'language')
+
+    chunks = list(keyset_chunks_generator(query, TagModel.id, chunk_size=2))
+    assert [[tag.id for tag in chunk] for chunk in chunks] == [[1, 2], [4, 5], [6]]
+    assert list(keyset_chunks_generator(query, TagModel.id, chunk_size=5)) == [chunks[0] + chunks[1] + chunks[2]]
+
+
+def test_keyset_ranges_generator(session_in_memory):
+    session_in_memory.add_all([TagModel(name=f'tag{i}', ref_property='language' if i != 3 else 'country')
+                               for i in range(1, 7)])
+    session_in_memory.commit()
+    query = session_in_memory.query(TagModel).filter(TagModel.ref_property == 'language')
+
+    assert list(keyset_ranges_generator(query, TagModel.id, chunk_size=2)) == [(1, 2), (4, 5), (6, 6)]
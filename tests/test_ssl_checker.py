@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+import ssl
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from database.models.link_check import LinkCheckModel
+from database.models.page_url_domain import PageUrlDomainModel
+from services.ssl_checker import ssl_checker
+from services.ssl_checker.ssl_checker import (
+    get_ssl_expiration_date,
+    get_ssl_expiration_dates_cached,
+    update_linkchecks_ssl,
+    update_pudomains_ssl,
+)
+
+not_valid_after = datetime.datetime(2030, 1, 2, 3, 4, 5)
+
+
+def get_server_ssl_context(tmp_path) -> ssl.SSLContext:
+    """ssl context with self-signed certificate expiring at not_valid_after"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    certificate = x509.CertificateBuilder() \
+        .subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(datetime.datetime(2020, 1, 1)) \
+        .not_valid_after(not_valid_after) \
+        .sign(key, hashes.SHA256())
+    (tmp_path / 'cert.pem').write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    (tmp_path / 'key.pem').write_bytes(key.private_bytes(serialization.Encoding.PEM,
+                                                         serialization.PrivateFormat.PKCS8,
+                                                         serialization.NoEncryption()))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(tmp_path / 'cert.pem', tmp_path / 'key.pem')
+    return context
+
+
+async def pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def handle_connect(reader, writer):
+    """http proxy, which only tunnels CONNECT requests"""
+    request_head = await reader.readuntil(b'\r\n\r\n')
+    hostname, port = request_head.split()[1].decode().rsplit(':', 1)
+    upstream_reader, upstream_writer = await asyncio.open_connection(hostname, int(port))
+    writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+    await writer.drain()
+    await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+
+
+def test_get_ssl_expiration_date(tmp_path):
+    """test expiration date of self-signed certificate is got directly and through proxy tunnel,
+    and None is got from port without tls"""
+
+    async def get_ssl_expiration_dates():
+        async def handle_tls(reader, writer):
+            await reader.read()
+            writer.close()
+
+        tls_server = await asyncio.start_server(handle_tls, '127.0.0.1', 0, ssl=get_server_ssl_context(tmp_path))
+        proxy_server = await asyncio.start_server(handle_connect, '127.0.0.1', 0)
+        tls_port = tls_server.sockets[0].getsockname()[1]
+        proxy_port = proxy_server.sockets[0].getsockname()[1]
+        async with tls_server, proxy_server:
+            return (
+                await get_ssl_expiration_date('127.0.0.1', tls_port, proxy_url=None),
+                await get_ssl_expiration_date('127.0.0.1', tls_port, proxy_url=f'http://127.0.0.1:{proxy_port}'),
+                await get_ssl_expiration_date('127.0.0.1', proxy_port, proxy_url=None, timeout=1),
+            )
+
+    assert asyncio.run(get_ssl_expiration_dates()) == (not_valid_after, not_valid_after, None)
+
+
+def test_get_ssl_expiration_date_closes_tunnel_on_timeout(monkeypatch):
+    """test proxy tunnel is closed when tls handshake through it is not done in timeout"""
+    tunnel_writers = []
+    open_tunnel = ssl_checker.open_tunnel
+
+    async def open_tunnel_recorded(*args):
+        reader, writer = await open_tunnel(*args)
+        tunnel_writers.append(writer)
+        return reader, writer
+
+    monkeypatch.setattr(ssl_checker, 'open_tunnel', open_tunnel_recorded)
+
+    async def get_ssl_expiration_date_through_tunnel():
+        async def handle_silent(reader, writer):
+            await reader.read()
+            writer.close()
+
+        silent_server = await asyncio.start_server(handle_silent, '127.0.0.1', 0)
+        proxy_server = await asyncio.start_server(handle_connect, '127.0.0.1', 0)
+        silent_port = silent_server.sockets[0].getsockname()[1]
+        proxy_port = proxy_server.sockets[0].getsockname()[1]
+        async with silent_server, proxy_server:
+            return await get_ssl_expiration_date('127.0.0.1', silent_port, proxy_url=f'http://127.0.0.1:{proxy_port}',
+                                                 timeout=0.5)
+
+    assert asyncio.run(get_ssl_expiration_date_through_tunnel()) is None
+    tunnel_writer, = tunnel_writers
+    assert tunnel_writer.transport.is_closing()
+
+
+def test_update_linkchecks_ssl(session_in_memory):
+    linkchecks = [LinkCheckModel(status='green'), LinkCheckModel(status='green')]
+    session_in_memory.add_all(linkchecks)
+    session_in_memory.commit()
+
+    update_linkchecks_ssl(session_in_memory, {linkchecks[0].id: not_valid_after, linkchecks[1].id: None})
+    session_in_memory.expire_all()
+    assert linkchecks[0].ssl_expiration_date == not_valid_after and linkchecks[0].ssl_expires_in_days > 0
+    assert linkchecks[1].ssl_expiration_date is None and linkchecks[1].ssl_expires_in_days == -1
+
+
+def test_get_ssl_expiration_dates_cached(session_in_memory, monkeypatch):
+    """test
+    - fresh cached ssl expiration dates of page_url_domains are not probed
+    - stale, failed, expiring within SSL_EXPIRATION_DAYS and unknown ones are probed and then cached
+    - failed probe doesn't overwrite cached ssl expiration date and ssl_checked_at
+    """
+    now = datetime.datetime.utcnow()
+    session_in_memory.add_all([
+        PageUrlDomainModel(name='fresh.com', ssl_expiration_date=not_valid_after, ssl_checked_at=now),
+        PageUrlDomainModel(name='stale.com', ssl_expiration_date=not_valid_after,
+                           ssl_checked_at=now - datetime.timedelta(days=30)),
+        PageUrlDomainModel(name='failed.com', ssl_expiration_date=None, ssl_checked_at=now),
+        PageUrlDomainModel(name='expiring.com', ssl_expiration_date=now + datetime.timedelta(days=5),
+                           ssl_checked_at=now),
+    ])
+    session_in_memory.commit()
+    probed_hostnames = set()
+
+    async def get_ssl_expiration_dates(hostnames):
+        probed_hostnames.update(hostnames)
+        return {hostname: not_valid_after for hostname in hostnames}
+
+    monkeypatch.setattr(ssl_checker, 'get_ssl_expiration_dates', get_ssl_expiration_dates)
+    hostnames = ['fresh.com', 'stale.com', 'failed.com', 'expiring.com', 'unknown.com']
+    ssl_expiration_dates, ssl_expiration_dates_probed = asyncio.run(
+        get_ssl_expiration_dates_cached(session_in_memory, hostnames))
+    assert probed_hostnames == {'stale.com', 'failed.com', 'expiring.com', 'unknown.com'}
+    assert ssl_expiration_dates == {hostname: not_valid_after for hostname in hostnames}
+
+    update_pudomains_ssl(session_in_memory, ssl_expiration_dates_probed)
+    probed_hostnames.clear()
+    asyncio.run(get_ssl_expiration_dates_cached(session_in_memory, hostnames))
+    assert probed_hostnames == {'unknown.com'}
+
+    pudomain_stale = session_in_memory.query(PageUrlDomainModel).filter_by(name='stale.com').one()
+    ssl_checked_at = pudomain_stale.ssl_checked_at
+    update_pudomains_ssl(session_in_memory, {'stale.com': None})
+    session_in_memory.expire_all()
+    assert pudomain_stale.ssl_expiration_date == not_valid_after and pudomain_stale.ssl_checked_at == ssl_checked_at
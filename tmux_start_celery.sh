@@ -7,7 +7,13 @@ tmux start-server
 tmux new-session -d -s $session -n celery
 
 tmux selectp -t 1
-tmux send-keys "celery -A celery_app worker --loglevel=INFO" C-m
+tmux send-keys "celery -A celery_app worker --loglevel=INFO -Q interactive -n interactive@%h --concurrency=4 --prefetch-multiplier=1" C-m
+
+tmux splitw -v
+tmux send-keys "celery -A celery_app worker --loglevel=INFO -Q uploads,nightly -n bulk@%h --concurrency=2 --prefetch-multiplier=1" C-m
+
+tmux splitw -v
+tmux send-keys "celery -A celery_app worker --loglevel=INFO -Q playwright,celery -n default@%h --concurrency=2 --prefetch-multiplier=1" C-m
 
 tmux splitw -h
 tmux send-keys "docker start redis_tmux" C-m